@@ -1,18 +1,37 @@
+import asyncio
+import re
 from collections.abc import Awaitable, Callable, Mapping
 from typing import Any
 
 import structlog
 from matrix_bot.client import MatrixClient
 from matrix_bot.eventparser import MessageEventParser
-from nio import MatrixRoom, RoomMessage
+from nio import MatrixRoom, RoomGetEventResponse, RoomMessage, RoomSendError
 from typing_extensions import override
 
+from matrix_command_bot.aggregation import (
+    RESULT_EVENT_TYPE,
+    CommandResult,
+    ResultAggregator,
+)
 from matrix_command_bot.command import ICommand
-from matrix_command_bot.util import get_server_name, is_local_user, send_report
+from matrix_command_bot.step import ICommandStep
+from matrix_command_bot.step.reaction_steps import ReactionStep
+from matrix_command_bot.util import (
+    get_server_name,
+    is_email,
+    is_local_user,
+    is_user_id,
+    iter_file_lines,
+    send_report,
+)
 from matrix_command_bot.validation.simple_command import SimpleValidatedCommand
 
 logger = structlog.getLogger(__name__)
 
+# Beyond this, the users are only listed in the JSON report
+MAX_LISTED_USERS = 50
+
 
 class InteractiveValidatedCommand(SimpleValidatedCommand):
     def __init__(
@@ -71,6 +90,10 @@ class InteractiveValidatedCommand(SimpleValidatedCommand):
 
 
 class UserRelatedCommand(InteractiveValidatedCommand):
+    # Whether the worker bots send their results to the coordinator when
+    # `aggregate_results` is set, for the commands handling users of all servers
+    AGGREGATE_RESULTS = False
+
     def __init__(
         self,
         room: MatrixRoom,
@@ -84,15 +107,235 @@ class UserRelatedCommand(InteractiveValidatedCommand):
         self.transform_cmd_input_fct: (
             Callable[[type[ICommand], list[str]], Awaitable[list[str]]] | None
         ) = extra_config.get("transform_cmd_input_fct")  # pyright: ignore[reportAttributeAccessIssue]
+        self.nb_workers: int = extra_config.get("user_commands_nb_workers", 1)  # pyright: ignore[reportAttributeAccessIssue]
+
+        self.failed_user_ids: list[str] = []
 
     @override
     async def should_execute(self) -> bool:
         self.user_ids = self.command_text.split()
 
+        mxc_url = await self.get_attached_file_url()
+        if mxc_url:
+            user_ids_from_file = await self.get_user_ids_from_file(mxc_url)
+            if not user_ids_from_file and self.extra_config.get("is_coordinator", True):
+                await self.matrix_client.send_markdown_message(
+                    self.room.room_id,
+                    "Couldn't read any user from the attached file",
+                    reply_to=self.message.event_id,
+                    thread_root=self.message.event_id,
+                )
+            self.user_ids += user_ids_from_file
+        self.user_ids = list(dict.fromkeys(self.user_ids))
+
         if self.transform_cmd_input_fct:
             self.user_ids = await self.transform_cmd_input_fct(
                 self.__class__, self.user_ids
             )
         return any(
             is_local_user(user_id, self.server_name) for user_id in self.user_ids
+        ) or bool(self.get_worker_server_names())
+
+    @property
+    def is_aggregated_worker(self) -> bool:
+        return (
+            self.AGGREGATE_RESULTS
+            and bool(self.extra_config.get("aggregate_results"))
+            and not self.extra_config.get("is_coordinator", True)
+        )
+
+    def get_worker_server_names(self) -> set[str]:
+        """Servers of the users handled by the worker bots, when aggregating.
+
+        The users of servers without a worker bot are skipped, as without
+        aggregation.
+        """
+        result_aggregator: ResultAggregator | None = self.extra_config.get(
+            "result_aggregator"
+        )
+        if not self.AGGREGATE_RESULTS or not result_aggregator:
+            return set()
+        server_names = {
+            name
+            for name in map(get_server_name, filter(is_user_id, self.user_ids))
+            if name
+        }
+        return (server_names & result_aggregator.worker_server_names) - {
+            self.server_name
+        }
+
+    @override
+    async def create_steps(self) -> list[ICommandStep]:
+        steps = await super().create_steps()
+        if self.is_aggregated_worker:
+            # The coordinator reacts for every bot
+            return [step for step in steps if not isinstance(step, ReactionStep)]
+        return steps
+
+    async def send_results(self, failure_message: str) -> bool:
+        """Send the report and the users that couldn't be processed.
+
+        When aggregating, the worker bots send them to the coordinator instead,
+        which sends a single report and message for all the servers.
+        """
+        if self.json_report:
+            self.json_report["command"] = self.KEYWORD
+        if self.is_aggregated_worker:
+            await self.send_result_event(failure_message)
+            return not self.failed_user_ids
+
+        results: dict[str, CommandResult] = {}
+        missing_server_names: list[str] = []
+        result_aggregator: ResultAggregator | None = self.extra_config.get(
+            "result_aggregator"
+        )
+        worker_server_names = self.get_worker_server_names()
+        if result_aggregator and worker_server_names:
+            results = await result_aggregator.wait(
+                self.room.room_id, self.message.event_id, worker_server_names
+            )
+            self.merge_results(results)
+            missing_server_names = sorted(worker_server_names - results.keys())
+
+        if self.json_report:
+            await self.send_report()
+        await self.send_failed_user_ids(failure_message)
+        if missing_server_names:
+            await self.matrix_client.send_markdown_message(
+                self.room.room_id,
+                "No result received from the bots of: "
+                + ", ".join(missing_server_names),
+                reply_to=self.message.event_id,
+                thread_root=self.message.event_id,
+            )
+
+        return (
+            not self.failed_user_ids
+            and not missing_server_names
+            # The failed users of a worker are not merged when it sent them itself
+            and all(result.result for result in results.values())
+        )
+
+    async def send_failed_user_ids(self, failure_message: str) -> None:
+        if not self.failed_user_ids:
+            return
+        text = "\n".join(
+            [
+                failure_message,
+                "",
+                *self.format_user_ids(self.failed_user_ids),
+            ]
+        )
+        await self.matrix_client.send_markdown_message(
+            self.room.room_id,
+            text,
+            reply_to=self.message.event_id,
+            thread_root=self.message.event_id,
+        )
+
+    async def send_result_event(self, failure_message: str) -> None:
+        result = CommandResult(
+            self.server_name or "",
+            not self.failed_user_ids,
+            self.failed_user_ids,
+            self.json_report or None,
+        )
+        content = result.to_content(self.message.event_id)
+        if "failed_user_ids" not in content:
+            # Too large to be sent in the event
+            if self.json_report:
+                await self.send_report()
+            await self.send_failed_user_ids(failure_message)
+        resp = await self.matrix_client.room_send(
+            self.room.room_id, RESULT_EVENT_TYPE, content
+        )
+        if isinstance(resp, RoomSendError):
+            logger.warning(
+                "Cannot send the command result to the coordinator",
+                error=resp.message,
+                status_code=resp.status_code,
+            )
+
+    def merge_results(self, results: Mapping[str, CommandResult]) -> None:
+        servers: dict[str, Any] = {
+            self.server_name or "": {"result": not self.failed_user_ids}
+        }
+        for server_name, result in sorted(results.items()):
+            if result.report is not None:
+                self.json_report.update(result.report)
+            self.failed_user_ids += result.failed_user_ids
+            servers[server_name] = {
+                "result": result.result,
+                "report": "merged" if result.report is not None else "uploaded",
+            }
+        for server_name in self.get_worker_server_names() - results.keys():
+            servers[server_name] = {"result": None}
+        self.json_report["command"] = self.KEYWORD
+        self.json_report["servers"] = servers
+
+    async def get_attached_file_url(self) -> str | None:
+        """Return the url of the `m.file` the command replies to, if any."""
+        replied_event_id = (
+            self.message.source.get("content", {})
+            .get("m.relates_to", {})
+            .get("m.in_reply_to", {})
+            .get("event_id")
+        )
+        if not replied_event_id:
+            return None
+
+        resp = await self.matrix_client.room_get_event(
+            self.room.room_id, replied_event_id
         )
+        if not isinstance(resp, RoomGetEventResponse):
+            return None
+        content = resp.event.source.get("content", {})
+        if content.get("msgtype") != "m.file":
+            return None
+        return content.get("url")
+
+    async def get_user_ids_from_file(self, mxc_url: str) -> list[str]:
+        """Read the user ids or emails of a CSV or newline separated file."""
+        user_ids: list[str] = []
+        async for line in iter_file_lines(self.matrix_client, mxc_url):
+            for value in re.split(r"[\s,;]+", line):
+                user_id = value.strip("\"'")
+                # Skip the headers and the other columns
+                if is_user_id(user_id) or is_email(user_id):
+                    user_ids.append(user_id)
+        return user_ids
+
+    def format_user_ids(self, user_ids: list[str]) -> list[str]:
+        lines = [f"- {user_id}" for user_id in user_ids[:MAX_LISTED_USERS]]
+        if len(user_ids) > MAX_LISTED_USERS:
+            lines.append(f"- ... and {len(user_ids) - MAX_LISTED_USERS} more")
+        return lines
+
+    async def process_users(self, fct: Callable[[str], Awaitable[bool]]) -> list[bool]:
+        """Run `fct` on every user with at most `nb_workers` users in flight.
+
+        Results are returned in the order of `user_ids` and `failed_user_ids`
+        is sorted the same way, so the outcome does not depend on which
+        request finished first.
+        """
+        # Processing the same user twice concurrently would mix up its report
+        user_ids = list(dict.fromkeys(self.user_ids))
+        results: list[bool] = [False] * len(user_ids)
+        pending = iter(enumerate(user_ids))
+
+        async def worker() -> None:
+            for index, user_id in pending:
+                # An error must not stop the other users, nor leave their workers
+                # running unawaited
+                try:
+                    results[index] = await fct(user_id)
+                except Exception as e:  # noqa: BLE001
+                    logger.warning("Cannot process %s", user_id, exc_info=e)
+                    self.failed_user_ids.append(user_id)
+
+        nb_workers = max(1, min(self.nb_workers, len(user_ids)))
+        await asyncio.gather(*[worker() for _ in range(nb_workers)])
+
+        order = {user_id: index for index, user_id in enumerate(user_ids)}
+        self.failed_user_ids.sort(key=lambda user_id: order.get(user_id, len(order)))
+        return results
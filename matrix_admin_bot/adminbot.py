@@ -1,3 +1,4 @@
+import time
 from collections.abc import Mapping
 from typing import Any
 
@@ -35,6 +36,11 @@ from matrix_admin_bot.commands.next.user_v2 import UserCommandV2
 from matrix_admin_bot.commands.ping import PingCommand
 from matrix_command_bot.command import ICommand
 from matrix_command_bot.commandbot import CommandBot, Role
+from matrix_command_bot.report import report_config
+from matrix_command_bot.scheduler import CommandScheduler, ScheduledCommand
+from matrix_command_bot.store import SQLiteCommandStore
+from matrix_command_bot.tracing import FileSpanExporter, tracing_config
+from matrix_command_bot.util import get_server_name
 from matrix_command_bot.validation.validators.totp import TOTPValidator
 
 
@@ -59,6 +65,8 @@ def get_command_list() -> list[type[ICommand]]:
 
 
 class HelpCommand(ICommand):
+    KEYWORD = "help"
+
     def __init__(
         self,
         room: MatrixRoom,
@@ -71,7 +79,7 @@ class HelpCommand(ICommand):
             room=room, event=message, matrix_client=matrix_client
         )
         event_parser.do_not_accept_own_message()
-        event_parser.command("help")
+        event_parser.command(self.KEYWORD)
 
     @override
     async def execute(self) -> bool:
@@ -82,9 +90,8 @@ class HelpCommand(ICommand):
                 "more information about a specific command:\n\n"
             )
             for command in get_command_list():
-                keyword = getattr(command, "KEYWORD", None)
-                if keyword:
-                    help_message += f"- **!{keyword}**\n"
+                if command.KEYWORD:
+                    help_message += f"- **!{command.KEYWORD}**\n"
             await self.matrix_client.send_markdown_message(
                 self.room.room_id,
                 help_message,
@@ -92,6 +99,54 @@ class HelpCommand(ICommand):
         return True
 
 
+class QueueCommand(ICommand):
+    KEYWORD = "queue"
+
+    def __init__(
+        self,
+        room: MatrixRoom,
+        message: RoomMessage,
+        matrix_client: MatrixClient,
+        extra_config: Mapping[str, Any],
+    ) -> None:
+        super().__init__(room, message, matrix_client, extra_config)
+        event_parser = MessageEventParser(
+            room=room, event=message, matrix_client=matrix_client
+        )
+        event_parser.do_not_accept_own_message()
+        event_parser.command(self.KEYWORD)
+
+    @staticmethod
+    def format_commands(title: str, scheduled_commands: list[ScheduledCommand]) -> str:
+        now = time.monotonic()
+        message = f"{title}: {len(scheduled_commands)}\n"
+        for scheduled in scheduled_commands:
+            message += (
+                f"- {scheduled.command.__class__.__name__} "
+                f"from {scheduled.command.message.sender} "
+                f"since {round(now - scheduled.since)}s\n"
+            )
+        return message
+
+    @override
+    async def execute(self) -> bool:
+        scheduler: CommandScheduler | None = self.extra_config.get("scheduler")  # pyright: ignore[reportAttributeAccessIssue]
+        if scheduler is None:
+            return False
+        # Each bot of a multi-bot setup answers with its own queue
+        message = (
+            f"Commands on {get_server_name(self.matrix_client.user_id)}:\n\n"
+            + self.format_commands("Running", scheduler.running)
+            + self.format_commands("Queued", scheduler.queued)
+        )
+        await self.matrix_client.send_markdown_message(
+            self.room.room_id,
+            message,
+            reply_to=self.message.event_id,
+        )
+        return True
+
+
 class RoleModel(BaseModel):
     all_commands: bool = False
     allowed_commands: list[str] = []
@@ -107,12 +162,39 @@ class AdminBotConfig(BaseSettings):
     bot_password: str = ""
     mas_base_url: str = ""
     mas_access_token: str = ""
+    mas_max_connections: int = 10
+    mas_page_size: int = 100
+    mas_rate_limit: float = 0
+    synapse_rate_limit: float = 0
+    synapse_max_connections: int = 10
+    interactive_reserved_connections: int = 2
     allowed_room_ids: list[str] = []
     totps: dict[str, str] = {}
     is_coordinator: bool = True
     roles: dict[str, RoleModel] = {}
     server_notice_limit: int = 100
     server_notice_nb_workers: int = 1
+    server_notice_rate: float = 10
+    server_notice_max_rate: float = 0
+    server_notice_progress_interval: float = 5
+    server_notice_checkpoint_dir: str | None = None
+    user_commands_nb_workers: int = 4
+    max_running_commands: int = 10
+    max_running_commands_per_type: dict[str, int] = {"ServerNoticeCommandV2": 1}
+    command_store_path: str | None = None
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 0
+    trace_file: str | None = None
+    aggregate_results: bool = False
+    worker_user_ids: list[str] = []
+    aggregation_timeout: float = 300
+    blocked_loop_threshold: float = 0
+    cache_ttl: float = 24 * 60 * 60
+    commands_cache_size: int = 5120
+    related_commands_cache_size: int = 5120
+    events_cache_max_bytes: int = 4 * 1024 * 1024
+    report_compression: str | None = None
+    report_json_lines: bool = False
 
     @classmethod
     @override
@@ -133,6 +215,31 @@ class AdminBotConfig(BaseSettings):
         )
 
 
+def get_roles(
+    config: AdminBotConfig, all_commands: list[type[ICommand]]
+) -> dict[str, list[Role]]:
+    roles: dict[str, list[Role]] = {}
+
+    commands_dict = {c.__name__: c for c in all_commands}
+    for role_name, role_model in config.roles.items():
+        allowed_commands: list[type[ICommand]] = []
+        for allowed_command_str in role_model.allowed_commands:
+            allowed_cmd = commands_dict.get(allowed_command_str)
+            if allowed_cmd:
+                allowed_commands.append(allowed_cmd)
+
+        role = Role(
+            role_name,
+            role_model.all_commands,
+            allowed_commands,
+            role_model.allow_other_users_interaction,
+        )
+
+        for user_id in role_model.user_ids:
+            roles.setdefault(user_id, []).append(role)
+    return roles
+
+
 class AdminBot(CommandBot):
     def __init__(
         self,
@@ -142,32 +249,40 @@ class AdminBot(CommandBot):
         if "validator" not in extra_config:
             extra_config["validator"] = TOTPValidator(config.totps)
         bot_lib_config.allowed_room_ids = config.allowed_room_ids
-        if "server_notice_limit" not in extra_config:
-            extra_config["server_notice_limit"] = config.server_notice_limit
-        if "server_notice_nb_workers" not in extra_config:
-            extra_config["server_notice_nb_workers"] = config.server_notice_nb_workers
-
-        roles: dict[str, list[Role]] = {}
-
-        command_list = get_command_list()
-        all_commands = [*command_list, HelpCommand]
-        commands_dict = {c.__name__: c for c in all_commands}
-        for role_name, role_model in config.roles.items():
-            allowed_commands: list[type[ICommand]] = []
-            for allowed_command_str in role_model.allowed_commands:
-                allowed_cmd = commands_dict.get(allowed_command_str)
-                if allowed_cmd:
-                    allowed_commands.append(allowed_cmd)
-
-            role = Role(
-                role_name,
-                role_model.all_commands,
-                allowed_commands,
-                role_model.allow_other_users_interaction,
+        report_config.compression = config.report_compression
+        report_config.json_lines = config.report_json_lines
+        if config.trace_file:
+            tracing_config.exporter = FileSpanExporter(config.trace_file)
+        for key in (
+            "server_notice_limit",
+            "server_notice_nb_workers",
+            "server_notice_checkpoint_dir",
+            "server_notice_progress_interval",
+            "user_commands_nb_workers",
+            "cache_ttl",
+            "commands_cache_size",
+            "related_commands_cache_size",
+            "events_cache_max_bytes",
+            "metrics_host",
+            "metrics_port",
+            "blocked_loop_threshold",
+            "aggregate_results",
+            "worker_user_ids",
+            "aggregation_timeout",
+        ):
+            if key not in extra_config:
+                extra_config[key] = getattr(config, key)
+        if "scheduler" not in extra_config:
+            extra_config["scheduler"] = CommandScheduler(
+                config.max_running_commands, config.max_running_commands_per_type
+            )
+        if "command_store" not in extra_config and config.command_store_path:
+            extra_config["command_store"] = SQLiteCommandStore(
+                config.command_store_path
             )
 
-            for user_id in role_model.user_ids:
-                roles.setdefault(user_id, []).append(role)
+        all_commands = [*get_command_list(), HelpCommand, QueueCommand]
+        roles = get_roles(config, all_commands)
         super().__init__(
             homeserver=config.homeserver,
             username=config.bot_username,
@@ -190,8 +305,25 @@ class AdminBot(CommandBot):
                 synapse_client=self.matrix_client,
                 mas_base_url=config.mas_base_url,
                 mas_access_token=config.mas_access_token,
+                max_connections=config.mas_max_connections,
+                page_size=config.mas_page_size,
+                mas_rate_limit=config.mas_rate_limit,
+                synapse_rate_limit=config.synapse_rate_limit,
+                synapse_max_connections=config.synapse_max_connections,
+                interactive_reserved_connections=config.interactive_reserved_connections,
+                server_notice_rate=config.server_notice_rate,
+                server_notice_max_rate=config.server_notice_max_rate,
             )
 
+    @override
+    async def main(self) -> None:
+        try:
+            await super().main()
+        finally:
+            admin_client: AdminClient | None = self.extra_config.get("admin_client")
+            if admin_client:
+                await admin_client.close()
+
 
 def main() -> None:
     config = AdminBotConfig()
@@ -1,19 +1,68 @@
 import asyncio
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Any
 from zoneinfo import ZoneInfo
 
-import requests
+import aiohttp
 import structlog
 from aiohttp import ClientResponse
 from matrix_bot.client import MatrixClient
-from requests import Response
 
+from matrix_admin_bot.commands.next.priority import PrioritySemaphore
+from matrix_admin_bot.commands.next.rate_limiter import (
+    AdaptiveRateLimiter,
+    RateLimiter,
+)
+from matrix_command_bot.metrics import get_endpoint_label, registry
 from matrix_command_bot.util import get_localpart_from_id
 
 logger = structlog.getLogger(__name__)
 
 VERIFY_SSL_CERT = True
+KEEPALIVE_TIMEOUT = 30
+
+admin_api_requests_total = registry.counter(
+    "matrix_admin_bot_admin_api_requests_total",
+    "Requests sent to the admin APIs",
+    ("target", "method", "endpoint", "status"),
+)
+admin_api_request_duration = registry.histogram(
+    "matrix_admin_bot_admin_api_request_duration_seconds",
+    "Duration of the admin API requests, waits for a connection slot excluded",
+    ("target", "method", "endpoint"),
+)
+admin_api_retries_total = registry.counter(
+    "matrix_admin_bot_admin_api_retries_total",
+    "Admin API requests sent again after a failure",
+    ("target", "endpoint"),
+)
+
+
+def record_request(
+    target: str, method: str, endpoint: str, start: float, status: str
+) -> None:
+    labels = (target, method, get_endpoint_label(endpoint))
+    admin_api_request_duration.observe(time.perf_counter() - start, *labels)
+    admin_api_requests_total.inc(*labels, status)
+
+
+class MASError(Exception):
+    def __init__(self, status: int | None, description: Any) -> None:  # noqa: ANN401
+        super().__init__(f"MAS request failed with status {status}: {description}")
+        self.status = status
+        self.description = description
+
+
+@dataclass
+class UserSnapshot:
+    mas_user_id: str
+    devices: list[dict[str, Any]] = field(default_factory=list)
+    compat_sessions: list[dict[str, Any]] = field(default_factory=list)
+    user_sessions: list[dict[str, Any]] = field(default_factory=list)
+    oauth2_sessions: list[dict[str, Any]] = field(default_factory=list)
 
 
 class AdminClient:
@@ -26,24 +75,127 @@ class AdminClient:
         synapse_client: MatrixClient,
         mas_base_url: str,
         mas_access_token: str,
+        max_connections: int = 10,
+        page_size: int = 100,
+        mas_rate_limit: float = 0,
+        synapse_rate_limit: float = 0,
+        server_notice_rate: float = 10,
+        server_notice_max_rate: float = 0,
+        synapse_max_connections: int = 10,
+        interactive_reserved_connections: int = 2,
     ) -> None:
         self.base_url = mas_base_url.rstrip("/")
         self.access_token = mas_access_token
+        self.max_connections = max_connections
+        self.page_size = page_size
+
+        # Requests per second budget of each target, shared by all the commands
+        self.mas_rate_limiter = RateLimiter(mas_rate_limit)
+        self.synapse_rate_limiter = RateLimiter(synapse_rate_limit)
+        # Requests in flight to each target, some of them kept for the
+        # interactive commands so that they are not stuck behind bulk jobs
+        self.mas_dispatcher = PrioritySemaphore(
+            max_connections, interactive_reserved_connections
+        )
+        self.synapse_dispatcher = PrioritySemaphore(
+            synapse_max_connections, interactive_reserved_connections
+        )
+        # Adjusted to what Synapse sustains, shared by all the server notice workers
+        self.server_notice_rate_limiter = AdaptiveRateLimiter(
+            server_notice_rate, max_rate=server_notice_max_rate or None
+        )
 
         self.synapse_client = synapse_client
-        self.session = requests.Session()
-        self.session.headers.update(
-            {
-                "Accept": "application/json",
-                "User-Agent": "matrix-admin-bot",
-                "Authorization": f"Bearer {self.access_token}",
-            }
-        )
-        self.session.verify = VERIFY_SSL_CERT
+        # The session is created lazily since it needs a running event loop
+        self.session: aiohttp.ClientSession | None = None
+
+    def get_mas_session(self) -> aiohttp.ClientSession:
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                headers={
+                    "Accept": "application/json",
+                    "User-Agent": "matrix-admin-bot",
+                    "Authorization": f"Bearer {self.access_token}",
+                },
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_connections,
+                    keepalive_timeout=KEEPALIVE_TIMEOUT,
+                    ssl=VERIFY_SSL_CERT,
+                ),
+            )
+        return self.session
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
 
-    def send_to_mas(self, method: str, endpoint: str, **kwargs: Any) -> Response:  # noqa: ANN401
+    async def send_to_mas(
+        self,
+        method: str,
+        endpoint: str,
+        **kwargs: Any,  # noqa: ANN401
+    ) -> ClientResponse:
         url = f"{self.base_url}" + endpoint
-        return self.session.request(method, url, **kwargs)
+        async with self.mas_dispatcher:
+            await self.mas_rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                resp = await self.get_mas_session().request(method, url, **kwargs)
+                # Read the body right away so the connection goes back to the pool
+                await resp.read()
+            except Exception:
+                record_request("mas", method, endpoint, start, "error")
+                raise
+            record_request("mas", method, endpoint, start, str(resp.status))
+        return resp
+
+    async def iter_mas_pages(
+        self,
+        endpoint: str,
+        params: dict[str, Any] | None = None,
+        page_size: int | None = None,
+        max_retry: int | None = None,
+    ) -> AsyncIterator[dict[str, Any]]:
+        """Yield the pages of a MAS JSON:API list, following the `links.next` cursor.
+
+        Each page is tried up to max_retry times when it is set.
+        Raises MASError if a page can't be retrieved.
+        """
+        page_params: dict[str, Any] | None = {
+            **(params or {}),
+            "page[first]": page_size or self.page_size,
+        }
+        next_endpoint: str | None = endpoint
+        while next_endpoint:
+            resp = (
+                await self.send_to_mas_with_retry(
+                    next_endpoint, max_retry, params=page_params
+                )
+                if max_retry
+                else await self.send_to_mas(
+                    "GET", endpoint=next_endpoint, params=page_params
+                )
+            )
+            json_body = await self.decode_response(resp)
+            if resp is None or not resp.ok:
+                raise MASError(resp.status if resp else None, json_body)
+            yield json_body
+
+            # The next link already carries the filters and the page size
+            next_endpoint = (json_body.get("links") or {}).get("next")
+            page_params = None
+
+    async def iter_mas_items(
+        self,
+        endpoint: str,
+        params: dict[str, Any] | None = None,
+        page_size: int | None = None,
+    ) -> AsyncIterator[dict[str, Any]]:
+        """Yield the resources of all the pages of a MAS JSON:API list."""
+        async for page in self.iter_mas_pages(endpoint, params, page_size):
+            for item in page.get("data", []):
+                yield item
 
     async def send_to_synapse(
         self,
@@ -61,9 +213,18 @@ class AdminClient:
                 "Authorization": f"Bearer {self.access_token}",
             }
         )
-        return await self.synapse_client.send(
-            method, endpoint, headers=headers, **kwargs
-        )
+        async with self.synapse_dispatcher:
+            await self.synapse_rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                resp = await self.synapse_client.send(
+                    method, endpoint, headers=headers, **kwargs
+                )
+            except Exception:
+                record_request("synapse", method, endpoint, start, "error")
+                raise
+            record_request("synapse", method, endpoint, start, str(resp.status))
+            return resp
 
     async def is_email_valid(
         self, server_name: str | None, email: str | None
@@ -90,7 +251,7 @@ class AdminClient:
     ) -> str | None:
         username = get_localpart_from_id(user_id)
         endpoint = f"/api/admin/v1/users/by-username/{username}"
-        resp = self.send_to_mas("GET", endpoint=endpoint)
+        resp = await self.send_to_mas("GET", endpoint=endpoint)
 
         json_body = await self.decode_response(resp)
         if not resp.ok:
@@ -104,82 +265,73 @@ class AdminClient:
 
     async def get_users(
         self, server_name: str | None, json_report: dict[str, Any], limit: int = 100
-    ) -> set[str]:
+    ) -> AsyncIterator[str]:
+        """Yield the ids of the active users as the MAS pages are retrieved.
+
+        Once the enumeration is over, the number of yielded users is checked against
+        the count announced by MAS and any failure is reported in
+        json_report["details"]["get_users"].
+        """
         if server_name is None:
-            return set()
+            return
 
-        users: set[str] = set()
-        endpoint = f"/api/admin/v1/users?filter[status]=active&page[first]={limit}"
-        resp = await self.send_to_mas_with_retry(endpoint)
-        json_body = await self.decode_response(resp)
-        if not resp.ok:
-            error = "Cannot get all users from MAS"
+        nb_retrieved = 0
+        nb_users = 0
+        error = "Cannot get all users from MAS"
+        try:
+            async for page in self.iter_mas_pages(
+                "/api/admin/v1/users",
+                {"filter[status]": "active"},
+                page_size=limit,
+                max_retry=5,
+            ):
+                # Update user count
+                meta = page.get("meta") or {}
+                if meta.get("count"):
+                    nb_users = meta["count"]
+                    json_report["details"]["nb_users"] = nb_users
+                for user in page["data"]:
+                    if user["type"] == "user":
+                        nb_retrieved += 1
+                        yield f"@{user['attributes']['username']}:{server_name}"
+        except MASError as e:
             json_report["details"]["get_users"] = {
                 "error": error,
-                "description": json_body,
+                "description": e.description,
             }
             logger.warning(
                 "%s - %s users has been retrieved: %s",
                 error,
-                len(users),
-                f"{resp.status_code}-{resp.reason}-{json_body}",
+                nb_retrieved,
+                f"{e.status}-{e.description}",
             )
-            return users
-
-        nb_users = 0
-        if json_body.get("meta") and json_body.get("meta").get("count"):
-            nb_users = json_body["meta"]["count"]
-
-        while True:
-            users = users | {
-                f"@{user['attributes']['username']}:{server_name}"
-                for user in json_body["data"]
-                if user["type"] == "user"
-            }
-            # Update user count
-            if json_body.get("meta") and json_body.get("meta").get("count"):
-                nb_users = json_body["meta"]["count"]
-            if json_body.get("links") and json_body.get("links").get("next"):
-                endpoint = json_body["links"]["next"]
-                resp = await self.send_to_mas_with_retry(endpoint)
-                json_body = await self.decode_response(resp)
-                if not resp.ok:
-                    error = "Cannot get all users from MAS"
-                    json_report["details"]["get_users"] = {
-                        "error": error,
-                        "description": json_body,
-                    }
-                    logger.warning(
-                        "%s - %s users has been retrieved: %s",
-                        error,
-                        len(users),
-                        f"{resp.status_code}-{resp.reason}-{json_body}",
-                    )
-                    return set()
-            else:
-                break
+            return
 
         # Check if we have retrieve all users
-        if nb_users > len(users):
+        if nb_users > nb_retrieved:
             logger.warning(
-                "Not all users have been retrieved : %s/%s users", len(users), nb_users
+                "Not all users have been retrieved : %s/%s users",
+                nb_retrieved,
+                nb_users,
             )
-            error = "Cannot get all users from MAS"
             json_report["details"]["get_users"] = {
                 "error": error,
                 "description": f"Not all users have been retrieved : "
-                f"{len(users)}/{nb_users} users",
+                f"{nb_retrieved}/{nb_users} users",
             }
-            return set()
-
-        return users
 
     async def send_to_mas_with_retry(
-        self, endpoint: str, max_retry: int = 5
-    ) -> Response:
+        self,
+        endpoint: str,
+        max_retry: int = 5,
+        **kwargs: Any,  # noqa: ANN401
+    ) -> ClientResponse | None:
+        resp = None
         for retry_nb in range(max_retry):
+            if retry_nb:
+                admin_api_retries_total.inc("mas", get_endpoint_label(endpoint))
             try:
-                resp = self.send_to_mas("GET", endpoint=endpoint)
+                resp = await self.send_to_mas("GET", endpoint=endpoint, **kwargs)
                 if resp.ok:
                     return resp
             except Exception as e:  # noqa: BLE001
@@ -187,15 +339,14 @@ class AdminClient:
                 # use some backoff
                 await asyncio.sleep(0.5 * retry_nb)
 
-        resp = Response()
-        resp.status_code = 500
-        resp.reason = "Internal Server Error"
         return resp
 
-    async def decode_response(self, resp: Response) -> Any:  # noqa: ANN401
+    async def decode_response(self, resp: ClientResponse | None) -> Any:  # noqa: ANN401
+        if resp is None:
+            return "No response from MAS"
         if resp.headers.get("Content-Type", "").startswith("application/json") is True:
-            return resp.json()
-        return resp.text
+            return await resp.json()
+        return await resp.text()
 
     async def decode_client_response(self, resp: ClientResponse) -> Any:  # noqa: ANN401
         if resp.headers.get("Content-Type", "").startswith("application/json") is True:
@@ -204,7 +355,7 @@ class AdminClient:
 
     async def get_devices_from_synapse(
         self, json_report: dict[str, Any], user_id: str
-    ) -> None:
+    ) -> list[dict[str, Any]]:
         endpoint = f"/_synapse/admin/v2/users/{user_id}/devices"
         resp = await self.send_to_synapse(
             "GET",
@@ -214,6 +365,42 @@ class AdminClient:
             json_body = await resp.json()
             json_report[user_id]["devices"] = json_body.get("devices", [])
             logger.info("Devices : %s", json_report[user_id]["devices"])
+            return json_report[user_id]["devices"]
+        return []
+
+    async def get_user_snapshot(
+        self, json_report: dict[str, Any], failed_user_ids: list[str], user_id: str
+    ) -> UserSnapshot | None:
+        """Fetch the devices and the active MAS sessions of a user.
+
+        Independent reads are sent concurrently: the Synapse devices together
+        with the MAS user id, then the 3 session types which need the MAS user
+        id. Everything is also added to `json_report` as the individual getters
+        do. Returns None if the user can't be found in MAS.
+        """
+        devices, mas_user_id = await asyncio.gather(
+            self.get_devices_from_synapse(json_report, user_id),
+            self.get_mas_user_id(json_report, failed_user_ids, user_id),
+        )
+        if mas_user_id is None:
+            return None
+
+        compat_sessions, user_sessions, oauth2_sessions = await asyncio.gather(
+            self.get_compat_sessions(
+                json_report, failed_user_ids, mas_user_id, user_id
+            ),
+            self.get_user_sessions(json_report, failed_user_ids, mas_user_id, user_id),
+            self.get_oauth2_sessions(
+                json_report, failed_user_ids, mas_user_id, user_id
+            ),
+        )
+        return UserSnapshot(
+            mas_user_id=mas_user_id,
+            devices=devices,
+            compat_sessions=compat_sessions,
+            user_sessions=user_sessions,
+            oauth2_sessions=oauth2_sessions,
+        )
 
     async def get_user_from_synapse(
         self, json_report: dict[str, Any], failed_user_ids: list[str], user_id: str
@@ -247,26 +434,10 @@ class AdminClient:
         failed_user_ids: list[str],
         mas_user_id: str,
         user_id: str,
-    ) -> None:
-        params = {"filter[user]": mas_user_id, "filter[status]": "active"}
-        endpoint = "/api/admin/v1/compat-sessions"
-        resp = self.send_to_mas("GET", endpoint=endpoint, params=params)
-        json_body = await self.decode_response(resp)
-        if resp.ok:
-            count = json_body["meta"]["count"]
-            if count > 0:
-                sessions = json_body["data"]
-                json_report[user_id]["sessions"]["compat-sessions"] = sessions
-                logger.debug(
-                    "Compat-Sessions : %s",
-                    json_report[user_id]["sessions"]["compat-sessions"],
-                )
-        else:
-            error = f"Cannot get compat session  from localpart {user_id}"
-            json_report[user_id]["errors"].append(
-                {"error": error, "description": json_body}
-            )
-            failed_user_ids.append(user_id)
+    ) -> list[dict[str, Any]]:
+        return await self.get_sessions(
+            "compat-sessions", json_report, failed_user_ids, mas_user_id, user_id
+        )
 
     async def get_user_sessions(
         self,
@@ -274,26 +445,10 @@ class AdminClient:
         failed_user_ids: list[str],
         mas_user_id: str,
         user_id: str,
-    ) -> None:
-        params = {"filter[user]": mas_user_id, "filter[status]": "active"}
-        endpoint = "/api/admin/v1/user-sessions"
-        resp = self.send_to_mas("GET", endpoint=endpoint, params=params)
-        json_body = await self.decode_response(resp)
-        if resp.ok:
-            count = json_body["meta"]["count"]
-            if count > 0:
-                sessions = json_body["data"]
-                json_report[user_id]["sessions"]["user-sessions"] = sessions
-                logger.debug(
-                    "User-Sessions : %s",
-                    json_report[user_id]["sessions"]["user-sessions"],
-                )
-        else:
-            error = f"Cannot get user session for {user_id}"
-            json_report[user_id]["errors"].append(
-                {"error": error, "description": json_body}
-            )
-            failed_user_ids.append(user_id)
+    ) -> list[dict[str, Any]]:
+        return await self.get_sessions(
+            "user-sessions", json_report, failed_user_ids, mas_user_id, user_id
+        )
 
     async def get_oauth2_sessions(
         self,
@@ -301,27 +456,39 @@ class AdminClient:
         failed_user_ids: list[str],
         mas_user_id: str,
         user_id: str,
-    ) -> None:
+    ) -> list[dict[str, Any]]:
+        return await self.get_sessions(
+            "oauth2-sessions", json_report, failed_user_ids, mas_user_id, user_id
+        )
+
+    async def get_sessions(
+        self,
+        session_type: str,
+        json_report: dict[str, Any],
+        failed_user_ids: list[str],
+        mas_user_id: str,
+        user_id: str,
+    ) -> list[dict[str, Any]]:
         params = {"filter[user]": mas_user_id, "filter[status]": "active"}
-        endpoint = "/api/admin/v1/oauth2-sessions"
-        resp = self.send_to_mas("GET", endpoint=endpoint, params=params)
-        json_body = await self.decode_response(resp)
-        if resp.ok:
-            count = json_body["meta"]["count"]
-            if count > 0:
-                sessions = json_body["data"]
-                json_report[user_id]["sessions"]["oauth2-sessions"] = sessions
-                logger.debug(
-                    "OAuth2-Sessions : %s",
-                    json_report[user_id]["sessions"]["oauth2-sessions"],
-                )
-        else:
-            error = f"Cannot get oauth2 session for {user_id}"
+        sessions: list[dict[str, Any]] = []
+        try:
+            async for session in self.iter_mas_items(
+                f"/api/admin/v1/{session_type}", params
+            ):
+                sessions.append(session)  # noqa: PERF401
+        except MASError as e:
+            error = f"Cannot get {session_type} for {user_id}"
             json_report[user_id]["errors"].append(
-                {"error": error, "description": json_body}
+                {"error": error, "description": e.description}
             )
             failed_user_ids.append(user_id)
 
+        # Report what has been retrieved, even if a page failed
+        if sessions:
+            json_report[user_id]["sessions"][session_type] = sessions
+            logger.debug("%s : %s", session_type, sessions)
+        return sessions
+
     async def set_password(
         self,
         json_report: dict[str, Any],
@@ -332,7 +499,7 @@ class AdminClient:
     ) -> bool:
         endpoint = f"/api/admin/v1/users/{mas_user_id}/set-password"
         data = {"password": password, "skip_password_check": True}
-        resp = self.send_to_mas("POST", endpoint=endpoint, json=data)
+        resp = await self.send_to_mas("POST", endpoint=endpoint, json=data)
         if not resp.ok:
             json_body = await self.decode_response(resp)
             error = f"Cannot reset password for {user_id}"
@@ -351,7 +518,7 @@ class AdminClient:
         user_id: str,
     ) -> bool:
         endpoint = f"/api/admin/v1/users/{mas_user_id}/kill-sessions"
-        resp = self.send_to_mas("POST", endpoint=endpoint)
+        resp = await self.send_to_mas("POST", endpoint=endpoint)
         json_body = await self.decode_response(resp)
         if not resp.ok:
             error = f"Cannot kill all sessions {user_id}"
@@ -370,7 +537,7 @@ class AdminClient:
         user_id: str,
     ) -> bool:
         endpoint = f"/api/admin/v1/users/{mas_user_id}/lock"
-        resp = self.send_to_mas("POST", endpoint=endpoint)
+        resp = await self.send_to_mas("POST", endpoint=endpoint)
         json_body = await self.decode_response(resp)
         if not resp.ok:
             error = f"Cannot lock for {user_id}"
@@ -390,7 +557,7 @@ class AdminClient:
         user_id: str,
     ) -> bool:
         endpoint = f"/api/admin/v1/users/{mas_user_id}/unlock"
-        resp = self.send_to_mas("POST", endpoint=endpoint)
+        resp = await self.send_to_mas("POST", endpoint=endpoint)
         json_body = await self.decode_response(resp)
         if not resp.ok:
             error = f"Cannot unlock for {user_id}"
@@ -411,7 +578,7 @@ class AdminClient:
     ) -> bool:
         endpoint = f"/api/admin/v1/users/{mas_user_id}/deactivate"
         data = {"skip_erase": True}
-        resp = self.send_to_mas("POST", endpoint=endpoint, json=data)
+        resp = await self.send_to_mas("POST", endpoint=endpoint, json=data)
         json_body = await self.decode_response(resp)
         if not resp.ok:
             error = f"Cannot deactivate for {user_id}"
@@ -431,7 +598,7 @@ class AdminClient:
         user_id: str,
     ) -> bool:
         endpoint = f"/api/admin/v1/users/{mas_user_id}/reactivate"
-        resp = self.send_to_mas("POST", endpoint=endpoint)
+        resp = await self.send_to_mas("POST", endpoint=endpoint)
         json_body = await self.decode_response(resp)
         if not resp.ok:
             error = f"Cannot reactivate for {user_id}"
@@ -450,20 +617,21 @@ class AdminClient:
         user_id: str,
         params: dict[str, Any],
     ) -> list[dict[str, Any]] | None:
-        endpoint = "/api/admin/v1/user-emails"
-        resp = self.send_to_mas("GET", endpoint=endpoint, params=params)
-        json_body = await self.decode_response(resp)
-        if not resp.ok:
-            if resp.status_code == 404:
+        emails: list[dict[str, Any]] = []
+        try:
+            async for email in self.iter_mas_items("/api/admin/v1/user-emails", params):
+                emails.append(email)  # noqa: PERF401
+        except MASError as e:
+            if e.status == 404:
                 return []
             error = f"Cannot find emails with {params} for {user_id}"
             json_report[user_id]["errors"].append(
-                {"error": error, "description": json_body}
+                {"error": error, "description": e.description}
             )
             failed_user_ids.append(user_id)
             return None
-        json_report[user_id]["description"] = json_body["data"]
-        return json_body["data"]
+        json_report[user_id]["description"] = emails
+        return emails
 
     async def remove_email(
         self,
@@ -473,7 +641,7 @@ class AdminClient:
         user_id: str,
     ) -> bool:
         endpoint = f"/api/admin/v1/user-emails/{user_email_id}"
-        resp = self.send_to_mas("DELETE", endpoint=endpoint)
+        resp = await self.send_to_mas("DELETE", endpoint=endpoint)
         json_body = await self.decode_response(resp)
         if not resp.ok:
             error = f"Cannot remove email {user_email_id} for {user_id}"
@@ -494,7 +662,7 @@ class AdminClient:
     ) -> bool:
         endpoint = "/api/admin/v1/user-emails"
         data = {"user_id": mas_user_id, "email": email}
-        resp = self.send_to_mas("POST", endpoint=endpoint, json=data)
+        resp = await self.send_to_mas("POST", endpoint=endpoint, json=data)
         json_body = await self.decode_response(resp)
         if not resp.ok:
             error = f"Cannot add email {email} for {user_id}"
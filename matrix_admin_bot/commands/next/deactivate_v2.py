@@ -15,6 +15,7 @@ logger = structlog.getLogger(__name__)
 
 class DeactivateCommandV2(UserRelatedCommand):
     KEYWORD = "deactivate"
+    AGGREGATE_RESULTS = True
 
     def __init__(
         self,
@@ -25,7 +26,6 @@ class DeactivateCommandV2(UserRelatedCommand):
     ) -> None:
         super().__init__(room, message, matrix_client, self.KEYWORD, extra_config)
         self.admin_client: AdminClient = extra_config.get("admin_client")  # pyright: ignore[reportAttributeAccessIssue]
-        self.failed_user_ids: list[str] = []
 
     async def deactivate_user(self, user_id: str) -> bool:
         if get_server_name(user_id) != self.server_name:
@@ -36,30 +36,13 @@ class DeactivateCommandV2(UserRelatedCommand):
         self.json_report[user_id]["sessions"] = {}
         self.json_report[user_id]["errors"] = []
 
-        # Get devices from the user in Synapse
-        await self.admin_client.get_devices_from_synapse(self.json_report, user_id)
-
-        # Get the user from the MAS with its localpart
-        mas_user_id = await self.admin_client.get_mas_user_id(
+        # Get devices from Synapse, the MAS user and all its sessions
+        snapshot = await self.admin_client.get_user_snapshot(
             self.json_report, self.failed_user_ids, user_id
         )
-        if mas_user_id is None:
+        if snapshot is None:
             return False
-
-        # Get all compat-sessions in MAS
-        await self.admin_client.get_compat_sessions(
-            self.json_report, self.failed_user_ids, mas_user_id, user_id
-        )
-
-        # Get all user-sessions in MAS
-        await self.admin_client.get_user_sessions(
-            self.json_report, self.failed_user_ids, mas_user_id, user_id
-        )
-
-        # Get all oauth2-sessions
-        await self.admin_client.get_oauth2_sessions(
-            self.json_report, self.failed_user_ids, mas_user_id, user_id
-        )
+        mas_user_id = snapshot.mas_user_id
 
         # Deactivate the user
         return await self.admin_client.deactivate(
@@ -68,29 +51,10 @@ class DeactivateCommandV2(UserRelatedCommand):
 
     @override
     async def simple_execute(self) -> bool:
-        for user_id in self.user_ids:
-            await self.deactivate_user(user_id)
+        await self.process_users(self.deactivate_user)
 
-        if self.json_report:
-            self.json_report["command"] = self.KEYWORD
-            await self.send_report()
         logger.info(self.json_report)
-        if self.failed_user_ids:
-            text = "\n".join(
-                [
-                    "Couldn't deactivate the following users:",
-                    "",
-                    *[f"- {user_id}" for user_id in self.failed_user_ids],
-                ]
-            )
-            await self.matrix_client.send_markdown_message(
-                self.room.room_id,
-                text,
-                reply_to=self.message.event_id,
-                thread_root=self.message.event_id,
-            )
-
-        return not self.failed_user_ids
+        return await self.send_results("Couldn't deactivate the following users:")
 
     @property
     @override
@@ -99,7 +63,7 @@ class DeactivateCommandV2(UserRelatedCommand):
             [
                 "You are about to deactivate the following users:",
                 "",
-                *[f"- {user_id}" for user_id in self.user_ids],
+                *self.format_user_ids(self.user_ids),
                 "",
                 "⚠⚠ This will also log-out all of their devices!",
             ]
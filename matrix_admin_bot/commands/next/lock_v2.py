@@ -12,6 +12,7 @@ from matrix_command_bot.util import get_server_name
 
 class LockCommandV2(UserRelatedCommand):
     KEYWORD = "lock"
+    AGGREGATE_RESULTS = True
 
     def __init__(
         self,
@@ -22,7 +23,6 @@ class LockCommandV2(UserRelatedCommand):
     ) -> None:
         super().__init__(room, message, matrix_client, self.KEYWORD, extra_config)
         self.admin_client: AdminClient = extra_config.get("admin_client")  # pyright: ignore[reportAttributeAccessIssue]
-        self.failed_user_ids: list[str] = []
 
     async def lock_user(self, user_id: str) -> bool:
         if get_server_name(user_id) != self.server_name:
@@ -33,30 +33,13 @@ class LockCommandV2(UserRelatedCommand):
         self.json_report[user_id]["sessions"] = {}
         self.json_report[user_id]["errors"] = []
 
-        # Get devices from the user in Synapse
-        await self.admin_client.get_devices_from_synapse(self.json_report, user_id)
-
-        # Get the user from the MAS with its localpart
-        mas_user_id = await self.admin_client.get_mas_user_id(
+        # Get devices from Synapse, the MAS user and all its sessions
+        snapshot = await self.admin_client.get_user_snapshot(
             self.json_report, self.failed_user_ids, user_id
         )
-        if mas_user_id is None:
+        if snapshot is None:
             return False
-
-        # Get all compat-sessions in MAS
-        await self.admin_client.get_compat_sessions(
-            self.json_report, self.failed_user_ids, mas_user_id, user_id
-        )
-
-        # Get all user-sessions in MAS
-        await self.admin_client.get_user_sessions(
-            self.json_report, self.failed_user_ids, mas_user_id, user_id
-        )
-
-        # Get all oauth2-sessions
-        await self.admin_client.get_oauth2_sessions(
-            self.json_report, self.failed_user_ids, mas_user_id, user_id
-        )
+        mas_user_id = snapshot.mas_user_id
 
         # Lock the user
         return await self.admin_client.lock(
@@ -65,29 +48,9 @@ class LockCommandV2(UserRelatedCommand):
 
     @override
     async def simple_execute(self) -> bool:
-        for user_id in self.user_ids:
-            await self.lock_user(user_id)
-
-        if self.json_report:
-            self.json_report["command"] = self.KEYWORD
-            await self.send_report()
-
-        if self.failed_user_ids:
-            text = "\n".join(
-                [
-                    "Couldn't lock the following users:",
-                    "",
-                    *[f"- {user_id}" for user_id in self.failed_user_ids],
-                ]
-            )
-            await self.matrix_client.send_markdown_message(
-                self.room.room_id,
-                text,
-                reply_to=self.message.event_id,
-                thread_root=self.message.event_id,
-            )
-
-        return not self.failed_user_ids
+        await self.process_users(self.lock_user)
+
+        return await self.send_results("Couldn't lock the following users:")
 
     @property
     @override
@@ -96,7 +59,7 @@ class LockCommandV2(UserRelatedCommand):
             [
                 "You are about to lock the following users:",
                 "",
-                *[f"- {user_id}" for user_id in self.user_ids],
+                *self.format_user_ids(self.user_ids),
             ]
         )
 
@@ -12,6 +12,7 @@ from matrix_command_bot.util import get_server_name
 
 class MembershipsCommandV2(UserRelatedCommand):
     KEYWORD = "memberships"
+    AGGREGATE_RESULTS = True
 
     def __init__(
         self,
@@ -22,7 +23,6 @@ class MembershipsCommandV2(UserRelatedCommand):
     ) -> None:
         super().__init__(room, message, matrix_client, self.KEYWORD, extra_config)
         self.admin_client: AdminClient = extra_config.get("admin_client")  # pyright: ignore[reportAttributeAccessIssue]
-        self.failed_user_ids: list[str] = []
 
     async def memberships(self, user_id: str) -> bool:
         if get_server_name(user_id) != self.server_name:
@@ -69,37 +69,18 @@ class MembershipsCommandV2(UserRelatedCommand):
                 room_details["membership"] = membership
                 self.json_report[user_id].append(room_details)
         else:
+            self.failed_user_ids.append(user_id)
             return False
 
         return True
 
     @override
     async def simple_execute(self) -> bool:
-        for user_id in self.user_ids:
-            res = await self.memberships(user_id)
-            if not res:
-                self.failed_user_ids.append(user_id)
-
-        if self.json_report:
-            self.json_report["command"] = self.KEYWORD
-            await self.send_report()
-
-        if self.failed_user_ids:
-            text = "\n".join(
-                [
-                    "Couldn't get room memberships for the following users:",
-                    "",
-                    *[f"- {user_id}" for user_id in self.failed_user_ids],
-                ]
-            )
-            await self.matrix_client.send_markdown_message(
-                self.room.room_id,
-                text,
-                reply_to=self.message.event_id,
-                thread_root=self.message.event_id,
-            )
-
-        return not self.failed_user_ids
+        await self.process_users(self.memberships)
+
+        return await self.send_results(
+            "Couldn't get room memberships for the following users:"
+        )
 
     @property
     @override
@@ -0,0 +1,87 @@
+import asyncio
+import heapq
+import itertools
+from contextvars import ContextVar
+from enum import IntEnum
+from types import TracebackType
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BULK = 1
+
+
+# Priority of the admin API requests sent from the current context.
+# Bulk commands set it once, the tasks they create inherit it.
+request_priority: ContextVar[Priority] = ContextVar(
+    "request_priority", default=Priority.INTERACTIVE
+)
+
+
+class PrioritySemaphore:
+    """
+    Semaphore serving its waiters by priority, then in FIFO order.
+    The `reserved` last slots are kept for the interactive requests, so they
+    get through even when bulk requests saturate the target.
+    A value of 0 disables the limit.
+    """
+
+    def __init__(self, value: int = 0, reserved: int = 0) -> None:
+        self.value = value
+        self.reserved = min(reserved, max(0, value - 1))
+        self.in_flight = 0
+        self.waiters: list[tuple[Priority, int, asyncio.Future[None]]] = []
+        self.counter = itertools.count()
+
+    def can_start(self, priority: Priority) -> bool:
+        if self.value <= 0:
+            return True
+        limit = (
+            self.value
+            if priority == Priority.INTERACTIVE
+            else (self.value - self.reserved)
+        )
+        return self.in_flight < limit
+
+    async def acquire(self) -> None:
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self.waiters, (request_priority.get(), next(self.counter), waiter)
+        )
+        # Served right away when nothing with the same or a higher priority waits
+        self.wake_up()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done():
+                # The slot has been given right before the cancellation
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self.wake_up()
+
+    def wake_up(self) -> None:
+        while self.waiters:
+            priority, _, waiter = self.waiters[0]
+            if waiter.cancelled():
+                heapq.heappop(self.waiters)
+                continue
+            # The waiters behind have the same or a lower priority
+            if not self.can_start(priority):
+                return
+            heapq.heappop(self.waiters)
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    async def __aenter__(self) -> None:
+        await self.acquire()
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.release()
@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+from typing_extensions import override
+
+from matrix_admin_bot.commands.next.priority import PrioritySemaphore
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the number of requests per second sent to a target.
+    A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate: float = 0, burst: int | None = None) -> None:
+        self.rate = rate
+        self.capacity = burst if burst else max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        # Interactive requests don't wait behind the queued bulk ones
+        self.lock = PrioritySemaphore(1)
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+
+        # Waiters are served by priority, then in FIFO order, by the lock
+        async with self.lock:
+            self.refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= 1
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    Rate limiter converging on the rate sustained by the target (AIMD).
+    The rate grows by `increase` requests per second every second while the
+    target is healthy, and is multiplied by `decrease_factor` when it is
+    overloaded, all the requests being held for the delay asked by the target.
+    A rate of 0 disables the limit, only the delay asked by the target is
+    respected.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        min_rate: float = 1,
+        max_rate: float | None = None,
+        increase: float = 1,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        super().__init__(rate, burst=1)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.blocked_until = 0.0
+        self.decreased_at = 0.0
+
+    def on_success(self) -> None:
+        if self.rate <= 0:
+            return
+        # One success per request: +increase/rate each time is +increase per second
+        self.refill()
+        self.rate += self.increase / self.rate
+        if self.max_rate:
+            self.rate = min(self.rate, self.max_rate)
+
+    def on_overload(self, retry_after: float | None = None) -> None:
+        now = time.monotonic()
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+        # The requests already in flight will fail too, only back off once for them
+        if self.rate > 0 and now - self.decreased_at >= 1:
+            self.refill()
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self.tokens = 0
+            self.decreased_at = now
+
+    @override
+    async def acquire(self) -> None:
+        async with self.lock:
+            delay = self.blocked_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await super().acquire()
@@ -25,7 +25,6 @@ class ReactivateCommandV2(UserRelatedCommand):
     ) -> None:
         super().__init__(room, message, matrix_client, self.KEYWORD, extra_config)
         self.admin_client: AdminClient = extra_config.get("admin_client")  # pyright: ignore[reportAttributeAccessIssue]
-        self.failed_user_ids: list[str] = []
         self.user_id: str | None = None
         self.email: str | None = None
 
@@ -38,30 +37,13 @@ class ReactivateCommandV2(UserRelatedCommand):
         self.json_report[user_id]["sessions"] = {}
         self.json_report[user_id]["errors"] = []
 
-        # Get devices from the user in Synapse
-        await self.admin_client.get_devices_from_synapse(self.json_report, user_id)
-
-        # Get the user from the MAS with its localpart
-        mas_user_id = await self.admin_client.get_mas_user_id(
+        # Get devices from Synapse, the MAS user and all its sessions
+        snapshot = await self.admin_client.get_user_snapshot(
             self.json_report, self.failed_user_ids, user_id
         )
-        if mas_user_id is None:
+        if snapshot is None:
             return False
-
-        # Get all compat-sessions in MAS
-        await self.admin_client.get_compat_sessions(
-            self.json_report, self.failed_user_ids, mas_user_id, user_id
-        )
-
-        # Get all user-sessions in MAS
-        await self.admin_client.get_user_sessions(
-            self.json_report, self.failed_user_ids, mas_user_id, user_id
-        )
-
-        # Get all oauth2-sessions
-        await self.admin_client.get_oauth2_sessions(
-            self.json_report, self.failed_user_ids, mas_user_id, user_id
-        )
+        mas_user_id = snapshot.mas_user_id
 
         # Check if email is used
         params = {
@@ -143,7 +125,7 @@ class ReactivateCommandV2(UserRelatedCommand):
                 [
                     "Couldn't reactivate the following users:",
                     "",
-                    *[f"- {user_id}" for user_id in self.failed_user_ids],
+                    *self.format_user_ids(self.failed_user_ids),
                 ]
             )
             await self.matrix_client.send_markdown_message(
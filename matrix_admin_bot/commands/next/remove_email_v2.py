@@ -26,7 +26,6 @@ class RemoveEmailCommandV2(UserRelatedCommand):
         super().__init__(room, message, matrix_client, self.KEYWORD, extra_config)
         self.transform_cmd_input_fct = None
         self.admin_client: AdminClient = extra_config.get("admin_client")  # pyright: ignore[reportAttributeAccessIssue]
-        self.failed_user_ids: list[str] = []
         self.user_id: str | None = None
 
     async def remove_email(self, user_id: str) -> bool:
@@ -103,7 +102,7 @@ class RemoveEmailCommandV2(UserRelatedCommand):
                 [
                     "Couldn't remove email of the following users:",
                     "",
-                    *[f"- {user_id}" for user_id in self.failed_user_ids],
+                    *self.format_user_ids(self.failed_user_ids),
                 ]
             )
             await self.matrix_client.send_markdown_message(
@@ -26,7 +26,6 @@ class ReplaceEmailCommandV2(UserRelatedCommand):
         super().__init__(room, message, matrix_client, self.KEYWORD, extra_config)
         self.transform_cmd_input_fct = None
         self.admin_client: AdminClient = extra_config.get("admin_client")  # pyright: ignore[reportAttributeAccessIssue]
-        self.failed_user_ids: list[str] = []
         self.user_id: str | None = None
         self.email: str | None = None
 
@@ -94,7 +93,7 @@ class ReplaceEmailCommandV2(UserRelatedCommand):
                 [
                     "Couldn't replace email of the following users:",
                     "",
-                    *[f"- {user_id}" for user_id in self.failed_user_ids],
+                    *self.format_user_ids(self.failed_user_ids),
                 ]
             )
             await self.matrix_client.send_markdown_message(
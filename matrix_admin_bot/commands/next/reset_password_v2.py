@@ -17,6 +17,7 @@ logger = structlog.getLogger(__name__)
 
 class ResetPasswordCommandV2(UserRelatedCommand):
     KEYWORD = "reset_password"
+    AGGREGATE_RESULTS = True
 
     def __init__(
         self,
@@ -27,7 +28,6 @@ class ResetPasswordCommandV2(UserRelatedCommand):
     ) -> None:
         super().__init__(room, message, matrix_client, self.KEYWORD, extra_config)
         self.admin_client: AdminClient = extra_config.get("admin_client")  # pyright: ignore[reportAttributeAccessIssue]
-        self.failed_user_ids: list[str] = []
 
     async def reset_password(self, user_id: str, password: str) -> bool:
         if get_server_name(user_id) != self.server_name:
@@ -39,30 +39,13 @@ class ResetPasswordCommandV2(UserRelatedCommand):
         self.json_report[user_id]["errors"] = []
         self.json_report[user_id]["new_password"] = ""
 
-        # Get devices from the user in Synapse
-        await self.admin_client.get_devices_from_synapse(self.json_report, user_id)
-
-        # Get the user from the MAS with its localpart
-        mas_user_id = await self.admin_client.get_mas_user_id(
+        # Get devices from Synapse, the MAS user and all its sessions
+        snapshot = await self.admin_client.get_user_snapshot(
             self.json_report, self.failed_user_ids, user_id
         )
-        if mas_user_id is None:
+        if snapshot is None:
             return False
-
-        # Get all compat-sessions in MAS
-        await self.admin_client.get_compat_sessions(
-            self.json_report, self.failed_user_ids, mas_user_id, user_id
-        )
-
-        # Get all user-sessions in MAS
-        await self.admin_client.get_user_sessions(
-            self.json_report, self.failed_user_ids, mas_user_id, user_id
-        )
-
-        # Get all oauth2-sessions
-        await self.admin_client.get_oauth2_sessions(
-            self.json_report, self.failed_user_ids, mas_user_id, user_id
-        )
+        mas_user_id = snapshot.mas_user_id
 
         # Reset the password within the MAS
         set_password_success = await self.admin_client.set_password(
@@ -85,29 +68,13 @@ class ResetPasswordCommandV2(UserRelatedCommand):
             characters = string.ascii_lowercase + string.digits
             return "".join(secrets.choice(characters) for _ in range(length))
 
-        for user_id in self.user_ids:
-            await self.reset_password(user_id, randomword(32))
-
-        if self.json_report:
-            self.json_report["command"] = self.KEYWORD
-            await self.send_report()
-
-        if self.failed_user_ids:
-            text = "\n".join(
-                [
-                    "Couldn't reset the password of the following users:",
-                    "",
-                    *[f"- {user_id}" for user_id in self.failed_user_ids],
-                ]
-            )
-            await self.matrix_client.send_markdown_message(
-                self.room.room_id,
-                text,
-                reply_to=self.message.event_id,
-                thread_root=self.message.event_id,
-            )
-
-        return not self.failed_user_ids
+        await self.process_users(
+            lambda user_id: self.reset_password(user_id, randomword(32))
+        )
+
+        return await self.send_results(
+            "Couldn't reset the password of the following users:"
+        )
 
     @property
     @override
@@ -116,7 +83,7 @@ class ResetPasswordCommandV2(UserRelatedCommand):
             [
                 "You are about to reset password of the following users with MAS:",
                 "",
-                *[f"- {user_id}" for user_id in self.user_ids],
+                *self.format_user_ids(self.user_ids),
                 "",
                 "⚠⚠ This will also log-out all of their devices!",
             ]
@@ -0,0 +1,96 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any
+
+import aiofiles
+import aiofiles.os
+import structlog
+
+logger = structlog.getLogger(__name__)
+
+# Delivered users are written by batch to keep the workers off the disk
+FLUSH_SIZE = 100
+FLUSH_INTERVAL = 1.0
+
+
+def get_content_hash(notice_content: Mapping[str, Any]) -> str:
+    return hashlib.sha256(
+        json.dumps(notice_content, sort_keys=True).encode()
+    ).hexdigest()
+
+
+class ServerNoticeCheckpoint:
+    """
+    On-disk progress of a server notice campaign.
+    The campaign is described in `<campaign_id>.json` and the delivered user ids
+    are appended, one per line, to `<campaign_id>.delivered`.
+    """
+
+    def __init__(self, directory: str, campaign_id: str) -> None:
+        self.campaign_id = campaign_id
+        self.header_path = Path(directory) / f"{campaign_id}.json"
+        self.delivered_path = Path(directory) / f"{campaign_id}.delivered"
+        self.pending: list[str] = []
+        self.flushed_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def save(
+        self, notice_content: Mapping[str, Any], recipients: list[str]
+    ) -> None:
+        await aiofiles.os.makedirs(self.header_path.parent, exist_ok=True)
+        header = {
+            "campaign_id": self.campaign_id,
+            "content_hash": get_content_hash(notice_content),
+            "notice_content": notice_content,
+            "recipients": recipients,
+        }
+        tmp_path = self.header_path.with_suffix(".json.tmp")
+        async with aiofiles.open(tmp_path, "w") as f:
+            await f.write(json.dumps(header))
+        await aiofiles.os.replace(tmp_path, self.header_path)
+
+    async def load(self) -> dict[str, Any] | None:
+        if not await aiofiles.os.path.exists(self.header_path):
+            return None
+        async with aiofiles.open(self.header_path) as f:
+            header: dict[str, Any] = json.loads(await f.read())
+        if get_content_hash(header["notice_content"]) != header["content_hash"]:
+            logger.warning(
+                "Server notice checkpoint %s is corrupted: content hash mismatch",
+                self.campaign_id,
+            )
+            return None
+        return header
+
+    async def load_delivered(self) -> set[str]:
+        if not await aiofiles.os.path.exists(self.delivered_path):
+            return set()
+        async with aiofiles.open(self.delivered_path) as f:
+            # A crash can leave a truncated last line, it is simply ignored
+            return {line.rstrip("\n") async for line in f if line.endswith("\n")}
+
+    async def mark_delivered(self, user_id: str) -> None:
+        self.pending.append(user_id)
+        if (
+            len(self.pending) >= FLUSH_SIZE
+            or time.monotonic() - self.flushed_at >= FLUSH_INTERVAL
+        ):
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self.lock:
+            self.flushed_at = time.monotonic()
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, []
+            async with aiofiles.open(self.delivered_path, "a") as f:
+                await f.write("".join(f"{user_id}\n" for user_id in pending))
+
+    async def remove(self) -> None:
+        for path in (self.header_path, self.delivered_path):
+            if await aiofiles.os.path.exists(path):
+                await aiofiles.os.remove(path)
@@ -0,0 +1,86 @@
+import time
+from datetime import timedelta
+from typing import Any
+
+import structlog
+
+from matrix_command_bot.command import ICommand
+from matrix_command_bot.util import get_server_name
+
+logger = structlog.getLogger(__name__)
+
+
+class ServerNoticeProgress:
+    """
+    Progress of a server notice campaign, published as a single message in the
+    command thread and edited in place at most once every `interval` seconds.
+    The counters are read from the campaign report.
+    """
+
+    def __init__(
+        self, command: ICommand, json_report: dict[str, Any], interval: float
+    ) -> None:
+        self.command = command
+        self.json_report = json_report
+        self.interval = interval
+        self.started_at = time.monotonic()
+        # Short campaigns are over before the first update and post nothing
+        self.updated_at = self.started_at
+        self.event_id: str | None = None
+
+    def get_message(self, *, completed: bool = False) -> str:
+        summary = self.json_report["summary"]
+        processed = summary["success"] + summary["failed"]
+        elapsed = time.monotonic() - self.started_at
+        rate = processed / elapsed if elapsed > 0 else 0
+
+        # Every bot of a multi-bot setup publishes the progress of its server
+        message = (
+            f"Server notice on {get_server_name(self.command.matrix_client.user_id)} "
+            f"{'completed' if completed else 'in progress'}: "
+            f"{summary['success']} sent, {summary['failed']} failed, "
+            f"{rate:.1f} notices/s"
+        )
+        total = self.json_report["details"].get("nb_users")
+        if not completed and total and rate > 0:
+            remaining = total - processed - summary.get("already_delivered", 0)
+            eta = timedelta(seconds=round(max(0, remaining) / rate))
+            message += f", ETA {eta}"
+        return message
+
+    async def update(self) -> None:
+        now = time.monotonic()
+        if self.interval <= 0 or now - self.updated_at < self.interval:
+            return
+        self.updated_at = now
+        await self.publish(self.get_message())
+
+    async def complete(self) -> None:
+        if self.event_id:
+            await self.publish(self.get_message(completed=True))
+
+    async def publish(self, message: str) -> None:
+        try:
+            if self.event_id is None:
+                self.event_id = await self.command.matrix_client.send_text_message(
+                    self.command.room.room_id,
+                    message,
+                    reply_to=self.command.message.event_id,
+                    thread_root=self.command.message.event_id,
+                )
+            else:
+                await self.command.matrix_client.room_send(
+                    self.command.room.room_id,
+                    "m.room.message",
+                    {
+                        "msgtype": "m.text",
+                        "body": f"* {message}",
+                        "m.new_content": {"msgtype": "m.text", "body": message},
+                        "m.relates_to": {
+                            "rel_type": "m.replace",
+                            "event_id": self.event_id,
+                        },
+                    },
+                )
+        except Exception as e:  # noqa: BLE001
+            logger.warning("Cannot publish the server notice progress", exc_info=e)
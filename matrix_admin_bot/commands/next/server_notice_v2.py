@@ -1,6 +1,7 @@
 import asyncio
+import hashlib
 import json
-from collections.abc import Awaitable, Callable, Mapping
+from collections.abc import AsyncIterator, Awaitable, Callable, Mapping
 from typing import Any
 
 import structlog
@@ -10,8 +11,20 @@ from matrix_bot.eventparser import MessageEventParser
 from nio import MatrixRoom, RoomMessage
 from typing_extensions import override
 
-from matrix_admin_bot.commands.next.admin_client import AdminClient
+from matrix_admin_bot.commands.next.admin_client import (
+    AdminClient,
+    admin_api_retries_total,
+)
+from matrix_admin_bot.commands.next.priority import Priority, request_priority
+from matrix_admin_bot.commands.next.server_notice_checkpoint import (
+    ServerNoticeCheckpoint,
+)
+from matrix_admin_bot.commands.next.server_notice_progress import (
+    ServerNoticeProgress,
+)
 from matrix_command_bot.command import ICommand
+from matrix_command_bot.event_cache import EventRecord
+from matrix_command_bot.metrics import registry
 from matrix_command_bot.simple_command import SimpleExecuteStep
 from matrix_command_bot.step import CommandAction, CommandWithSteps, ICommandStep
 from matrix_command_bot.step.reaction_steps import (
@@ -22,7 +35,6 @@ from matrix_command_bot.step.reaction_steps import (
 from matrix_command_bot.util import (
     get_server_name,
     is_local_user,
-    randomword,
     send_report,
     set_status_reaction,
 )
@@ -30,9 +42,16 @@ from matrix_command_bot.validation import IValidator
 from matrix_command_bot.validation.steps import ValidateStep
 
 USER_ALL = "all"
+SERVER_NOTICE_ENDPOINT = "/_synapse/admin/v1/send_server_notice"
 
 logger = structlog.getLogger(__name__)
 
+server_notice_queue_depth = registry.gauge(
+    "matrix_admin_bot_server_notice_queue_depth",
+    "Recipients enumerated and waiting for a server notice worker",
+    ("campaign_id",),
+)
+
 
 class ServerNoticeState(ReactionCommandState):
     def __init__(self) -> None:
@@ -40,6 +59,15 @@ class ServerNoticeState(ReactionCommandState):
         self.notice_content: Mapping[str, Any] = {}
         self.recipients: list[str] = []
         self.notice_original_event_id: str | None = None
+        # Users already notified by a previous run of a resumed campaign
+        self.delivered: set[str] = set()
+
+    @override
+    def dump(self) -> dict[str, Any]:
+        # Rebuilt from the checkpoint on load, it can hold millions of users
+        state = super().dump()
+        del state["delivered"]
+        return state
 
 
 class ServerNoticeAskRecipientsStep(ICommandStep):
@@ -136,6 +164,42 @@ class ServerNoticeGetNoticeStep(ICommandStep):
         return True, CommandAction.CONTINUE
 
 
+class ServerNoticeLoadCheckpointStep(ICommandStep):
+    def __init__(
+        self,
+        command: ICommand,
+        command_state: ServerNoticeState,
+        checkpoint: ServerNoticeCheckpoint | None,
+    ) -> None:
+        super().__init__(command)
+        self.command_state = command_state
+        self.checkpoint = checkpoint
+
+    @override
+    async def execute(
+        self, reply: RoomMessage | None = None
+    ) -> tuple[bool, CommandAction]:
+        header = None
+        if self.checkpoint:
+            header = await self.checkpoint.load()
+        if self.checkpoint is None or header is None:
+            logger.warning("No server notice campaign to resume")
+            # Aborted before asking for the validation of a campaign that doesn't exist
+            if self.command.extra_config.get("is_coordinator", True):
+                await self.command.matrix_client.send_markdown_message(
+                    self.command.room.room_id,
+                    "There is no server notice campaign to resume with this id.",
+                    reply_to=self.command.message.event_id,
+                    thread_root=self.command.message.event_id,
+                )
+            return False, CommandAction.ABORT
+
+        self.command_state.notice_content = header["notice_content"]
+        self.command_state.recipients = header["recipients"]
+        self.command_state.delivered = await self.checkpoint.load_delivered()
+        return True, CommandAction.CONTINUE
+
+
 class ShouldExecuteStep(ICommandStep):
     def __init__(
         self,
@@ -183,6 +247,10 @@ class ServerNoticeCommandV2(CommandWithSteps):
         self.admin_client: AdminClient = extra_config.get("admin_client")  # pyright: ignore[reportAttributeAccessIssue]
         self.limit: int = extra_config.get("server_notice_limit", 100)  # pyright: ignore[reportAttributeAccessIssue]
         self.nb_workers: int = extra_config.get("server_notice_nb_workers", 1)  # pyright: ignore[reportAttributeAccessIssue]
+        self.progress_interval: float = extra_config.get(  # pyright: ignore[reportAttributeAccessIssue]
+            "server_notice_progress_interval", 5
+        )
+        checkpoint_dir: str | None = extra_config.get("server_notice_checkpoint_dir")  # pyright: ignore[reportAttributeAccessIssue]
 
         self.state = ServerNoticeState()
 
@@ -192,6 +260,12 @@ class ServerNoticeCommandV2(CommandWithSteps):
         event_parser.do_not_accept_own_message()
 
         self.command_text = event_parser.command(self.KEYWORD).strip()
+        args = self.command_text.split()
+        self.resume_id = (
+            args[1]
+            if len(args) == 2 and args[0] == "resume" and args[1].isalnum()
+            else None
+        )
 
         self.json_report: dict[str, Any] = {"command": self.KEYWORD}
         self.json_report.setdefault("summary", {})
@@ -202,7 +276,15 @@ class ServerNoticeCommandV2(CommandWithSteps):
 
         self.server_name = get_server_name(self.matrix_client.user_id)
 
-        self.command_id = randomword(16)
+        # Derived from the command event so that every bot uses the same campaign id
+        self.command_id = (
+            self.resume_id or hashlib.sha256(message.event_id.encode()).hexdigest()[:16]
+        )
+        self.checkpoint = (
+            ServerNoticeCheckpoint(checkpoint_dir, self.command_id)
+            if checkpoint_dir
+            else None
+        )
 
     async def execute(self) -> bool:
         if self.command_text == "help":
@@ -211,8 +293,36 @@ class ServerNoticeCommandV2(CommandWithSteps):
 
         return await super().execute()
 
+    @override
+    def dump_state(self) -> dict[str, Any] | None:
+        state = super().dump_state()
+        if state is not None:
+            state["state"] = self.state.dump()
+        return state
+
+    @override
+    async def load_state(self, state: Mapping[str, Any]) -> None:
+        await super().load_state(state)
+        self.state.load(state["state"])
+        if self.checkpoint:
+            self.state.delivered = await self.checkpoint.load_delivered()
+
     @override
     async def create_steps(self) -> list[ICommandStep]:
+        if self.resume_id:
+            return [
+                ServerNoticeLoadCheckpointStep(self, self.state, self.checkpoint),
+                ValidateStep(
+                    self,
+                    self.state,
+                    self.validator,
+                    f"The server notice campaign `{self.resume_id}` will be resumed.",
+                ),
+                ShouldExecuteStep(self, self.state, self.server_name),
+                ReactionStep(self, self.state, "🚀"),
+                SimpleExecuteStep(self, self.state, self.simple_execute),
+                ResultReactionStep(self, self.state),
+            ]
         return [
             ServerNoticeAskRecipientsStep(self),
             ServerNoticeGetRecipientsStep(self, self.state),
@@ -235,55 +345,27 @@ class ServerNoticeCommandV2(CommandWithSteps):
 
     async def simple_execute(self) -> bool:
         logger.info("Server Notice - %s - started", self.command_id)
-        users = await self.get_users(self.json_report, self.limit)
-        nb_users = len(users)
-        users = list(users)
-        logger.info("Notice will be sent to %s users", nb_users)
+        # Let the interactive commands go before the notices, workers included
+        request_priority.set(Priority.BULK)
         result = True
 
         if not self.state.notice_content:
             self.json_report["summary"]["status"] = "FAILED"
             self.json_report["summary"]["reason"] = "There is no notice to send"
+        elif self.checkpoint:
+            self.json_report["campaign_id"] = self.command_id
+            self.json_report["summary"]["already_delivered"] = 0
+            if not self.resume_id:
+                await self.checkpoint.save(
+                    self.state.notice_content, self.state.recipients
+                )
+            result = await self.send_server_notices()
+            await self.checkpoint.flush()
+            # Keep the checkpoint of an incomplete campaign so that it can be resumed
+            if result:
+                await self.checkpoint.remove()
         else:
-            user_queue: asyncio.Queue[str] = asyncio.Queue()
-            result_queue: asyncio.Queue[tuple[str, bool]] = asyncio.Queue()
-
-            for user_id in users:
-                await user_queue.put(user_id)
-
-            processed = {"count": 0}
-
-            async def worker(worker_id: int) -> None:
-                while not user_queue.empty():
-                    try:
-                        user_id = user_queue.get_nowait()
-                    except asyncio.QueueEmpty:
-                        break
-
-                    success = await self.send_server_notice(
-                        self.state.notice_content, user_id
-                    )
-                    processed["count"] += 1
-                    logger.info(
-                        "Worker %s - Process Server Notice %s/%s : %s",
-                        worker_id,
-                        processed["count"],
-                        nb_users,
-                        user_id,
-                    )
-                    await result_queue.put((user_id, success))
-                    user_queue.task_done()
-
-            await asyncio.gather(*[worker(i) for i in range(self.nb_workers)])
-
-            while not result_queue.empty():
-                user_id, success = result_queue.get_nowait()
-                if success:
-                    self.json_report["summary"]["success"] += 1
-                else:
-                    result = False
-                    self.json_report["summary"]["failed"] += 1
-                    self.json_report["failed_users"] += user_id + " "
+            result = await self.send_server_notices()
 
         logger.info("Server Notice - %s - completed", self.command_id)
 
@@ -297,22 +379,98 @@ class ServerNoticeCommandV2(CommandWithSteps):
             )
         return result
 
+    async def send_server_notices(self) -> bool:
+        """Send the notice to the recipients while they are being enumerated."""
+        result = True
+        # Bounded so the enumeration doesn't get too far ahead of the workers
+        user_queue: asyncio.Queue[str | None] = asyncio.Queue(maxsize=self.limit)
+        processed = {"count": 0}
+        progress = ServerNoticeProgress(self, self.json_report, self.progress_interval)
+
+        async def producer() -> None:
+            async for user_id in self.get_remaining_users():
+                await user_queue.put(user_id)
+                server_notice_queue_depth.set(user_queue.qsize(), self.command_id)
+            # One end marker per worker
+            for _ in range(self.nb_workers):
+                await user_queue.put(None)
+
+        async def worker(worker_id: int) -> None:
+            nonlocal result
+            while (user_id := await user_queue.get()) is not None:
+                server_notice_queue_depth.set(user_queue.qsize(), self.command_id)
+                if not await self.notify_user(user_id):
+                    result = False
+                await progress.update()
+                processed["count"] += 1
+                logger.info(
+                    "Worker %s - Process Server Notice %s : %s",
+                    worker_id,
+                    processed["count"],
+                    user_id,
+                )
+
+        # If a task fails, the others are cancelled instead of being left blocked
+        # on the queue
+        try:
+            async with asyncio.TaskGroup() as task_group:
+                task_group.create_task(producer())
+                for i in range(self.nb_workers):
+                    task_group.create_task(worker(i))
+        finally:
+            server_notice_queue_depth.remove(self.command_id)
+        logger.info("Notice has been sent to %s users", processed["count"])
+        await progress.complete()
+
+        return result and "get_users" not in self.json_report["details"]
+
+    async def notify_user(self, user_id: str) -> bool:
+        try:
+            success = await self.send_server_notice(self.state.notice_content, user_id)
+        except Exception as e:  # noqa: BLE001
+            logger.warning("Notice failed for %s", user_id, exc_info=e)
+            success = False
+
+        if success:
+            self.json_report["summary"]["success"] += 1
+            if self.checkpoint:
+                try:
+                    await self.checkpoint.mark_delivered(user_id)
+                except OSError as e:
+                    # Only a resumed campaign would send this notice again
+                    logger.warning("Cannot checkpoint the notice of %s", user_id, e=e)
+        else:
+            self.json_report["summary"]["failed"] += 1
+            self.json_report["failed_users"] += user_id + " "
+        return success
+
+    async def get_remaining_users(self) -> AsyncIterator[str]:
+        async for user_id in self.get_users(self.json_report, self.limit):
+            if user_id in self.state.delivered:
+                self.json_report["summary"]["already_delivered"] += 1
+            else:
+                yield user_id
+
     async def get_users(
         self, json_report: dict[str, Any], limit: int = 100
-    ) -> set[str]:
-        users: set[str] = set()
+    ) -> AsyncIterator[str]:
         if self.state.recipients and (
             (USER_ALL in self.state.recipients and len(self.state.recipients) == 1)
             or (self.server_name in self.state.recipients)
         ):
-            users = await self.admin_client.get_users(
+            async for user_id in self.admin_client.get_users(
                 self.server_name, json_report, limit
-            )
+            ):
+                yield user_id
         elif self.state.recipients:
-            for user_id in self.state.recipients:
-                if is_local_user(user_id, self.server_name):
-                    users.add(user_id)
-        return users
+            user_ids = [
+                user_id
+                for user_id in dict.fromkeys(self.state.recipients)
+                if is_local_user(user_id, self.server_name)
+            ]
+            json_report["details"]["nb_users"] = len(user_ids)
+            for user_id in user_ids:
+                yield user_id
 
     async def send_server_notice(
         self, message: Mapping[str, Any], user_id: str
@@ -332,23 +490,44 @@ class ServerNoticeCommandV2(CommandWithSteps):
     async def _send_with_retry(
         self, user_id: str, content: dict[str, Any]
     ) -> ClientResponse | None:
+        rate_limiter = self.admin_client.server_notice_rate_limiter
         resp = None
         for retry_nb in range(3):
+            if retry_nb:
+                admin_api_retries_total.inc("synapse", SERVER_NOTICE_ENDPOINT)
+            await rate_limiter.acquire()
             try:
                 resp = await self.admin_client.send_to_synapse(
                     "POST",
-                    "/_synapse/admin/v1/send_server_notice",
+                    SERVER_NOTICE_ENDPOINT,
                     data=json.dumps({"user_id": user_id, "content": content}),
                 )
-                if await self._stop_retry(resp):
-                    break
+                stop_retry = await self._stop_retry(resp)
+                retry_after = None if stop_retry else await self._get_retry_after(resp)
             except Exception as e:  # noqa: BLE001
                 logger.warning(
                     "Bot Admin has lost connection for %s", user_id, exc_info=e
                 )
-            await asyncio.sleep(0.5 * retry_nb)
+                stop_retry = False
+                retry_after = None
+            # Outside of the try: the notice must not be sent again if it fails
+            if stop_retry:
+                rate_limiter.on_success()
+                break
+            # Synapse is overloaded: slow down all the workers, not only this one
+            rate_limiter.on_overload(retry_after or 0.5 * (retry_nb + 1))
         return resp
 
+    async def _get_retry_after(self, resp: ClientResponse) -> float | None:
+        if resp.status == 429:
+            json_body = await resp.json()
+            if json_body.get("retry_after_ms"):
+                return json_body["retry_after_ms"] / 1000
+        retry_after = resp.headers.get("Retry-After")
+        if isinstance(retry_after, str) and retry_after.isdigit():
+            return float(retry_after)
+        return None
+
     async def _stop_retry(self, resp: ClientResponse) -> bool:
         if resp.ok or (resp.status < 500 and resp.status != 429):
             return True
@@ -382,6 +561,7 @@ class ServerNoticeCommandV2(CommandWithSteps):
         return """
 **Usage**:
 `!server_notice`
+`!server_notice resume <campaign_id>`
 
 **Purpose**:
 Sends server notices to users through an interactive, step-by-step process.
@@ -401,13 +581,15 @@ Sends server notices to users through an interactive, step-by-step process.
 - Use this feature responsibly for important announcements
 - The message is entered in a second step after specifying recipients
 - You can edit your message before confirming
+- When a checkpoint directory is configured, the report of an incomplete campaign
+contains its `campaign_id`, use `resume` to notify only the remaining users
 """
 
     @override
     async def replace_received(
         self,
         new_content: Mapping[str, Any],
-        original_event: RoomMessage,
+        original_event: EventRecord,
     ) -> None:
         if (
             self.state.notice_original_event_id
@@ -12,6 +12,7 @@ from matrix_command_bot.util import get_server_name
 
 class UnlockCommandV2(UserRelatedCommand):
     KEYWORD = "unlock"
+    AGGREGATE_RESULTS = True
 
     def __init__(
         self,
@@ -22,7 +23,6 @@ class UnlockCommandV2(UserRelatedCommand):
     ) -> None:
         super().__init__(room, message, matrix_client, self.KEYWORD, extra_config)
         self.admin_client: AdminClient = extra_config.get("admin_client")  # pyright: ignore[reportAttributeAccessIssue]
-        self.failed_user_ids: list[str] = []
 
     async def unlock_user(self, user_id: str) -> bool:
         if get_server_name(user_id) != self.server_name:
@@ -49,29 +49,9 @@ class UnlockCommandV2(UserRelatedCommand):
 
     @override
     async def simple_execute(self) -> bool:
-        for user_id in self.user_ids:
-            await self.unlock_user(user_id)
-
-        if self.json_report:
-            self.json_report["command"] = self.KEYWORD
-            await self.send_report()
-
-        if self.failed_user_ids:
-            text = "\n".join(
-                [
-                    "Couldn't unlock the following users:",
-                    "",
-                    *[f"- {user_id}" for user_id in self.failed_user_ids],
-                ]
-            )
-            await self.matrix_client.send_markdown_message(
-                self.room.room_id,
-                text,
-                reply_to=self.message.event_id,
-                thread_root=self.message.event_id,
-            )
-
-        return not self.failed_user_ids
+        await self.process_users(self.unlock_user)
+
+        return await self.send_results("Couldn't unlock the following users:")
 
     @property
     @override
@@ -80,7 +60,7 @@ class UnlockCommandV2(UserRelatedCommand):
             [
                 "You are about to unlock the following users:",
                 "",
-                *[f"- {user_id}" for user_id in self.user_ids],
+                *self.format_user_ids(self.user_ids),
             ]
         )
 
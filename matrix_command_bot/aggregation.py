@@ -0,0 +1,127 @@
+import asyncio
+import json
+from collections.abc import Collection, Mapping
+from dataclasses import dataclass, field
+from typing import Any
+
+import structlog
+from nio import MatrixRoom, UnknownEvent
+
+from matrix_command_bot.cache import DEFAULT_CACHE_TTL, MeteredTTLCache
+from matrix_command_bot.util import get_server_name
+
+logger = structlog.getLogger(__name__)
+
+# Sent by the worker bots in the thread of the command
+RESULT_EVENT_TYPE = "fr.gouv.tchap.bot.command_result"
+# Events are capped at 64 KiB, larger reports are uploaded by the worker
+MAX_INLINE_REPORT_SIZE = 48 * 1024
+DEFAULT_AGGREGATION_TIMEOUT = 300
+
+
+@dataclass
+class CommandResult:
+    server_name: str
+    result: bool
+    # Not received by the coordinator when the worker had to send them itself
+    failed_user_ids: list[str] = field(default_factory=list)
+    report: dict[str, Any] | None = None
+
+    def to_content(self, command_event_id: str) -> dict[str, Any]:
+        content: dict[str, Any] = {
+            "command_event_id": command_event_id,
+            "server_name": self.server_name,
+            "result": self.result,
+            "m.relates_to": {"rel_type": "m.thread", "event_id": command_event_id},
+        }
+        # Left out when too large, the worker then sends them itself
+        details: dict[str, Any] = {"failed_user_ids": self.failed_user_ids}
+        if self.report is not None:
+            details["report"] = self.report
+        if len(json.dumps(details)) <= MAX_INLINE_REPORT_SIZE:
+            content.update(details)
+        return content
+
+    @classmethod
+    def from_content(cls, content: Mapping[str, Any]) -> "CommandResult":
+        return cls(
+            content["server_name"],
+            bool(content["result"]),
+            list(content.get("failed_user_ids", [])),
+            content.get("report"),
+        )
+
+
+class ResultAggregator:
+    """
+    Results of the worker bots received by the coordinator, per room and
+    command event. They are kept until the command collects them, as a worker
+    may finish before the coordinator.
+    Only the results sent by `worker_user_ids` are accepted.
+    """
+
+    def __init__(
+        self,
+        worker_user_ids: Collection[str],
+        timeout: float = DEFAULT_AGGREGATION_TIMEOUT,
+        ttl: float = DEFAULT_CACHE_TTL,
+    ) -> None:
+        self.worker_user_ids = set(worker_user_ids)
+        self.worker_server_names = {
+            name for name in map(get_server_name, worker_user_ids) if name
+        }
+        self.timeout = timeout
+        self.results: MeteredTTLCache[tuple[str, str], dict[str, CommandResult]] = (
+            MeteredTTLCache("command_results", ttl=ttl)
+        )
+        self.received = asyncio.Condition()
+
+    async def on_result_event(self, room: MatrixRoom, event: UnknownEvent) -> None:
+        if event.type != RESULT_EVENT_TYPE:
+            return
+        if event.sender not in self.worker_user_ids:
+            logger.warning("Command result from an unknown bot", source=event.source)
+            return
+        content: dict[str, Any] = event.source.get("content", {})
+        try:
+            command_event_id: str = content["command_event_id"]
+            result = CommandResult.from_content(content)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning("Invalid command result", source=event.source, e=e)
+            return
+        # A bot only reports its own server
+        if get_server_name(event.sender) != result.server_name:
+            logger.warning("Command result from another server", source=event.source)
+            return
+
+        # Only the command of the same room collects it
+        self.results.setdefault((room.room_id, command_event_id), {})[
+            result.server_name
+        ] = result
+        async with self.received:
+            self.received.notify_all()
+
+    async def wait(
+        self,
+        room_id: str,
+        command_event_id: str,
+        server_names: Collection[str],
+    ) -> dict[str, CommandResult]:
+        """Wait for the results of `server_names`, return those received in time."""
+        key = (room_id, command_event_id)
+
+        def get_results() -> dict[str, CommandResult]:
+            return self.results.get(key) or {}
+
+        try:
+            async with asyncio.timeout(self.timeout), self.received:
+                await self.received.wait_for(
+                    lambda: all(name in get_results() for name in server_names)
+                )
+        except TimeoutError:
+            logger.warning(
+                "Missing command results",
+                command_event_id=command_event_id,
+                missing=[name for name in server_names if name not in get_results()],
+            )
+        return self.results.pop(key, None) or {}
@@ -0,0 +1,111 @@
+import time
+from collections.abc import Callable
+from typing import Any, TypeVar, overload
+
+import cachetools
+from typing_extensions import override
+
+K = TypeVar("K")
+V = TypeVar("V")
+T = TypeVar("T")
+
+DEFAULT_CACHE_SIZE = 5120
+DEFAULT_CACHE_TTL = 24 * 60 * 60
+
+_MISSING: Any = object()
+
+
+class MeteredTTLCache(cachetools.TTLCache[K, V]):
+    """
+    TTL cache counting its hits, misses, evictions (entries dropped to make
+    room before their expiry) and expirations.
+    `on_evict` is called with each evicted entry.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: float = DEFAULT_CACHE_SIZE,
+        ttl: float = DEFAULT_CACHE_TTL,
+        getsizeof: Callable[[V], float] | None = None,
+        on_evict: Callable[[K, V], None] | None = None,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        super().__init__(maxsize=maxsize, ttl=ttl, timer=timer, getsizeof=getsizeof)
+        self.name = name
+        self.on_evict = on_evict
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.expirations: int = 0
+
+    @override
+    def __getitem__(self, key: K) -> V:
+        value = super().__getitem__(key)
+        self.hits += 1
+        return value
+
+    @override
+    def __missing__(self, key: K) -> V:
+        self.misses += 1
+        return super().__missing__(key)
+
+    @override
+    def get(self, key: K, default: Any = None) -> Any:
+        if key not in self:
+            self.misses += 1
+            return default
+        return self[key]
+
+    @overload
+    def pop(self, key: K) -> V: ...
+
+    @overload
+    def pop(self, key: K, default: V | T) -> V | T: ...
+
+    @override
+    def pop(self, key: K, default: Any = _MISSING) -> Any:
+        # Removals read the entry too, they are not lookups
+        hits = self.hits
+        try:
+            if default is _MISSING:
+                return super().pop(key)
+            return super().pop(key, default)
+        finally:
+            self.hits = hits
+
+    @override
+    def expire(self, time: float | None = None) -> list[tuple[K, V]]:
+        expired = super().expire(time)
+        self.expirations += len(expired)
+        return expired
+
+    @override
+    def clear(self) -> None:
+        # Depending on the cachetools version, clearing pops every entry
+        counters = self.hits, self.evictions, self.expirations
+        on_evict, self.on_evict = self.on_evict, None
+        try:
+            super().clear()
+        finally:
+            self.hits, self.evictions, self.expirations = counters
+            self.on_evict = on_evict
+
+    @override
+    def popitem(self) -> tuple[K, V]:
+        key, value = super().popitem()
+        self.evictions += 1
+        if self.on_evict:
+            self.on_evict(key, value)
+        return key, value
+
+    def get_stats(self) -> dict[str, float]:
+        return {
+            "size": self.currsize,
+            "maxsize": self.maxsize,
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
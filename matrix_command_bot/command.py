@@ -5,8 +5,14 @@ from typing import Any
 from matrix_bot.bot import MatrixClient
 from nio import MatrixRoom, RoomMessage
 
+from matrix_command_bot.event_cache import EventRecord
+
 
 class ICommand(ABC):
+    # Commands declaring their keyword are only built for `!<KEYWORD>` messages,
+    # the others are built for every message
+    KEYWORD: str = ""
+
     def __init__(
         self,
         room: MatrixRoom,
@@ -22,12 +28,20 @@ class ICommand(ABC):
     @abstractmethod
     async def execute(self) -> bool: ...
 
+    def dump_state(self) -> dict[str, Any] | None:
+        """Return the JSON state to persist while waiting for a reply, if any."""
+        return None
+
+    async def load_state(self, state: Mapping[str, Any]) -> None:  # noqa: ARG002
+        """Restore the state returned by `dump_state` after a restart."""
+        return
+
     async def reply_received(self, reply: RoomMessage) -> None:  # noqa: ARG002
         return
 
     async def replace_received(
         self,
         new_content: Mapping[str, Any],  # noqa: ARG002
-        original_event: RoomMessage,  # noqa: ARG002
+        original_event: EventRecord,  # noqa: ARG002
     ) -> None:
         return
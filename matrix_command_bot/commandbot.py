@@ -1,17 +1,51 @@
 import asyncio
+from collections import Counter
 from dataclasses import dataclass, field
 from typing import Any
 
-import cachetools
 import structlog
 from matrix_bot.bot import MatrixBot
 from matrix_bot.eventparser import EventNotConcerned
-from nio import MatrixRoom, RoomMessage
+from nio import MatrixRoom, RoomMessage, UnknownEvent
+from typing_extensions import override
 
+from matrix_command_bot.aggregation import (
+    DEFAULT_AGGREGATION_TIMEOUT,
+    ResultAggregator,
+)
+from matrix_command_bot.cache import (
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_CACHE_TTL,
+    MeteredTTLCache,
+)
 from matrix_command_bot.command import ICommand
+from matrix_command_bot.event_cache import (
+    EVENT_CACHE_MAX_BYTES,
+    EventCache,
+    EventRecord,
+)
+from matrix_command_bot.metrics import (
+    monitor_event_loop_lag,
+    registry,
+    start_metrics_server,
+)
+from matrix_command_bot.scheduler import CommandScheduler
+from matrix_command_bot.store import CommandRecord, ICommandStore
+from matrix_command_bot.watchdog import LoopWatchdog
 
 logger = structlog.getLogger(__name__)
 
+COMMAND_PREFIX = "!"
+
+commands_total = registry.counter(
+    "matrix_bot_commands_total", "Commands executed", ("keyword", "result")
+)
+command_duration = registry.histogram(
+    "matrix_bot_command_duration_seconds",
+    "Duration of the commands until they complete or wait for a reply",
+    ("keyword",),
+)
+
 
 @dataclass
 class Role:
@@ -34,63 +68,269 @@ class CommandBot(MatrixBot):
     ) -> None:
         super().__init__(homeserver, username, password)
         self.commands = commands
+        # Commands without keyword are tried on every message
+        self.commands_by_keyword: dict[str, list[type[ICommand]]] = {}
+        self.commands_without_keyword: list[type[ICommand]] = []
+        for command_type in commands:
+            if command_type.KEYWORD:
+                self.commands_by_keyword.setdefault(command_type.KEYWORD, []).append(
+                    command_type
+                )
+            else:
+                self.commands_without_keyword.append(command_type)
         self.roles = roles
         self.extra_config = {}
         if extra_config:
             self.extra_config = extra_config
+        if "scheduler" not in self.extra_config:
+            self.extra_config["scheduler"] = CommandScheduler()
+        # The coordinator collects the results of the worker bots
+        if (
+            self.extra_config.get("aggregate_results")
+            and self.extra_config.get("is_coordinator", True)
+            and "result_aggregator" not in self.extra_config
+        ):
+            self.extra_config["result_aggregator"] = ResultAggregator(
+                self.extra_config.get("worker_user_ids", []),
+                self.extra_config.get(
+                    "aggregation_timeout", DEFAULT_AGGREGATION_TIMEOUT
+                ),
+                self.extra_config.get("cache_ttl", DEFAULT_CACHE_TTL),
+            )
 
-        self.recent_events_cache: cachetools.TTLCache[str, RoomMessage] = (
-            cachetools.TTLCache(maxsize=5120, ttl=24 * 60 * 60)
+        cache_ttl: float = self.extra_config.get("cache_ttl", DEFAULT_CACHE_TTL)
+        self.recent_events_cache = EventCache(
+            self.extra_config.get("events_cache_max_bytes", EVENT_CACHE_MAX_BYTES),
+            cache_ttl,
         )
-        self.commands_cache: cachetools.TTLCache[str, ICommand] = cachetools.TTLCache(
-            maxsize=5120, ttl=24 * 60 * 60
+        self.commands_cache: MeteredTTLCache[str, ICommand] = MeteredTTLCache(
+            "commands",
+            self.extra_config.get("commands_cache_size", DEFAULT_CACHE_SIZE),
+            cache_ttl,
+            on_evict=self.on_command_evicted,
+        )
+        # Event id -> id of the command event its reply chain or thread leads to
+        self.related_command_ids: MeteredTTLCache[str, str] = MeteredTTLCache(
+            "related_commands",
+            self.extra_config.get("related_commands_cache_size", DEFAULT_CACHE_SIZE),
+            cache_ttl,
         )
 
         self.background_tasks: set[asyncio.Task[Any]] = set()
+        # Number of events dropped before creating a handling task, per reason
+        self.skipped_events: Counter[str] = Counter()
+        # Commands waiting for a reply and the event index outlive a restart
+        self.command_store: ICommandStore | None = self.extra_config.get(
+            "command_store"
+        )
+        # Reports the code blocking the event loop longer than the threshold
+        blocked_loop_threshold: float = self.extra_config.get(
+            "blocked_loop_threshold", 0
+        )
+        self.watchdog = (
+            LoopWatchdog(blocked_loop_threshold) if blocked_loop_threshold else None
+        )
 
         self.callbacks.register_on_message_event(self.store_event_in_cache)
         self.callbacks.register_on_message_event(self.launch_handle_event_task)
+        self.register_metrics()
+
+    def register_metrics(self) -> None:
+        scheduler: CommandScheduler = self.extra_config["scheduler"]
+        registry.counter(
+            "matrix_bot_skipped_events_total",
+            "Events dropped before creating a handling task",
+            ("reason",),
+            collect=lambda: {(reason,): n for reason, n in self.skipped_events.items()},
+        )
+        registry.gauge(
+            "matrix_bot_scheduled_commands",
+            "Commands running or waiting for a slot",
+            ("state",),
+            collect=lambda: {
+                ("running",): len(scheduler.running),
+                ("queued",): len(scheduler.queued),
+            },
+        )
+        registry.gauge(
+            "matrix_bot_cache",
+            "Size and counters of the caches",
+            ("cache", "stat"),
+            collect=lambda: {
+                (cache, stat): value
+                for cache, stats in self.get_cache_stats().items()
+                for stat, value in stats.items()
+            },
+        )
+
+    @override
+    async def main(self) -> None:
+        result_aggregator: ResultAggregator | None = self.extra_config.get(
+            "result_aggregator"
+        )
+        if result_aggregator:
+            self.matrix_client.add_event_callback(
+                result_aggregator.on_result_event,  # pyright: ignore[reportArgumentType]
+                UnknownEvent,
+            )
+        monitors: list[asyncio.Task[None]] = []
+        if self.watchdog:
+            monitors.append(asyncio.create_task(self.watchdog.run()))
+        metrics_runner = None
+        metrics_port: int = self.extra_config.get("metrics_port", 0)
+        if metrics_port:
+            metrics_runner = await start_metrics_server(
+                self.extra_config.get("metrics_host", "127.0.0.1"), metrics_port
+            )
+            monitors.append(asyncio.create_task(monitor_event_loop_lag()))
+        try:
+            await super().main()
+        finally:
+            for monitor in monitors:
+                monitor.cancel()
+            await asyncio.gather(*monitors, return_exceptions=True)
+            if metrics_runner:
+                await metrics_runner.cleanup()
+
+    def on_command_evicted(self, command_event_id: str, command: ICommand) -> None:
+        # The command is evicted before its TTL: the cache is too small
+        logger.warning(
+            "Command root evicted from the cache, the replies to it will be ignored",
+            command=command.__class__.__name__,
+            command_event_id=command_event_id,
+            cache_stats=self.commands_cache.get_stats(),
+        )
+
+    def get_cache_stats(self) -> dict[str, dict[str, float]]:
+        return {
+            cache.name: cache.get_stats()
+            for cache in (
+                self.recent_events_cache,
+                self.commands_cache,
+                self.related_command_ids,
+            )
+        }
 
     async def store_event_in_cache(
         self,
         _room: MatrixRoom,
         message: RoomMessage,
     ) -> None:
-        self.recent_events_cache[message.event_id] = message
-
-    def get_replied_event(self, message: RoomMessage) -> RoomMessage | None:
-        return self.recent_events_cache.get(
-            message.source.get("content", {})
-            .get("m.relates_to", {})
-            .get("m.in_reply_to", {})
-            .get("event_id")
-        )
+        self.recent_events_cache.add(message)
 
-    def get_related_command(self, message: RoomMessage) -> ICommand | None:
-        content = message.source.get("content", {})
-        if not content:
+    def index_related_command(self, message: RoomMessage) -> None:
+        """Record the command the message relates to, if any.
+
+        The parents are indexed before their replies, so a reply chain of any
+        depth is resolved from the entry of the direct parent.
+        """
+        relates_to = message.source.get("content", {}).get("m.relates_to", {})
+        parent_event_ids: list[str | None] = []
+        if relates_to.get("rel_type") == "m.thread":
+            parent_event_ids.append(relates_to.get("event_id"))
+        parent_event_ids.append(relates_to.get("m.in_reply_to", {}).get("event_id"))
+
+        for parent_event_id in parent_event_ids:
+            if not parent_event_id:
+                continue
+            if parent_event_id in self.commands_cache:
+                command_event_id = parent_event_id
+            else:
+                command_event_id = self.related_command_ids.get(parent_event_id)
+            if not command_event_id and self.command_store:
+                command_event_id = self.command_store.get_related_command_id(
+                    parent_event_id
+                )
+            if command_event_id:
+                self.related_command_ids[message.event_id] = command_event_id
+                if self.command_store:
+                    self.command_store.save_related_command_id(
+                        message.event_id, command_event_id
+                    )
+                return
+
+    def get_related_command(
+        self, message: RoomMessage | EventRecord
+    ) -> ICommand | None:
+        command_event_id = self.related_command_ids.get(message.event_id)
+        if command_event_id is None:
+            return None
+        # The command may have expired before the events relating to it
+        return self.commands_cache.get(command_event_id)
+
+    async def find_related_command(
+        self, message: RoomMessage | EventRecord
+    ) -> ICommand | None:
+        """Same as `get_related_command`, restoring the command from the store."""
+        command_event_id = self.related_command_ids.get(message.event_id)
+        if command_event_id is None:
+            return None
+        related_command = self.commands_cache.get(command_event_id)
+        if related_command:
+            return related_command
+        return await self.restore_command(command_event_id)
+
+    async def restore_command(self, command_event_id: str) -> ICommand | None:
+        if self.command_store is None:
+            return None
+        record = self.command_store.get_command(command_event_id)
+        if record is None:
             return None
 
-        # let's check if we have a thread root message and if it is a command
-        if content.get("m.relates_to", {}).get("rel_type") == "m.thread":
-            command = self.commands_cache.get(
-                content.get("m.relates_to", {}).get("event_id")
+        command_types = [c for c in self.commands if c.__name__ == record.command_type]
+        message = RoomMessage.parse_event(record.source)
+        if not command_types or not isinstance(message, RoomMessage):
+            self.command_store.delete_command(command_event_id)
+            return None
+        room = MatrixRoom(record.room_id, self.matrix_client.user_id)
+        try:
+            command = command_types[0](
+                room, message, self.matrix_client, self.extra_config
+            )
+            await command.load_state(record.state)
+        except Exception as e:  # noqa: BLE001
+            logger.warning(
+                "Cannot restore command %s", record.command_type, e=e, message=message
             )
-            if command:
-                return command
-
-        # no thread here, let's check the reply chain for a command to validate
-        replied_event = message
-        while replied_event:
-            replied_event = self.get_replied_event(replied_event)
-            if replied_event:
-                command = self.commands_cache.get(replied_event.event_id)
-                if command:
-                    return command
+            self.command_store.delete_command(command_event_id)
+            return None
 
-        return None
+        # Another event may have restored it in the meantime
+        command = self.commands_cache.setdefault(command_event_id, command)
+        logger.info("Command restored", command=command)
+        return command
+
+    def persist_command(self, command: ICommand) -> None:
+        if self.command_store is None:
+            return
+        command_event_id = command.message.event_id
+        state = command.dump_state()
+        if state is None:
+            self.command_store.delete_command(command_event_id)
+            return
+        self.command_store.save_command(
+            CommandRecord(
+                command_event_id,
+                command.room.room_id,
+                command.__class__.__name__,
+                command.message.source,
+                state,
+            )
+        )
+        # Lets the replies to the command itself be indexed after a restart
+        self.command_store.save_related_command_id(command_event_id, command_event_id)
 
-    def get_replaced_event(self, message: RoomMessage) -> RoomMessage | None:
+    def get_candidate_commands(self, message: RoomMessage) -> list[type[ICommand]]:
+        body = message.source.get("content", {}).get("body")
+        if isinstance(body, str) and body.startswith(COMMAND_PREFIX):
+            words = body[len(COMMAND_PREFIX) :].split(maxsplit=1)
+            if words and words[0] in self.commands_by_keyword:
+                return (
+                    self.commands_by_keyword[words[0]] + self.commands_without_keyword
+                )
+        return self.commands_without_keyword
+
+    def get_replaced_event(self, message: RoomMessage) -> EventRecord | None:
         relates_to_payload = message.source.get("content", {}).get("m.relates_to", {})
         if relates_to_payload.get("rel_type", "") == "m.replace":
             replace_event_id = relates_to_payload.get("event_id", None)
@@ -98,11 +338,35 @@ class CommandBot(MatrixBot):
                 return self.recent_events_cache.get(replace_event_id)
         return None
 
+    def get_skip_reason(self, message: RoomMessage) -> str | None:
+        """Return why the event can't concern a command, None if it may."""
+        if message.sender == self.matrix_client.user_id:
+            return "own_message"
+        content = message.source.get("content", {})
+        if content.get("msgtype") == "m.notice":
+            return "notice"
+        # Replies, threads and edits may relate to a command
+        if content.get("m.relates_to"):
+            return None
+        body = content.get("body")
+        if isinstance(body, str) and body.startswith(COMMAND_PREFIX):
+            return None
+        return "not_a_command"
+
     async def launch_handle_event_task(
         self,
         room: MatrixRoom,
         message: RoomMessage,
     ) -> None:
+        skip_reason = self.get_skip_reason(message)
+        if skip_reason:
+            if skip_reason == "own_message":
+                # Users can reply to the bot messages, they need to be indexed.
+                # The bot only answers commands that are already registered.
+                self.index_related_command(message)
+            self.skipped_events[skip_reason] += 1
+            return
+
         # Handle event in a separate task so it doesn't block the event loop
         task = asyncio.create_task(
             self.handle_event(room, message), name=f"HandleEvent-{message.event_id}"
@@ -116,13 +380,17 @@ class CommandBot(MatrixBot):
         room: MatrixRoom,
         message: RoomMessage,
     ) -> None:
+        # Done before any await: handling tasks start in the order of the events,
+        # so the parent of this message has already been indexed
+        self.index_related_command(message)
+
         # Let's ignore bot own messages
         if message.sender == self.matrix_client.user_id:
             return
 
         replaced_event = self.get_replaced_event(message)
         if replaced_event:
-            related_command = self.get_related_command(replaced_event)
+            related_command = await self.find_related_command(replaced_event)
             if related_command:
                 new_content = message.source.get("content", {}).get("m.new_content")
                 logger.debug(
@@ -133,6 +401,7 @@ class CommandBot(MatrixBot):
                 )
                 if self.can_interact(message.sender, related_command):
                     await related_command.replace_received(new_content, replaced_event)
+                    self.persist_command(related_command)
                 else:
                     if self.extra_config.get("is_coordinator", True):
                         await self.matrix_client.send_markdown_message(
@@ -148,7 +417,7 @@ class CommandBot(MatrixBot):
                     )
                 return
         else:
-            related_command = self.get_related_command(message)
+            related_command = await self.find_related_command(message)
             if related_command:
                 logger.debug(
                     "A reply to a command has been received",
@@ -157,6 +426,7 @@ class CommandBot(MatrixBot):
                 )
                 if self.can_interact(message.sender, related_command):
                     await related_command.reply_received(message)
+                    self.persist_command(related_command)
                 else:
                     if self.extra_config.get("is_coordinator", True):
                         await self.matrix_client.send_markdown_message(
@@ -172,14 +442,18 @@ class CommandBot(MatrixBot):
                     )
                 return
 
-        for command_type in self.commands:
+        for command_type in self.get_candidate_commands(message):
             try:
                 command = command_type(
                     room, message, self.matrix_client, self.extra_config
                 )
                 if self.can_execute(message.sender, command):
                     self.commands_cache[message.event_id] = command
-                    await command.execute()
+                    keyword = command.KEYWORD or command_type.__name__
+                    with command_duration.time(keyword):
+                        result = await command.execute()
+                    commands_total.inc(keyword, "success" if result else "failure")
+                    self.persist_command(command)
                 else:
                     if self.extra_config.get("is_coordinator", True):
                         await self.matrix_client.send_markdown_message(
@@ -0,0 +1,70 @@
+import sys
+from typing import Any
+
+from nio import RoomMessage
+
+from matrix_command_bot.cache import DEFAULT_CACHE_TTL, MeteredTTLCache
+
+# Budget of the recent events cache, around 10k events
+EVENT_CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+
+class EventRecord:
+    """
+    What the bot needs to know about a past event: who sent it and what it
+    relates to. The full events are only kept for the command roots, as the
+    `message` of their command.
+    """
+
+    __slots__ = ("event_id", "in_reply_to", "replaces", "sender", "thread_root")
+
+    def __init__(
+        self,
+        event_id: str,
+        sender: str,
+        in_reply_to: str | None = None,
+        thread_root: str | None = None,
+        replaces: str | None = None,
+    ) -> None:
+        self.event_id = event_id
+        self.sender = sender
+        self.in_reply_to = in_reply_to
+        self.thread_root = thread_root
+        self.replaces = replaces
+
+    @classmethod
+    def from_message(cls, message: RoomMessage) -> "EventRecord":
+        relates_to: dict[str, Any] = message.source.get("content", {}).get(
+            "m.relates_to", {}
+        )
+        rel_type = relates_to.get("rel_type")
+        return cls(
+            message.event_id,
+            message.sender,
+            in_reply_to=relates_to.get("m.in_reply_to", {}).get("event_id"),
+            thread_root=relates_to.get("event_id") if rel_type == "m.thread" else None,
+            replaces=relates_to.get("event_id") if rel_type == "m.replace" else None,
+        )
+
+    def get_size(self) -> int:
+        return sys.getsizeof(self) + sum(
+            sys.getsizeof(getattr(self, slot))
+            for slot in self.__slots__
+            if getattr(self, slot) is not None
+        )
+
+
+class EventCache(MeteredTTLCache[str, EventRecord]):
+    """TTL cache of event records, bounded by their size in bytes."""
+
+    def __init__(
+        self, max_bytes: int = EVENT_CACHE_MAX_BYTES, ttl: float = DEFAULT_CACHE_TTL
+    ) -> None:
+        super().__init__(
+            "recent_events", maxsize=max_bytes, ttl=ttl, getsizeof=EventRecord.get_size
+        )
+
+    def add(self, message: RoomMessage) -> EventRecord:
+        record = EventRecord.from_message(message)
+        self[record.event_id] = record
+        return record
@@ -0,0 +1,224 @@
+import asyncio
+import bisect
+import math
+import re
+import time
+from collections.abc import Callable, Generator, Iterator, Mapping
+from contextlib import contextmanager
+from typing import TypeVar
+
+import structlog
+from aiohttp import web
+
+logger = structlog.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+EVENT_LOOP_LAG_INTERVAL = 1.0
+
+Labels = tuple[str, ...]
+M = TypeVar("M", bound="Metric")
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labelnames: Labels, labels: Labels, extra: str = "") -> str:
+    pairs = [
+        f'{name}="{escape_label_value(value)}"'
+        for name, value in zip(labelnames, labels, strict=True)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    TYPE = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Labels = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def render_samples(self) -> Iterator[str]:
+        return iter(())
+
+    def render(self) -> str:
+        return "".join(
+            [
+                f"# HELP {self.name} {self.documentation}\n",
+                f"# TYPE {self.name} {self.TYPE}\n",
+                *(f"{sample}\n" for sample in self.render_samples()),
+            ]
+        )
+
+
+class Counter(Metric):
+    """Counter updated by the code, or read from `collect` when it is given."""
+
+    TYPE = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Labels = (),
+        collect: Callable[[], Mapping[Labels, float]] | None = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[Labels, float] = {}
+        self.collect = collect
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render_samples(self) -> Iterator[str]:
+        values = self.collect() if self.collect else self.values
+        for labels, value in values.items():
+            yield (
+                f"{self.name}{format_labels(self.labelnames, labels)} "
+                f"{format_value(value)}"
+            )
+
+
+class Gauge(Counter):
+    TYPE = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        self.values[labels] = value
+
+    def remove(self, *labels: str) -> None:
+        """Stop exporting the series of `labels`, e.g. once its command is over."""
+        self.values.pop(labels, None)
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Labels = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        # Per labels: count of each bucket (not cumulative), sum
+        self.values: dict[Labels, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        if labels not in self.values:
+            self.values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = self.values[labels]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Generator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render_samples(self) -> Iterator[str]:
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts, strict=True):
+                cumulative += count
+                bucket_labels = format_labels(
+                    self.labelnames, labels, f'le="{format_value(bound)}"'
+                )
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            sample_labels = format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{sample_labels} {format_value(total[0])}"
+            yield f"{self.name}_count{sample_labels} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: M) -> M:
+        # Registering again replaces the metric, e.g. the gauges of a new bot
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Labels = (),
+        collect: Callable[[], Mapping[Labels, float]] | None = None,
+    ) -> Counter:
+        return self.register(Counter(name, documentation, labelnames, collect))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Labels = (),
+        collect: Callable[[], Mapping[Labels, float]] | None = None,
+    ) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, collect))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Labels = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self.metrics.values())
+
+
+registry = MetricsRegistry()
+
+event_loop_lag = registry.gauge(
+    "matrix_bot_event_loop_lag_seconds",
+    "Delay of a periodic wake up of the event loop",
+)
+
+
+def get_endpoint_label(endpoint: str) -> str:
+    """Endpoint without its query and ids, to keep the number of series bounded."""
+    path = endpoint.split("?", 1)[0]
+    # MAS looks the users up by their localpart
+    path = re.sub(r"(?<=/by-username/)[^/]+", "{id}", path)
+    return re.sub(
+        r"/(?:[@!#$][^/]*|%40[^/]*|%21[^/]*|[0-9A-Z]{26})(?=/|$)", "/{id}", path
+    )
+
+
+async def monitor_event_loop_lag(interval: float = EVENT_LOOP_LAG_INTERVAL) -> None:
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        event_loop_lag.set(max(0.0, time.perf_counter() - start - interval))
+
+
+async def handle_metrics(_request: web.Request) -> web.Response:
+    return web.Response(
+        text=registry.render(), content_type="text/plain", charset="utf-8"
+    )
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics served on http://%s:%d/metrics", host, port)
+    return runner
@@ -0,0 +1,87 @@
+import json
+import zlib
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import IO, Any, Protocol
+
+import structlog
+
+try:
+    import zstandard  # pyright: ignore[reportMissingImports]
+except ImportError:
+    zstandard = None
+
+logger = structlog.getLogger(__name__)
+
+# Encoded chunks are grouped before being compressed and written
+WRITE_BUFFER_SIZE = 64 * 1024
+
+
+@dataclass
+class ReportConfig:
+    compression: str | None = None  # "gzip" or "zstd"
+    json_lines: bool = False
+
+
+report_config = ReportConfig()
+
+
+class Compressor(Protocol):
+    def compress(self, data: bytes, /) -> bytes: ...
+
+    def flush(self) -> bytes: ...
+
+
+class NoCompressor:
+    def compress(self, data: bytes, /) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def get_compressor(compression: str | None) -> tuple[Compressor, str, str | None]:
+    """Return the compressor, the file extension and the mime type override."""
+    if compression == "zstd":
+        if zstandard is not None:
+            return zstandard.ZstdCompressor().compressobj(), ".zst", "application/zstd"
+        logger.warning("zstandard is not installed, the report is gzipped instead")
+        compression = "gzip"
+    if compression == "gzip":
+        # wbits=31 produces a gzip container
+        return zlib.compressobj(wbits=31), ".gz", "application/gzip"
+    return NoCompressor(), "", None
+
+
+def iter_encoded_report(
+    json_report: dict[str, Any], *, json_lines: bool
+) -> Iterator[str]:
+    if json_lines:
+        # One line per top level entry, i.e. per user for the user reports
+        for key in sorted(json_report):
+            yield json.dumps({key: json_report[key]}, sort_keys=True)
+            yield "\n"
+    else:
+        yield from json.JSONEncoder(indent=2, sort_keys=True).iterencode(json_report)
+
+
+def write_report(
+    json_report: dict[str, Any],
+    file: IO[bytes],
+    compressor: Compressor,
+    *,
+    json_lines: bool = False,
+) -> None:
+    """Encode the report into the file chunk by chunk, never as a whole string."""
+    chunks: list[str] = []
+    buffered = 0
+    for chunk in iter_encoded_report(json_report, json_lines=json_lines):
+        chunks.append(chunk)
+        buffered += len(chunk)
+        if buffered >= WRITE_BUFFER_SIZE:
+            file.write(compressor.compress("".join(chunks).encode()))
+            chunks = []
+            buffered = 0
+    file.write(compressor.compress("".join(chunks).encode()))
+    file.write(compressor.flush())
+    file.flush()
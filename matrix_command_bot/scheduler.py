@@ -0,0 +1,87 @@
+import asyncio
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+
+import structlog
+
+from matrix_command_bot.command import ICommand
+
+logger = structlog.getLogger(__name__)
+
+
+@dataclass
+class ScheduledCommand:
+    command: ICommand
+    since: float = field(default_factory=time.monotonic)
+    slot: asyncio.Future[None] | None = None
+
+
+class CommandScheduler:
+    """
+    Limit the number of commands executed at the same time, globally and per
+    command class (by class name). A limit of 0 disables it.
+    The commands over the limits wait for a slot in FIFO order, except that a
+    command whose class has room is not held back by other blocked classes.
+    """
+
+    def __init__(
+        self,
+        max_running: int = 0,
+        max_running_per_command: Mapping[str, int] | None = None,
+    ) -> None:
+        self.max_running = max_running
+        self.max_running_per_command = dict(max_running_per_command or {})
+        self.running: list[ScheduledCommand] = []
+        self.queued: list[ScheduledCommand] = []
+
+    def can_run(self, command: ICommand) -> bool:
+        if self.max_running and len(self.running) >= self.max_running:
+            return False
+        limit = self.max_running_per_command.get(command.__class__.__name__)
+        if not limit:
+            return True
+        nb_running = sum(
+            1
+            for scheduled in self.running
+            if scheduled.command.__class__ is command.__class__
+        )
+        return nb_running < limit
+
+    def try_acquire(self, command: ICommand) -> bool:
+        if not self.can_run(command):
+            return False
+        self.running.append(ScheduledCommand(command))
+        return True
+
+    async def acquire(self, command: ICommand) -> None:
+        """Wait for a slot, use `try_acquire` first to avoid queueing."""
+        slot: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        scheduled = ScheduledCommand(command, slot=slot)
+        self.queued.append(scheduled)
+        logger.info(
+            "Command queued",
+            command=command.__class__.__name__,
+            nb_queued=len(self.queued),
+        )
+        try:
+            await slot
+        except asyncio.CancelledError:
+            if scheduled in self.queued:
+                self.queued.remove(scheduled)
+            else:
+                # The slot has been given right before the cancellation
+                self.release(command)
+            raise
+
+    def release(self, command: ICommand) -> None:
+        self.running = [
+            scheduled for scheduled in self.running if scheduled.command is not command
+        ]
+        for scheduled in list(self.queued):
+            if self.can_run(scheduled.command):
+                self.queued.remove(scheduled)
+                scheduled.since = time.monotonic()
+                self.running.append(scheduled)
+                if scheduled.slot and not scheduled.slot.done():
+                    scheduled.slot.set_result(None)
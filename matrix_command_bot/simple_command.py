@@ -7,12 +7,14 @@ from nio import MatrixRoom, RoomMessage
 from typing_extensions import override
 
 from matrix_command_bot.command import ICommand
+from matrix_command_bot.scheduler import CommandScheduler
 from matrix_command_bot.step import CommandAction, CommandWithSteps, ICommandStep
 from matrix_command_bot.step.reaction_steps import (
     ReactionCommandState,
     ReactionStep,
     ResultReactionStep,
 )
+from matrix_command_bot.util import set_status_reaction
 
 
 class SimpleExecuteStep(ICommandStep):
@@ -30,7 +32,22 @@ class SimpleExecuteStep(ICommandStep):
     async def execute(
         self, reply: RoomMessage | None = None
     ) -> tuple[bool, CommandAction]:
-        return await self.fct(), CommandAction.CONTINUE
+        scheduler: CommandScheduler | None = self.command.extra_config.get("scheduler")
+        if scheduler is None:
+            return await self.fct(), CommandAction.CONTINUE
+
+        if not scheduler.try_acquire(self.command):
+            self.state.current_reaction_event_id = await set_status_reaction(
+                self.command, "⏳", self.state.current_reaction_event_id
+            )
+            await scheduler.acquire(self.command)
+            self.state.current_reaction_event_id = await set_status_reaction(
+                self.command, "🚀", self.state.current_reaction_event_id
+            )
+        try:
+            return await self.fct(), CommandAction.CONTINUE
+        finally:
+            scheduler.release(self.command)
 
 
 class SimpleCommand(CommandWithSteps, ABC):
@@ -58,5 +75,17 @@ class SimpleCommand(CommandWithSteps, ABC):
     async def should_execute(self) -> bool:
         return True
 
+    @override
+    def dump_state(self) -> dict[str, Any] | None:
+        state = super().dump_state()
+        if state is not None:
+            state["state"] = self.state.dump()
+        return state
+
+    @override
+    async def load_state(self, state: Mapping[str, Any]) -> None:
+        await super().load_state(state)
+        self.state.load(state["state"])
+
     @abstractmethod
     async def simple_execute(self) -> bool: ...
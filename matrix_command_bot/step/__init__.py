@@ -1,3 +1,4 @@
+import time
 from abc import ABC, abstractmethod
 from collections.abc import Mapping
 from enum import Enum
@@ -9,6 +10,8 @@ from nio import MatrixRoom, RoomMessage
 from typing_extensions import override
 
 from matrix_command_bot.command import ICommand
+from matrix_command_bot.metrics import registry
+from matrix_command_bot.tracing import Span, get_trace_id, tracing_config
 
 
 class CommandAction(Enum):
@@ -20,6 +23,12 @@ class CommandAction(Enum):
 
 logger = structlog.getLogger(__name__)
 
+step_duration = registry.histogram(
+    "matrix_bot_step_duration_seconds",
+    "Duration of the command steps, waits for a reply excluded",
+    ("command", "step"),
+)
+
 
 class ICommandStep:
     def __init__(
@@ -34,6 +43,12 @@ class ICommandStep:
     ) -> tuple[bool, CommandAction]:
         return True, CommandAction.CONTINUE
 
+    def dump_state(self) -> dict[str, Any]:
+        return {}
+
+    def load_state(self, state: Mapping[str, Any]) -> None:  # noqa: ARG002
+        return
+
 
 class CommandWithSteps(ICommand, ABC):
     def __init__(
@@ -47,6 +62,10 @@ class CommandWithSteps(ICommand, ABC):
         self.current_step_index: int = 0
         self.current_result = True
         self.is_step_running = False
+        self.is_waiting_for_reply = False
+        # Spans of the command and of its steps, keyed by the command event
+        self.span: Span | None = None
+        self.waiting_since: float | None = None
 
     @abstractmethod
     async def create_steps(self) -> list[ICommandStep]: ...
@@ -57,6 +76,7 @@ class CommandWithSteps(ICommand, ABC):
         return await self.resume_execute(None)
 
     async def resume_execute(self, reply: RoomMessage | None) -> bool:
+        self.is_waiting_for_reply = False
         while self.current_step_index < len(self.steps):
             step = self.steps[self.current_step_index]
 
@@ -66,8 +86,10 @@ class CommandWithSteps(ICommand, ABC):
             if not res:
                 self.current_result = False
             if action == CommandAction.ABORT:
+                await self.end_span()
                 return self.current_result
             if action == CommandAction.WAIT_FOR_NEXT_REPLY:
+                self.is_waiting_for_reply = True
                 return True
             if action == CommandAction.RETRY:
                 continue
@@ -75,15 +97,81 @@ class CommandWithSteps(ICommand, ABC):
             reply = None
             self.current_step_index += 1
 
+        await self.end_span()
         return self.current_result
 
+    def get_span(self) -> Span:
+        # Restored commands start a new span
+        if self.span is None:
+            self.span = Span(
+                self.__class__.__name__,
+                get_trace_id(self.message.event_id),
+                attributes={"command_id": self.message.event_id},
+            )
+        return self.span
+
+    async def end_span(self) -> None:
+        self.get_span().end(ok=self.current_result, nb_steps=len(self.steps))
+        if tracing_config.exporter:
+            await tracing_config.exporter.flush()
+
+    @override
+    def dump_state(self) -> dict[str, Any] | None:
+        # A step interrupted by a restart is not replayed, only the waits are kept
+        if not self.is_waiting_for_reply:
+            return None
+        return {
+            "step_index": self.current_step_index,
+            "result": self.current_result,
+            "steps": [step.dump_state() for step in self.steps],
+        }
+
+    @override
+    async def load_state(self, state: Mapping[str, Any]) -> None:
+        self.steps = await self.create_steps()
+        if len(self.steps) != len(state["steps"]):
+            msg = f"{len(state['steps'])} steps persisted, {len(self.steps)} created"
+            raise ValueError(msg)
+        for step, step_state in zip(self.steps, state["steps"], strict=True):
+            step.load_state(step_state)
+        self.current_step_index = state["step_index"]
+        self.current_result = state["result"]
+        self.is_waiting_for_reply = True
+
     async def execute_step(
         self, step: ICommandStep, reply: RoomMessage | None
     ) -> tuple[bool, CommandAction]:
+        command_span = self.get_span()
+        span = Span(
+            step.__class__.__name__,
+            command_span.trace_id,
+            command_span.span_id,
+            {
+                "command_id": self.message.event_id,
+                "step_index": self.current_step_index,
+            },
+        )
+        if self.waiting_since is not None:
+            # Time spent waiting for the reply this step is resumed with
+            span.attributes["waited"] = round(
+                time.perf_counter() - self.waiting_since, 3
+            )
+            self.waiting_since = None
+
         self.is_step_running = True
-        result = await step.execute(reply)
-        self.is_step_running = False
-        return result
+        try:
+            with step_duration.time(self.__class__.__name__, step.__class__.__name__):
+                res, action = await step.execute(reply)
+        except Exception as e:
+            span.end(ok=False, error=repr(e))
+            raise
+        finally:
+            self.is_step_running = False
+
+        span.end(ok=res, action=action.name)
+        if action == CommandAction.WAIT_FOR_NEXT_REPLY:
+            self.waiting_since = time.perf_counter()
+        return res, action
 
     @override
     async def reply_received(self, reply: RoomMessage) -> None:
@@ -1,3 +1,6 @@
+from collections.abc import Mapping
+from typing import Any
+
 from nio import RoomMessage
 from typing_extensions import override
 
@@ -13,6 +16,12 @@ class ReactionCommandState:
     def __init__(self) -> None:
         self.current_reaction_event_id: str | None = None
 
+    def dump(self) -> dict[str, Any]:
+        return dict(vars(self))
+
+    def load(self, state: Mapping[str, Any]) -> None:
+        vars(self).update(state)
+
 
 class ReactionStep(ICommandStep):
     def __init__(
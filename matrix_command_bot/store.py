@@ -0,0 +1,140 @@
+import json
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any
+
+import structlog
+
+logger = structlog.getLogger(__name__)
+
+# Same lifetime as the in-memory caches of the bot
+DEFAULT_TTL = 24 * 60 * 60
+
+
+@dataclass
+class CommandRecord:
+    event_id: str
+    room_id: str
+    command_type: str
+    source: dict[str, Any]
+    state: dict[str, Any]
+
+
+class ICommandStore(ABC):
+    """
+    Persistence of the commands waiting for a reply and of the event index,
+    so that they survive a restart. Records are only read back on demand.
+    """
+
+    @abstractmethod
+    def get_command(self, event_id: str) -> CommandRecord | None: ...
+
+    @abstractmethod
+    def save_command(self, record: CommandRecord) -> None: ...
+
+    @abstractmethod
+    def delete_command(self, event_id: str) -> None: ...
+
+    @abstractmethod
+    def get_related_command_id(self, event_id: str) -> str | None: ...
+
+    @abstractmethod
+    def save_related_command_id(self, event_id: str, command_event_id: str) -> None: ...
+
+    def close(self) -> None:
+        return
+
+
+class SQLiteCommandStore(ICommandStore):
+    """
+    SQLite command store. Every call is a single indexed row read or write,
+    short enough to be done from the event loop. Expired rows are purged when
+    the store is opened, nothing else is read until it is asked for.
+    """
+
+    def __init__(self, path: str, ttl: float = DEFAULT_TTL) -> None:
+        self.ttl = ttl
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS commands ("
+            "event_id TEXT PRIMARY KEY, room_id TEXT NOT NULL, "
+            "command_type TEXT NOT NULL, source TEXT NOT NULL, "
+            "state TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS related_commands ("
+            "event_id TEXT PRIMARY KEY, command_event_id TEXT NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+        for table in ("commands", "related_commands"):
+            self.connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_updated_at ON {table} (updated_at)"
+            )
+        self.purge()
+
+    def get_expiry(self) -> float:
+        return time.time() - self.ttl
+
+    def purge(self) -> None:
+        expiry = self.get_expiry()
+        nb_commands = self.connection.execute(
+            "DELETE FROM commands WHERE updated_at < ?", (expiry,)
+        ).rowcount
+        nb_events = self.connection.execute(
+            "DELETE FROM related_commands WHERE updated_at < ?", (expiry,)
+        ).rowcount
+        logger.info(
+            "Expired commands purged from the store",
+            nb_commands=nb_commands,
+            nb_events=nb_events,
+        )
+
+    def get_command(self, event_id: str) -> CommandRecord | None:
+        row = self.connection.execute(
+            "SELECT room_id, command_type, source, state FROM commands "
+            "WHERE event_id = ? AND updated_at >= ?",
+            (event_id, self.get_expiry()),
+        ).fetchone()
+        if row is None:
+            return None
+        room_id, command_type, source, state = row
+        return CommandRecord(
+            event_id, room_id, command_type, json.loads(source), json.loads(state)
+        )
+
+    def save_command(self, record: CommandRecord) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO commands VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                record.event_id,
+                record.room_id,
+                record.command_type,
+                json.dumps(record.source),
+                json.dumps(record.state),
+                time.time(),
+            ),
+        )
+
+    def delete_command(self, event_id: str) -> None:
+        self.connection.execute("DELETE FROM commands WHERE event_id = ?", (event_id,))
+
+    def get_related_command_id(self, event_id: str) -> str | None:
+        row = self.connection.execute(
+            "SELECT command_event_id FROM related_commands "
+            "WHERE event_id = ? AND updated_at >= ?",
+            (event_id, self.get_expiry()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def save_related_command_id(self, event_id: str, command_event_id: str) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO related_commands VALUES (?, ?, ?)",
+            (event_id, command_event_id, time.time()),
+        )
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import json
+import secrets
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import structlog
+
+logger = structlog.getLogger(__name__)
+
+SCOPE_NAME = "matrix_command_bot"
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+# The spans are only written when a command ends, the oldest are dropped
+# beyond this if none does
+MAX_PENDING_SPANS = 10000
+
+
+def get_trace_id(command_event_id: str) -> str:
+    # Derived from the command event, so the spans of every bot share the trace
+    return hashlib.sha256(command_event_id.encode()).hexdigest()[:32]
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    parent_span_id: str | None = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+    span_id: str = field(default_factory=lambda: secrets.token_hex(8))
+    start_time: float = field(default_factory=time.time)
+    started_at: float = field(default_factory=time.perf_counter)
+    duration: float | None = None
+    ok: bool = True
+
+    def end(self, *, ok: bool = True, **attributes: Any) -> None:  # noqa: ANN401
+        self.duration = time.perf_counter() - self.started_at
+        self.ok = ok
+        self.attributes.update(attributes)
+        logger.info(
+            "Span ended",
+            span=self.name,
+            trace_id=self.trace_id,
+            duration=round(self.duration, 6),
+            ok=ok,
+            **self.attributes,
+        )
+        if tracing_config.exporter:
+            tracing_config.exporter.export(self)
+
+    def to_otlp(self) -> dict[str, Any]:
+        start_ns = int(self.start_time * 1e9)
+        otlp_span: dict[str, Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int((self.duration or 0) * 1e9)),
+            "attributes": [
+                {"key": key, "value": get_otlp_value(value)}
+                for key, value in self.attributes.items()
+            ],
+            "status": {"code": STATUS_OK if self.ok else STATUS_ERROR},
+        }
+        if self.parent_span_id:
+            otlp_span["parentSpanId"] = self.parent_span_id
+        return otlp_span
+
+
+def get_otlp_value(value: Any) -> dict[str, Any]:  # noqa: ANN401
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class FileSpanExporter:
+    """
+    Append the spans to a file in the OTLP JSON format, one export request per
+    line as the OpenTelemetry Collector file exporter does. The spans are
+    buffered and written when `flush` is called, at the end of each command.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        service_name: str = "matrix-admin-bot",
+        max_pending: int = MAX_PENDING_SPANS,
+    ) -> None:
+        self.path = path
+        self.service_name = service_name
+        self.pending: deque[Span] = deque(maxlen=max_pending)
+        self.dropped = 0
+        self.lock = asyncio.Lock()
+
+    def export(self, span: Span) -> None:
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped += 1
+        self.pending.append(span)
+
+    async def flush(self) -> None:
+        if self.dropped:
+            logger.warning("%s spans dropped before being written", self.dropped)
+            self.dropped = 0
+        if not self.pending:
+            return
+        spans = list(self.pending)
+        self.pending.clear()
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": self.service_name},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": SCOPE_NAME},
+                            "spans": [span.to_otlp() for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        # Written from a thread, as the reports are, one request at a time so
+        # that the lines don't interleave
+        async with self.lock:
+            await asyncio.to_thread(self.write, json.dumps(request) + "\n")
+
+    def write(self, line: str) -> None:
+        with Path(self.path).open("a") as f:
+            f.write(line)
+
+
+@dataclass
+class TracingConfig:
+    exporter: FileSpanExporter | None = None
+
+
+tracing_config = TracingConfig()
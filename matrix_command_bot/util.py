@@ -1,14 +1,21 @@
-import json
+import asyncio
 import secrets
 import string
+import tempfile
 import time
+from collections.abc import AsyncIterator
 from typing import Any
 
-import aiofiles
+import structlog
 from matrix_bot.bot import MatrixClient
 from nio import RoomMessageText
 
 from matrix_command_bot.command import ICommand
+from matrix_command_bot.report import get_compressor, report_config, write_report
+
+logger = structlog.getLogger(__name__)
+
+FILE_CHUNK_SIZE = 64 * 1024
 
 
 def get_fallback_stripped_body(reply: RoomMessageText) -> str:
@@ -37,6 +44,15 @@ def get_server_name(user_or_room_id: str) -> str | None:
     return parts[1]
 
 
+def is_user_id(value: str) -> bool:
+    return value.startswith("@") and bool(get_server_name(value))
+
+
+def is_email(value: str) -> bool:
+    local_part, _, domain = value.rpartition("@")
+    return bool(local_part) and "." in domain and not is_user_id(value)
+
+
 def get_localpart_from_id(user_or_room_id: str) -> str | None:
     idx = user_or_room_id.find(":")
     if idx == -1:
@@ -55,19 +71,67 @@ async def send_report(
     room_id: str,
     replied_event_id: str,
 ) -> None:
-    async with aiofiles.tempfile.NamedTemporaryFile(suffix=".json") as tmpfile:
-        await tmpfile.write(json.dumps(json_report, indent=2, sort_keys=True).encode())
-        await tmpfile.flush()
+    compressor, extension, mime_type = get_compressor(report_config.compression)
+    if report_config.json_lines:
+        extension = ".jsonl" + extension
+        mime_type = mime_type or "application/jsonl"
+    else:
+        extension = ".json" + extension
+        mime_type = mime_type or "application/json"
+
+    start = time.perf_counter()
+    with tempfile.NamedTemporaryFile(suffix=extension) as tmpfile:
+        # Encoding a large report is CPU bound, keep it off the event loop
+        await asyncio.to_thread(
+            write_report,
+            json_report,
+            tmpfile,
+            compressor,
+            json_lines=report_config.json_lines,
+        )
+        logger.info(
+            "Report %s encoded in %.3fs, uploading %s bytes",
+            report_name,
+            time.perf_counter() - start,
+            tmpfile.tell(),
+        )
         await matrix_client.send_file_message(
             room_id,
             str(tmpfile.name),
-            mime_type="application/json",
-            filename=f"{time.strftime('%Y_%m_%d-%H_%M')}-{report_name}.json",
+            mime_type=mime_type,
+            filename=f"{time.strftime('%Y_%m_%d-%H_%M')}-{report_name}{extension}",
             reply_to=replied_event_id,
             thread_root=replied_event_id,
         )
 
 
+async def iter_file_lines(
+    matrix_client: MatrixClient, mxc_url: str
+) -> AsyncIterator[str]:
+    """Yield the lines of an uploaded file while it is being downloaded."""
+    server_name, _, media_id = mxc_url.removeprefix("mxc://").partition("/")
+    resp = await matrix_client.send(
+        "GET",
+        f"/_matrix/client/v1/media/download/{server_name}/{media_id}",
+        headers={"Authorization": f"Bearer {matrix_client.access_token}"},
+    )
+    try:
+        if not resp.ok:
+            logger.warning("Cannot download %s: %s", mxc_url, resp.status)
+            return
+        # Not `async for line in resp.content`: aiohttp refuses the lines longer
+        # than its buffer, as in a one line comma separated file
+        buffer = b""
+        async for chunk in resp.content.iter_chunked(FILE_CHUNK_SIZE):
+            *lines, buffer = (buffer + chunk).split(b"\n")
+            for line in lines:
+                yield line.decode(errors="replace").strip()
+        if buffer:
+            yield buffer.decode(errors="replace").strip()
+    finally:
+        resp.release()
+
+
 async def set_status_reaction(
     command: ICommand,
     key: str | None,
@@ -1,3 +1,6 @@
+from collections.abc import Mapping
+from typing import Any
+
 from nio import RoomMessage
 from typing_extensions import override
 
@@ -37,6 +40,14 @@ class ValidateStep(ICommandStep):
             CommandAction.CONTINUE if res else CommandAction.WAIT_FOR_NEXT_REPLY,
         )
 
+    @override
+    def dump_state(self) -> dict[str, Any]:
+        return {"prompting_done": self.prompting_done}
+
+    @override
+    def load_state(self, state: Mapping[str, Any]) -> None:
+        self.prompting_done = state["prompting_done"]
+
     async def send_prompt(self) -> None:
         if self.command.extra_config.get("is_coordinator", True):
             confirm_text = self.validator.prompt if self.validator.prompt else ""
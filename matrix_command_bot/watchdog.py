@@ -0,0 +1,95 @@
+import asyncio
+import inspect
+import sys
+import threading
+import time
+import traceback
+from types import FrameType
+
+import structlog
+
+from matrix_command_bot.metrics import registry
+
+logger = structlog.getLogger(__name__)
+
+DEFAULT_BLOCKED_LOOP_THRESHOLD = 1.0
+
+event_loop_blocked_total = registry.counter(
+    "matrix_bot_event_loop_blocked_total",
+    "Times the event loop was blocked longer than the watchdog threshold",
+)
+
+
+class LoopWatchdog:
+    """
+    Detect the code blocking the event loop.
+
+    A coroutine refreshes a heartbeat several times per `threshold`, and a
+    thread checks it. When the heartbeat is older than `threshold`, the loop is
+    stuck in synchronous code: the thread logs the stack of the loop thread,
+    which ends with the blocking call, and the coroutine of the task running it.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_BLOCKED_LOOP_THRESHOLD) -> None:
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self.heartbeat = time.monotonic()
+        self.blocked = 0
+        # Set while the current block has been reported
+        self.reported = False
+        self.loop_thread_id: int | None = None
+        self.stopped = threading.Event()
+
+    async def run(self) -> None:
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stopped.clear()
+        thread = threading.Thread(
+            target=self.watch, name="event-loop-watchdog", daemon=True
+        )
+        thread.start()
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                if self.reported:
+                    logger.warning(
+                        "Event loop unblocked",
+                        blocked_for=round(time.monotonic() - self.heartbeat, 3),
+                    )
+                    self.reported = False
+                self.heartbeat = time.monotonic()
+        finally:
+            # The thread exits within an interval
+            self.stopped.set()
+
+    def watch(self) -> None:
+        while not self.stopped.wait(self.interval):
+            blocked_for = time.monotonic() - self.heartbeat
+            if blocked_for > self.threshold and not self.reported:
+                self.reported = True
+                self.report(blocked_for)
+
+    def report(self, blocked_for: float) -> None:
+        self.blocked += 1
+        event_loop_blocked_total.inc()
+        frame = sys._current_frames().get(self.loop_thread_id or 0)  # noqa: SLF001 # pyright: ignore[reportPrivateUsage]
+        logger.warning(
+            "Event loop blocked",
+            blocked_for=round(blocked_for, 3),
+            coroutine=get_task_coroutine_name(frame),
+            stack="".join(traceback.format_stack(frame)) if frame else None,
+        )
+
+
+def get_task_coroutine_name(frame: FrameType | None) -> str | None:
+    """Return the outermost coroutine of a stack, the one run by the task.
+
+    Read from the frames as asyncio.current_task is not safe outside of the
+    loop thread.
+    """
+    name = None
+    while frame:
+        if frame.f_code.co_flags & inspect.CO_COROUTINE:
+            name = frame.f_code.co_qualname
+        frame = frame.f_back
+    return name
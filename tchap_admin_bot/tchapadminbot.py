@@ -1,19 +1,46 @@
+import asyncio
+import math
+import time
+from collections.abc import Collection
 from hashlib import sha256
+from http import HTTPStatus
 from typing import Any
 
 import structlog
 import unpaddedbase64
+from aiohttp import ClientResponse
 from nio import GetOpenIDTokenResponse
+from typing_extensions import override
 
 from matrix_admin_bot.adminbot import AdminBot, AdminBotConfig
+from matrix_command_bot.cache import MeteredTTLCache
 from matrix_command_bot.command import ICommand
-from matrix_command_bot.util import get_server_name
+from matrix_command_bot.util import is_user_id
 
 logger = structlog.getLogger(__name__)
 
 
 class TchapAdminBotConfig(AdminBotConfig):
     identity_server: str = "http://localhost:8090"
+    identity_server_token_lifetime: float = 0
+    identity_lookup_cache_size: int = 5120
+    identity_lookup_cache_ttl: float = 60 * 60
+    identity_lookup_chunk_size: int = 1000
+    identity_lookup_nb_workers: int = 4
+
+
+def hash_email(email: str, pepper: str) -> str:
+    return str(
+        unpaddedbase64.encode_base64(
+            sha256(f"{email} email {pepper}".encode()).digest(),
+            urlsafe=True,
+        )
+    )
+
+
+def hash_emails(emails: list[str], pepper: str) -> dict[str, str]:
+    """Map the lookup hash of each email to the email, in the order of `emails`."""
+    return {hash_email(email, pepper): email for email in emails}
 
 
 class TchapAdminBot(AdminBot):
@@ -23,117 +50,255 @@ class TchapAdminBot(AdminBot):
         **extra_config: Any,  # noqa: ANN401
     ) -> None:
         self.identity_server = config.identity_server
+        self.identity_lookup_chunk_size = max(1, config.identity_lookup_chunk_size)
+        self.identity_lookup_nb_workers = config.identity_lookup_nb_workers
         if "transform_cmd_input_fct" not in extra_config:
             extra_config["transform_cmd_input_fct"] = self.transform_cmd_input
         super().__init__(config, **extra_config)
 
         self.identity_server_access_token: str | None = None
+        self.identity_server_token_lifetime = config.identity_server_token_lifetime
+        self.identity_server_token_expiry = 0.0
+        # Registration shared by the callers needing a new token
+        self.identity_server_registration: asyncio.Task[str | None] | None = None
+        self.hash_pepper: str | None = None
+        # (pepper, email) -> mxid, or None when the email has no account.
+        # Keyed by pepper so the entries of a rotated pepper are not used.
+        self.identity_lookups: MeteredTTLCache[tuple[str, str], str | None] = (
+            MeteredTTLCache(
+                "identity_lookups",
+                config.identity_lookup_cache_size,
+                config.identity_lookup_cache_ttl,
+            )
+        )
+
+    @override
+    def get_cache_stats(self) -> dict[str, dict[str, float]]:
+        stats = super().get_cache_stats()
+        stats[self.identity_lookups.name] = self.identity_lookups.get_stats()
+        return stats
 
     async def transform_cmd_input(
         self, _command: type[ICommand], cmd_input: list[str]
     ) -> list[str]:
         def filter_email(email: str) -> bool:
-            return (
-                not (email.startswith("@") and get_server_name(email)) and "@" in email
-            )
+            return not is_user_id(email) and "@" in email
 
-        potential_emails = set(
-            filter(
-                filter_email,
-                cmd_input,
+        # Deduplicated in the input order, which the lookup chunks follow
+        potential_emails = list(
+            dict.fromkeys(
+                filter(
+                    filter_email,
+                    cmd_input,
+                )
             )
         )
 
-        email_to_mxid_map: dict[str | None, Any] = {}
+        email_to_mxid_map: dict[str, str] = {}
 
         # get mxid to identity server only if we have valid email
         if len(potential_emails) > 0:
-            access_token = await self.get_identity_server_access_token()
-            pepper = await self.get_hash_pepper()
-            if self.matrix_client.client_session and access_token and pepper:
-
-                def hash_email(email: str) -> str:
-                    return str(
-                        unpaddedbase64.encode_base64(
-                            sha256(f"{email} email {pepper}".encode()).digest(),
-                            urlsafe=True,
-                        )
-                    )
-
-                address_hash_to_email_map = {
-                    hash_email(email): email for email in potential_emails
-                }
-                res = await self.matrix_client.client_session.post(
-                    f"{self.identity_server}/_matrix/identity/v2/lookup",
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                    },
-                    json={
-                        "addresses": list(address_hash_to_email_map.keys()),
-                        "algorithm": "sha256",
-                        "pepper": pepper,
-                    },
-                )
-                if res.ok:
-                    body = await res.json()
-                    address_hash_to_mxid_map: dict[str, str] = body.get("mappings", {})
-                    email_to_mxid_map = {
-                        address_hash_to_email_map.get(address_hash): mxid
-                        for address_hash, mxid in address_hash_to_mxid_map.items()
-                    }
-                else:
-                    logger.warning(
-                        "Error when doing the lookup",
-                        emails=potential_emails,
-                        result=res,
-                    )
+            email_to_mxid_map = await self.lookup_emails(potential_emails)
 
         return [email_to_mxid_map.get(user_id, user_id) for user_id in cmd_input]
 
-    async def get_hash_pepper(self) -> str | None:
-        if self.matrix_client.client_session and self.identity_server_access_token:
-            res = await self.matrix_client.client_session.get(
-                f"{self.identity_server}/_matrix/identity/v2/hash_details",
-                headers={
-                    "Authorization": f"Bearer {self.identity_server_access_token}",
-                },
+    async def lookup_emails(
+        self, emails: Collection[str], *, pepper_rotated: bool = False
+    ) -> dict[str, str]:
+        pepper = await self.get_hash_pepper()
+        if not pepper:
+            return {}
+
+        email_to_mxid_map: dict[str, str] = {}
+        unknown_emails: list[str] = []
+        for email in emails:
+            try:
+                mxid = self.identity_lookups[pepper, email]
+            except KeyError:
+                unknown_emails.append(email)
+                continue
+            if mxid:
+                email_to_mxid_map[email] = mxid
+
+        if unknown_emails:
+            email_to_mxid_map.update(
+                await self.lookup_unknown_emails(pepper, unknown_emails)
             )
-            if res.ok:
-                body = await res.json()
-                return body.get("lookup_pepper")
-            logger.warning("Error when getting the lookup pepper", result=res)
+            if self.hash_pepper != pepper and not pepper_rotated:
+                # The cached results come from the previous pepper
+                return await self.lookup_emails(emails, pepper_rotated=True)
+        return email_to_mxid_map
+
+    async def lookup_unknown_emails(
+        self, pepper: str, emails: list[str]
+    ) -> dict[str, str]:
+        # Identity servers cap the request size: the hashes are sent in chunks
+        address_hash_to_email_map = hash_emails(emails, pepper)
+        address_hashes = list(address_hash_to_email_map)
+        chunk_size = self.identity_lookup_chunk_size
+        chunks = [
+            address_hashes[i : i + chunk_size]
+            for i in range(0, len(address_hashes), chunk_size)
+        ]
+        pending = iter(chunks)
+        email_to_mxid_map: dict[str, str] = {}
+
+        async def worker() -> None:
+            for chunk in pending:
+                # The emails are looked up again with the new pepper
+                if self.hash_pepper != pepper:
+                    return
+                address_hash_to_mxid_map = await self.lookup_chunk(pepper, chunk)
+                if address_hash_to_mxid_map is None:
+                    continue
+                for address_hash in chunk:
+                    email = address_hash_to_email_map[address_hash]
+                    mxid = address_hash_to_mxid_map.get(address_hash)
+                    # The emails without account are cached too
+                    self.identity_lookups[pepper, email] = mxid
+                    if mxid:
+                        email_to_mxid_map[email] = mxid
+
+        nb_workers = max(1, min(self.identity_lookup_nb_workers, len(chunks)))
+        await asyncio.gather(*[worker() for _ in range(nb_workers)])
+        return email_to_mxid_map
+
+    async def lookup_chunk(
+        self, pepper: str, address_hashes: list[str]
+    ) -> dict[str, str] | None:
+        res = await self.send_to_identity_server(
+            "/_matrix/identity/v2/lookup",
+            json={
+                "addresses": address_hashes,
+                "algorithm": "sha256",
+                "pepper": pepper,
+            },
+        )
+        if res is None:
+            return None
+        if res.ok:
+            body = await res.json()
+            return body.get("mappings", {})
+
+        if res.status == HTTPStatus.BAD_REQUEST:
+            body = await res.json()
+            if body.get("errcode") == "M_INVALID_PEPPER":
+                logger.info("The lookup pepper has changed")
+                # Fetched again if the error doesn't give it
+                self.hash_pepper = body.get("lookup_pepper")
+                return None
 
+        logger.warning(
+            "Error when doing the lookup",
+            nb_addresses=len(address_hashes),
+            result=res,
+        )
         return None
 
-    async def get_identity_server_access_token(self) -> str | None:
-        if not self.identity_server_access_token and self.matrix_client.client_session:
-            openid_token_resp = await self.matrix_client.get_openid_token(
-                self.matrix_client.user_id
-            )
-            if isinstance(openid_token_resp, GetOpenIDTokenResponse):
-                res = await self.matrix_client.client_session.post(
-                    f"{self.identity_server}/_matrix/identity/v2/account/register",
-                    json={
-                        "token_type": openid_token_resp.token_type,
-                        "matrix_server_name": openid_token_resp.matrix_server_name,
-                        "expires_in": openid_token_resp.expires_in,
-                        "access_token": openid_token_resp.access_token,
-                    },
-                )
-                if res.ok:
-                    body = await res.json()
-                    self.identity_server_access_token = body.get("token", None)
-                else:
-                    logger.warning(
-                        "Error when getting an access token from ther identity server",
-                        result=res,
-                    )
+    async def get_hash_pepper(self) -> str | None:
+        if self.hash_pepper:
+            return self.hash_pepper
+        res = await self.send_to_identity_server("/_matrix/identity/v2/hash_details")
+        if res and res.ok:
+            body = await res.json()
+            self.hash_pepper = body.get("lookup_pepper")
+            return self.hash_pepper
+        logger.warning("Error when getting the lookup pepper", result=res)
+        return None
+
+    async def send_to_identity_server(
+        self, endpoint: str, json: dict[str, Any] | None = None
+    ) -> ClientResponse | None:
+        """GET `endpoint`, or POST `json` to it, with the identity server token.
+
+        A request rejected with 401 is retried once with a refreshed token.
+        """
+        if not self.matrix_client.client_session:
+            return None
+        access_token = await self.get_identity_server_access_token()
+        for retry in range(2):
+            if not access_token:
+                return None
+            url = f"{self.identity_server}{endpoint}"
+            headers = {"Authorization": f"Bearer {access_token}"}
+            if json is None:
+                res = await self.matrix_client.client_session.get(url, headers=headers)
             else:
-                logger.warning(
-                    "Error when getting the OpenID token from the homeserver",
-                    result=openid_token_resp,
+                res = await self.matrix_client.client_session.post(
+                    url, headers=headers, json=json
                 )
+            if res.status != HTTPStatus.UNAUTHORIZED or retry:
+                return res
+            # Give the connection back to the pool before retrying
+            res.release()
+            logger.info("The identity server access token has expired")
+            access_token = await self.get_identity_server_access_token(
+                expired_token=access_token
+            )
+        return None
 
+    async def get_identity_server_access_token(
+        self, expired_token: str | None = None
+    ) -> str | None:
+        """Return the identity server token, registering again once it expired.
+
+        Concurrent callers share a single registration: the ones rejected with
+        the previous token get the new one without registering again.
+        """
+        access_token = self.identity_server_access_token
+        if (
+            access_token
+            and access_token != expired_token
+            and time.monotonic() < self.identity_server_token_expiry
+        ):
+            return access_token
+        if (
+            self.identity_server_registration is None
+            or self.identity_server_registration.done()
+        ):
+            self.identity_server_access_token = None
+            self.identity_server_registration = asyncio.create_task(
+                self.register_to_identity_server()
+            )
+        # Shielded so a cancelled command doesn't cancel the others' registration
+        return await asyncio.shield(self.identity_server_registration)
+
+    async def register_to_identity_server(self) -> str | None:
+        if not self.matrix_client.client_session:
+            return None
+        openid_token_resp = await self.matrix_client.get_openid_token(
+            self.matrix_client.user_id
+        )
+        if not isinstance(openid_token_resp, GetOpenIDTokenResponse):
+            logger.warning(
+                "Error when getting the OpenID token from the homeserver",
+                result=openid_token_resp,
+            )
+            return None
+
+        res = await self.matrix_client.client_session.post(
+            f"{self.identity_server}/_matrix/identity/v2/account/register",
+            json={
+                "token_type": openid_token_resp.token_type,
+                "matrix_server_name": openid_token_resp.matrix_server_name,
+                "expires_in": openid_token_resp.expires_in,
+                "access_token": openid_token_resp.access_token,
+            },
+        )
+        if not res.ok:
+            logger.warning(
+                "Error when getting an access token from ther identity server",
+                result=res,
+            )
+            return None
+
+        body = await res.json()
+        self.identity_server_access_token = body.get("token", None)
+        self.identity_server_token_expiry = (
+            time.monotonic() + self.identity_server_token_lifetime
+            if self.identity_server_token_lifetime
+            else math.inf
+        )
         return self.identity_server_access_token
 
 
@@ -61,6 +61,8 @@ class MatrixClientMock:
         self.send_file_message = AsyncMock(side_effect=generate_event_id)
         self.send_reaction = AsyncMock(side_effect=generate_event_id)
         self.room_redact = AsyncMock()
+        self.room_send = AsyncMock()
+        self.room_get_event = AsyncMock()
         self.sync_forever_called = False
         self.homeserver = server_name
 
@@ -233,7 +235,7 @@ async def create_fake_admin_bot(
 
     # Mock admin client with mocked matrix client and mocked session
     admin_client = AdminClient(Mock(), "", "")
-    fake_session = Mock()
+    fake_session = Mock(request=AsyncMock(), close=AsyncMock())
     admin_client.synapse_client = fake_client
     admin_client.session = fake_session
     bot.extra_config["admin_client"] = admin_client
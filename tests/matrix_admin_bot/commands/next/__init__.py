@@ -69,7 +69,7 @@ USER = {
 }
 
 COMPAT_SESSIONS_LIST = {
-    "meta": {"count": 42},
+    "meta": {"count": 3},
     "data": [
         {
             "type": "compat-session",
@@ -136,13 +136,11 @@ COMPAT_SESSIONS_LIST = {
         "self": "/api/admin/v1/compat-sessions?page[first]=3",
         "first": "/api/admin/v1/compat-sessions?page[first]=3",
         "last": "/api/admin/v1/compat-sessions?page[last]=3",
-        "next": "/api/admin/v1/compat-sessions?page[after]=030C1G60R30C1G60R30C1G60R3"
-        "&page[first]=3",
     },
 }
 
 OAUTH2_SESSIONS_LIST = {
-    "meta": {"count": 42},
+    "meta": {"count": 3},
     "data": [
         {
             "type": "oauth2-session",
@@ -209,13 +207,11 @@ OAUTH2_SESSIONS_LIST = {
         "self": "/api/admin/v1/oauth2-sessions?page[first]=3",
         "first": "/api/admin/v1/oauth2-sessions?page[first]=3",
         "last": "/api/admin/v1/oauth2-sessions?page[last]=3",
-        "next": "/api/admin/v1/oauth2-sessions?page[after]=030C1G60R30C1G60R30C1G60R3"
-        "&page[first]=3",
     },
 }
 
 USER_SESSIONS_LIST = {
-    "meta": {"count": 42},
+    "meta": {"count": 3},
     "data": [
         {
             "type": "user-session",
@@ -264,8 +260,6 @@ USER_SESSIONS_LIST = {
         "self": "/api/admin/v1/user-sessions?page[first]=3",
         "first": "/api/admin/v1/user-sessions?page[first]=3",
         "last": "/api/admin/v1/user-sessions?page[last]=3",
-        "next": "/api/admin/v1/user-sessions?page[after]=030C1G60R30C1G60R30C1G60R3"
-        "&page[first]=3",
     },
 }
 
@@ -308,21 +302,33 @@ USER_SYNAPSE = {
 }
 
 
-def mock_response_error(status_code: int, text: str) -> Mock:
+def mock_response_error(status: int, text: str) -> Mock:
     return Mock(
         ok=False,
-        status_code=status_code,
-        text=text,
+        status=status,
+        read=AsyncMock(),
+        text=AsyncMock(return_value=text),
+    )
+
+
+def mock_response_no_content() -> Mock:
+    return Mock(
+        ok=True,
+        status=204,
+        read=AsyncMock(),
+        text=AsyncMock(return_value=""),
     )
 
 
 def mock_response_with_json(json: dict[str, Any]) -> Mock:
     return Mock(
         ok=True,
+        status=200,
         headers={
             "Content-Type": "application/json",
         },
-        json=Mock(return_value=json),
+        read=AsyncMock(),
+        json=AsyncMock(return_value=json),
     )
 
 
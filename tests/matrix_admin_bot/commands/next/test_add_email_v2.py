@@ -48,7 +48,7 @@ async def test_add_email() -> None:
         t,
     ) = await create_fake_admin_bot(validator=OkValidator())
     mocked_matrix_client.send = AsyncMock(side_effect=request_side_effect_synapse)
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
     await mocked_matrix_client.fake_synced_text_message(
@@ -112,7 +112,7 @@ async def test_failed_add_email_when_email_already_used() -> None:
         t,
     ) = await create_fake_admin_bot(validator=OkValidator())
     mocked_matrix_client.send = AsyncMock(side_effect=request_side_effect_synapse)
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
@@ -165,7 +165,7 @@ async def test_failed_add_email_when_user_has_email() -> None:
         t,
     ) = await create_fake_admin_bot(validator=OkValidator())
     mocked_matrix_client.send = AsyncMock(side_effect=request_side_effect_synapse)
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
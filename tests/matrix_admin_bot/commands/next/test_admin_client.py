@@ -0,0 +1,274 @@
+import asyncio
+from collections.abc import Generator
+from contextlib import contextmanager
+from typing import Any
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from nio import MatrixRoom
+
+from matrix_admin_bot.commands.next.admin_client import AdminClient
+from tests import (
+    USER1_ID,
+    OkValidator,
+    create_fake_admin_bot,
+    timeout,
+    wait_for_command_tasks,
+)
+from tests.matrix_admin_bot.commands.next import (
+    COMPAT_SESSIONS_LIST,
+    OAUTH2_SESSIONS_LIST,
+    USER,
+    USER_SESSIONS_LIST,
+    async_mock_response_with_json,
+    mock_response_error,
+    mock_response_with_json,
+)
+
+MAS_LATENCY = 0.05
+NB_COMMANDS = 10
+# get the mas user id, 3 session types and the lock itself
+NB_MAS_REQUESTS_PER_COMMAND = 5
+
+
+class InFlightCounter:
+    """Count the mocked requests running at the same time.
+
+    A round-trip starts each time a request is sent while none is in flight.
+    """
+
+    def __init__(self) -> None:
+        self.running = 0
+        self.peak = 0
+        self.round_trips = 0
+
+    @contextmanager
+    def track(self) -> Generator[None]:
+        if not self.running:
+            self.round_trips += 1
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            yield
+        finally:
+            self.running -= 1
+
+
+@pytest.mark.asyncio
+@timeout(10)
+async def test_concurrent_commands_do_not_run_one_after_another() -> None:
+    in_flight = InFlightCounter()
+
+    async def request_side_effect(method: str, url: str, **kwargs: Any) -> Mock:  # noqa: ARG001
+        # Simulate the MAS round-trip, a blocking transport would serialize these
+        with in_flight.track():
+            await asyncio.sleep(MAS_LATENCY)
+        if method == "GET" and "/api/admin/v1/users/by-username/" in url:
+            return mock_response_with_json(USER)
+        if method == "GET" and url.endswith("/api/admin/v1/compat-sessions"):
+            return mock_response_with_json(COMPAT_SESSIONS_LIST)
+        if method == "GET" and url.endswith("/api/admin/v1/oauth2-sessions"):
+            return mock_response_with_json(OAUTH2_SESSIONS_LIST)
+        if method == "GET" and url.endswith("/api/admin/v1/user-sessions"):
+            return mock_response_with_json(USER_SESSIONS_LIST)
+        if method == "POST" and url.endswith("/lock"):
+            return mock_response_with_json(USER)
+        return mock_response_error(403, "Forbidden")
+
+    (
+        mocked_matrix_client,
+        mock_admin_client,
+        t,
+    ) = await create_fake_admin_bot(validator=OkValidator())
+    mocked_matrix_client.send = AsyncMock(
+        return_value=Mock(ok=True, json=AsyncMock(return_value={}))
+    )
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
+
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    for i in range(NB_COMMANDS):
+        await mocked_matrix_client.fake_synced_text_message(
+            room,
+            USER1_ID,
+            f"!lock @user{i}:example.org",
+            wait_for_commands_execution=False,
+        )
+    await wait_for_command_tasks()
+
+    assert (
+        len(mock_admin_client.session.request.call_args_list)  # type: ignore[reportUnknownArgumentType]
+        == NB_COMMANDS * NB_MAS_REQUESTS_PER_COMMAND
+    )
+    assert mocked_matrix_client.send_file_message.await_count == NB_COMMANDS
+    # The requests of every command were in flight at the same time
+    assert in_flight.peak >= NB_COMMANDS
+
+    t.cancel()
+
+
+@pytest.mark.asyncio
+@timeout(2)
+async def test_user_snapshot_reads_concurrently() -> None:
+    in_flight = InFlightCounter()
+
+    async def request_side_effect(method: str, url: str, **kwargs: Any) -> Mock:  # noqa: ARG001
+        with in_flight.track():
+            await asyncio.sleep(MAS_LATENCY)
+        if method == "GET" and "/api/admin/v1/users/by-username/" in url:
+            return mock_response_with_json(USER)
+        if method == "GET" and url.endswith("/api/admin/v1/compat-sessions"):
+            return mock_response_with_json(COMPAT_SESSIONS_LIST)
+        if method == "GET" and url.endswith("/api/admin/v1/oauth2-sessions"):
+            return mock_response_with_json(OAUTH2_SESSIONS_LIST)
+        if method == "GET" and url.endswith("/api/admin/v1/user-sessions"):
+            return mock_response_with_json(USER_SESSIONS_LIST)
+        return mock_response_error(403, "Forbidden")
+
+    async def synapse_send_side_effect(*_args: Any, **_kwargs: Any) -> Mock:
+        with in_flight.track():
+            await asyncio.sleep(MAS_LATENCY)
+        return async_mock_response_with_json({"devices": [{"device_id": "ABC"}]})
+
+    admin_client = AdminClient(
+        Mock(send=AsyncMock(side_effect=synapse_send_side_effect)), "", ""
+    )
+    admin_client.session = Mock(request=AsyncMock(side_effect=request_side_effect))
+
+    user_id = "@user_to_reset:example.org"
+    json_report: dict[str, Any] = {user_id: {"sessions": {}, "errors": []}}
+    failed_user_ids: list[str] = []
+
+    snapshot = await admin_client.get_user_snapshot(
+        json_report, failed_user_ids, user_id
+    )
+
+    assert snapshot is not None
+    assert snapshot.mas_user_id == USER["data"]["id"]
+    assert snapshot.devices == [{"device_id": "ABC"}]
+    assert snapshot.compat_sessions == COMPAT_SESSIONS_LIST["data"]
+    assert snapshot.user_sessions == USER_SESSIONS_LIST["data"]
+    assert snapshot.oauth2_sessions == OAUTH2_SESSIONS_LIST["data"]
+    assert not failed_user_ids
+    # 2 round-trips instead of 5
+    assert in_flight.round_trips == 2
+    assert in_flight.peak == 3
+
+
+@pytest.mark.asyncio
+async def test_sessions_follow_pagination() -> None:
+    next_endpoint = (
+        "/api/admin/v1/compat-sessions?filter[user]=01040G2081040G2081040G2081"
+        "&filter[status]=active&page[after]=030C1G60R30C1G60R30C1G60R3&page[first]=3"
+    )
+    first_page = {
+        **COMPAT_SESSIONS_LIST,
+        "meta": {"count": 4},
+        "links": {**COMPAT_SESSIONS_LIST["links"], "next": next_endpoint},
+    }
+    second_page = {
+        "meta": {"count": 4},
+        "data": [{"type": "compat-session", "id": "040G2081040G2081040G208104"}],
+        "links": {},
+    }
+
+    def request_side_effect(method: str, url: str, **kwargs: Any) -> Mock:
+        if method == "GET" and url.endswith("/api/admin/v1/compat-sessions"):
+            assert kwargs["params"]["page[first]"] == 3
+            return mock_response_with_json(first_page)
+        if method == "GET" and url.endswith(next_endpoint):
+            assert kwargs["params"] is None
+            return mock_response_with_json(second_page)
+        return mock_response_error(403, "Forbidden")
+
+    admin_client = AdminClient(Mock(), "", "", page_size=3)
+    admin_client.session = Mock(request=AsyncMock(side_effect=request_side_effect))
+
+    user_id = "@user_to_reset:example.org"
+    json_report: dict[str, Any] = {user_id: {"sessions": {}, "errors": []}}
+    failed_user_ids: list[str] = []
+
+    sessions = await admin_client.get_compat_sessions(
+        json_report, failed_user_ids, USER["data"]["id"], user_id
+    )
+
+    assert len(sessions) == 4
+    assert sessions[-1]["id"] == "040G2081040G2081040G208104"
+    assert json_report[user_id]["sessions"]["compat-sessions"] == sessions
+    assert not failed_user_ids
+
+
+@pytest.mark.asyncio
+async def test_sessions_report_failed_page() -> None:
+    first_page = {
+        **COMPAT_SESSIONS_LIST,
+        "links": {"next": "/api/admin/v1/compat-sessions?page[after]=0"},
+    }
+
+    def request_side_effect(method: str, url: str, **kwargs: Any) -> Mock:  # noqa: ARG001
+        if method == "GET" and url.endswith("/api/admin/v1/compat-sessions"):
+            return mock_response_with_json(first_page)
+        return mock_response_error(500, "Internal Server Error")
+
+    admin_client = AdminClient(Mock(), "", "")
+    admin_client.session = Mock(request=AsyncMock(side_effect=request_side_effect))
+
+    user_id = "@user_to_reset:example.org"
+    json_report: dict[str, Any] = {user_id: {"sessions": {}, "errors": []}}
+    failed_user_ids: list[str] = []
+
+    sessions = await admin_client.get_compat_sessions(
+        json_report, failed_user_ids, USER["data"]["id"], user_id
+    )
+
+    # The first page is kept in the report along with the error
+    assert len(sessions) == 3
+    assert failed_user_ids == [user_id]
+    assert json_report[user_id]["errors"][0]["description"] == "Internal Server Error"
+
+
+@pytest.mark.asyncio
+async def test_users_are_yielded_as_pages_arrive() -> None:
+    first_page = {
+        "meta": {"count": 3},
+        "data": [
+            {"type": "user", "id": "1", "attributes": {"username": "user1"}},
+            {"type": "user", "id": "2", "attributes": {"username": "user2"}},
+        ],
+        "links": {"next": "/api/admin/v1/users?page[after]=2"},
+    }
+    second_page_requested = asyncio.Event()
+
+    def request_side_effect(method: str, url: str, **kwargs: Any) -> Mock:  # noqa: ARG001
+        if url.endswith("/api/admin/v1/users"):
+            return mock_response_with_json(first_page)
+        second_page_requested.set()
+        return mock_response_with_json({"meta": {"count": 3}, "data": []})
+
+    admin_client = AdminClient(Mock(), "", "")
+    admin_client.session = Mock(request=AsyncMock(side_effect=request_side_effect))
+    json_report: dict[str, Any] = {"details": {}}
+
+    users = admin_client.get_users("example.org", json_report, 2)
+    assert await anext(users) == "@user1:example.org"
+    assert not second_page_requested.is_set()
+
+    assert [user async for user in users] == ["@user2:example.org"]
+    # MAS announced 3 users but only 2 have been enumerated
+    assert json_report["details"]["get_users"]["description"] == (
+        "Not all users have been retrieved : 2/3 users"
+    )
+
+
+@pytest.mark.asyncio
+@timeout(10)
+async def test_admin_client_is_closed_with_the_bot() -> None:
+    _, admin_client, t = await create_fake_admin_bot()
+    session = admin_client.session
+
+    t.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await t
+
+    session.close.assert_awaited_once()  # pyright: ignore[reportOptionalMemberAccess, reportAttributeAccessIssue]
+    assert admin_client.session is None
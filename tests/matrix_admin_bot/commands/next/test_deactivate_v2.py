@@ -1,3 +1,4 @@
+import asyncio
 from typing import Any
 from unittest.mock import AsyncMock, Mock
 
@@ -38,7 +39,7 @@ async def test_deactivate() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value={}))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
@@ -91,7 +92,7 @@ async def test_failed_deactivate() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value={}))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
@@ -125,3 +126,85 @@ async def test_non_local_user_deactivate() -> None:
     assert len(mocked_matrix_client.send_reaction.await_args_list) == 0
 
     t.cancel()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_deactivate_keeps_failed_users_order() -> None:
+    delays = {"user_a": 0.03, "user_b": 0.02, "user_c": 0.01}
+
+    async def request_side_effect(method: str, url: str, **kwargs: Any) -> Mock:  # noqa: ARG001
+        username = url.rsplit("/", 1)[-1]
+        await asyncio.sleep(delays.get(username, 0))
+        return mock_response_error(404, "Not found")
+
+    (
+        mocked_matrix_client,
+        mock_admin_client,
+        t,
+    ) = await create_fake_admin_bot(validator=OkValidator(), user_commands_nb_workers=3)
+    mocked_matrix_client.send = AsyncMock(
+        return_value=Mock(ok=True, json=AsyncMock(return_value={}))
+    )
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
+
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    await mocked_matrix_client.fake_synced_text_message(
+        room,
+        USER1_ID,
+        "!deactivate @user_a:example.org @user_b:example.org @user_c:example.org",
+    )
+
+    failed_messages = [
+        args[0][1]
+        for args in mocked_matrix_client.send_markdown_message.await_args_list
+        if "Couldn't deactivate" in args[0][1]
+    ]
+    assert len(failed_messages) == 1
+    assert failed_messages[0].endswith(
+        "- @user_a:example.org\n- @user_b:example.org\n- @user_c:example.org"
+    )
+
+    t.cancel()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_deactivate_error_is_a_failed_user() -> None:
+    async def request_side_effect(method: str, url: str, **kwargs: Any) -> Mock:  # noqa: ARG001
+        if url.endswith("/user_a"):
+            msg = "Unexpected error"
+            raise ValueError(msg)
+        await asyncio.sleep(0.01)
+        return mock_response_error(404, "Not found")
+
+    (
+        mocked_matrix_client,
+        mock_admin_client,
+        t,
+    ) = await create_fake_admin_bot(validator=OkValidator(), user_commands_nb_workers=2)
+    mocked_matrix_client.send = AsyncMock(
+        return_value=Mock(ok=True, json=AsyncMock(return_value={}))
+    )
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
+
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    await mocked_matrix_client.fake_synced_text_message(
+        room,
+        USER1_ID,
+        "!deactivate @user_a:example.org @user_b:example.org @user_c:example.org",
+    )
+
+    # The other users are processed before the command completes
+    failed_messages = [
+        args[0][1]
+        for args in mocked_matrix_client.send_markdown_message.await_args_list
+        if "Couldn't deactivate" in args[0][1]
+    ]
+    assert len(failed_messages) == 1
+    assert failed_messages[0].endswith(
+        "- @user_a:example.org\n- @user_b:example.org\n- @user_c:example.org"
+    )
+    mocked_matrix_client.check_sent_reactions("🚀", "❌")
+
+    t.cancel()
@@ -1,8 +1,9 @@
+from collections.abc import AsyncIterator
 from typing import Any
 from unittest.mock import AsyncMock, Mock
 
 import pytest
-from nio import MatrixRoom
+from nio import MatrixRoom, RoomGetEventResponse, RoomMessageFile
 
 from tests import (
     USER1_ID,
@@ -42,7 +43,7 @@ async def test_lock() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value={}))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
@@ -95,7 +96,7 @@ async def test_failed_lock() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value={}))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
@@ -129,3 +130,76 @@ async def test_non_local_user_lock() -> None:
     assert len(mocked_matrix_client.send_reaction.await_args_list) == 0
 
     t.cancel()
+
+
+@pytest.mark.asyncio
+async def test_lock_users_from_attached_file() -> None:
+    def request_side_effect(method: str, url: str, **kwargs: Any) -> Mock:  # noqa: ARG001
+        if method == "GET" and url.endswith(
+            "/api/admin/v1/users/by-username/user_to_reset"
+        ):
+            return mock_response_with_json(USER)
+        if method == "GET" and url.endswith("/api/admin/v1/compat-sessions"):
+            return mock_response_with_json(COMPAT_SESSIONS_LIST)
+        if method == "GET" and url.endswith("/api/admin/v1/oauth2-sessions"):
+            return mock_response_with_json(OAUTH2_SESSIONS_LIST)
+        if method == "GET" and url.endswith("/api/admin/v1/user-sessions"):
+            return mock_response_with_json(USER_SESSIONS_LIST)
+        if method == "POST" and url.endswith("/lock"):
+            return mock_response_with_json(USER)
+        return mock_response_error(403, "Forbidden")
+
+    async def file_content() -> AsyncIterator[bytes]:
+        yield b"user_id,email\n@user_to_reset:example.org\n"
+        # The chunks don't follow the lines
+        yield b'"@user_to_reset:exam'
+        yield b'ple.org", @other_user:example2.org,@,not-a-user@\n'
+
+    def send_side_effect(method: str, path: str, **kwargs: Any) -> Mock:  # noqa: ARG001
+        if "/media/download/example.org/users" in path:
+            return Mock(
+                ok=True,
+                content=Mock(iter_chunked=Mock(return_value=file_content())),
+                release=Mock(),
+            )
+        return Mock(ok=True, json=AsyncMock(return_value={}))
+
+    (
+        mocked_matrix_client,
+        mock_admin_client,
+        t,
+    ) = await create_fake_admin_bot(validator=OkValidator())
+    mocked_matrix_client.send = AsyncMock(side_effect=send_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
+    file_event = RoomGetEventResponse()
+    file_event.event = RoomMessageFile.from_dict(
+        {
+            "event_id": "$file",
+            "sender": USER1_ID,
+            "origin_server_ts": 0,
+            "type": "m.room.message",
+            "content": {
+                "msgtype": "m.file",
+                "body": "users.csv",
+                "url": "mxc://example.org/users",
+            },
+        }
+    )
+    mocked_matrix_client.room_get_event = AsyncMock(return_value=file_event)
+
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    await mocked_matrix_client.fake_synced_text_message(
+        room,
+        USER1_ID,
+        "!lock",
+        extra_content={"m.relates_to": {"m.in_reply_to": {"event_id": "$file"}}},
+    )
+
+    mocked_matrix_client.room_get_event.assert_awaited_once_with(room.room_id, "$file")
+    mocked_matrix_client.send_file_message.assert_awaited_once()
+    # the duplicated local user is locked once
+    assert "/lock" in mock_admin_client.session.request.call_args_list[-1][0][1]
+    assert len(mock_admin_client.session.request.call_args_list) == 5  # type: ignore[reportUnknownArgumentType]
+
+    t.cancel()
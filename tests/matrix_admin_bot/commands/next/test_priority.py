@@ -0,0 +1,137 @@
+import asyncio
+import time
+from typing import Any
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+
+from matrix_admin_bot.commands.next.admin_client import AdminClient
+from matrix_admin_bot.commands.next.priority import (
+    Priority,
+    PrioritySemaphore,
+    request_priority,
+)
+from matrix_admin_bot.commands.next.rate_limiter import RateLimiter
+from tests import timeout
+from tests.matrix_admin_bot.commands.next import async_mock_response_with_json
+
+SYNAPSE_LATENCY = 0.05
+
+
+async def acquire_with_priority(
+    semaphore: PrioritySemaphore, priority: Priority, name: str, served: list[str]
+) -> None:
+    request_priority.set(priority)
+    await semaphore.acquire()
+    served.append(name)
+
+
+@pytest.mark.asyncio
+@timeout(2)
+async def test_interactive_waiters_are_served_first() -> None:
+    semaphore = PrioritySemaphore(1)
+    served: list[str] = []
+
+    await semaphore.acquire()
+    tasks = [
+        asyncio.create_task(acquire_with_priority(semaphore, priority, name, served))
+        for priority, name in [
+            (Priority.BULK, "bulk1"),
+            (Priority.BULK, "bulk2"),
+            (Priority.INTERACTIVE, "interactive"),
+        ]
+    ]
+    await asyncio.sleep(0)
+
+    for _ in tasks:
+        semaphore.release()
+        await asyncio.sleep(0)
+
+    assert served == ["interactive", "bulk1", "bulk2"]
+
+
+@pytest.mark.asyncio
+@timeout(2)
+async def test_bulk_requests_leave_reserved_slots() -> None:
+    semaphore = PrioritySemaphore(3, reserved=1)
+    served: list[str] = []
+
+    tasks = [
+        asyncio.create_task(
+            acquire_with_priority(semaphore, Priority.BULK, f"bulk{i}", served)
+        )
+        for i in range(3)
+    ]
+    await asyncio.sleep(0)
+    assert served == ["bulk0", "bulk1"]
+
+    await acquire_with_priority(semaphore, Priority.INTERACTIVE, "interactive", served)
+    assert served == ["bulk0", "bulk1", "interactive"]
+    assert semaphore.in_flight == 3
+
+    # The last bulk request only starts once the reserved slot is free again
+    semaphore.release()
+    await asyncio.sleep(0)
+    assert served[-1] == "interactive"
+    semaphore.release()
+    await asyncio.gather(*tasks)
+    assert served[-1] == "bulk2"
+
+
+@pytest.mark.asyncio
+@timeout(2)
+async def test_rate_limiter_serves_interactive_requests_first() -> None:
+    rate_limiter = RateLimiter(rate=50, burst=1)
+    served: list[str] = []
+
+    async def acquire(priority: Priority, name: str) -> None:
+        request_priority.set(priority)
+        await rate_limiter.acquire()
+        served.append(name)
+
+    bulk_tasks = [
+        asyncio.create_task(acquire(Priority.BULK, f"bulk{i}")) for i in range(5)
+    ]
+    await asyncio.sleep(0)
+    await acquire(Priority.INTERACTIVE, "interactive")
+
+    # Only the bulk request waiting for a token in the lock went before
+    assert served == ["bulk0", "bulk1", "interactive"]
+    await asyncio.gather(*bulk_tasks)
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_interactive_request_is_not_stuck_behind_bulk_requests() -> None:
+    async def synapse_send_side_effect(*_args: Any, **_kwargs: Any) -> Mock:
+        await asyncio.sleep(SYNAPSE_LATENCY)
+        return async_mock_response_with_json({})
+
+    admin_client = AdminClient(
+        Mock(send=AsyncMock(side_effect=synapse_send_side_effect)),
+        "",
+        "",
+        synapse_max_connections=4,
+        interactive_reserved_connections=1,
+    )
+
+    async def send_bulk_requests() -> None:
+        request_priority.set(Priority.BULK)
+        await asyncio.gather(
+            *[
+                admin_client.send_to_synapse("POST", "/send_server_notice")
+                for _ in range(60)
+            ]
+        )
+
+    bulk_task = asyncio.create_task(send_bulk_requests())
+    await asyncio.sleep(SYNAPSE_LATENCY / 2)
+
+    start = time.perf_counter()
+    await admin_client.send_to_synapse("POST", "/lock")
+    elapsed = time.perf_counter() - start
+
+    # 60 bulk requests over 3 connections take 1s, the lock doesn't wait for them
+    assert not bulk_task.done()
+    assert elapsed < 2 * SYNAPSE_LATENCY
+    await bulk_task
@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+import pytest
+
+from matrix_admin_bot.commands.next.rate_limiter import (
+    AdaptiveRateLimiter,
+    RateLimiter,
+)
+from tests import timeout
+
+
+@pytest.mark.asyncio
+@timeout(2)
+async def test_rate_limiter_spreads_requests() -> None:
+    rate_limiter = RateLimiter(rate=50, burst=1)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[rate_limiter.acquire() for _ in range(6)])
+    elapsed = time.perf_counter() - start
+
+    # The first request is served right away, the 5 others wait 1/50s each
+    assert elapsed >= 5 / 50 * 0.9
+
+
+@pytest.mark.asyncio
+@timeout(1)
+async def test_rate_limiter_disabled() -> None:
+    rate_limiter = RateLimiter()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[rate_limiter.acquire() for _ in range(1000)])
+
+    assert time.perf_counter() - start < 0.5
+
+
+@pytest.mark.asyncio
+@timeout(2)
+async def test_adaptive_rate_limiter_backs_off_and_probes() -> None:
+    rate_limiter = AdaptiveRateLimiter(rate=10, max_rate=12)
+
+    for _ in range(100):
+        rate_limiter.on_success()
+    assert rate_limiter.rate == 12
+
+    rate_limiter.on_overload(0.2)
+    # The other in-flight failures don't divide the rate again
+    rate_limiter.on_overload(0.2)
+    assert rate_limiter.rate == 6
+
+    start = time.perf_counter()
+    await rate_limiter.acquire()
+    # Held for the delay asked by the server
+    assert time.perf_counter() - start >= 0.2 * 0.9
+
+
+@pytest.mark.asyncio
+@timeout(1)
+async def test_adaptive_rate_limiter_disabled() -> None:
+    rate_limiter = AdaptiveRateLimiter(rate=0)
+
+    rate_limiter.on_success()
+    rate_limiter.on_overload(0.1)
+    assert rate_limiter.rate == 0
+
+    start = time.perf_counter()
+    await asyncio.gather(*[rate_limiter.acquire() for _ in range(100)])
+    # Only held for the delay asked by the server
+    assert time.perf_counter() - start < 0.5
@@ -51,7 +51,7 @@ async def test_reactivate() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value={}))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
@@ -110,7 +110,7 @@ async def test_failed_reactivate() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value={}))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
@@ -140,7 +140,7 @@ async def test_failed_reactivate_invalid_input() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value={}))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
@@ -14,6 +14,7 @@ from tests.matrix_admin_bot.commands.next import (
     USER_EMAILS_LIST,
     USER_EMAILS_LIST_NO_DATA,
     mock_response_error,
+    mock_response_no_content,
     mock_response_with_json,
 )
 
@@ -30,10 +31,7 @@ async def test_remove_email() -> None:
         if method == "DELETE" and url.endswith(
             "/api/admin/v1/user-emails/01K5R30ZEENQQCR9ZPQY9KYP09"
         ):
-            return Mock(
-                ok=True,
-                status_code=204,
-            )
+            return mock_response_no_content()
         return mock_response_error(403, "Forbidden")
 
     (
@@ -44,7 +42,7 @@ async def test_remove_email() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value={}))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
     await mocked_matrix_client.fake_synced_text_message(
@@ -83,10 +81,7 @@ async def test_failed_remove_email_when_user_has_no_email() -> None:
         if method == "DELETE" and url.endswith(
             "/api/admin/v1/user-emails/01K5R30ZEENQQCR9ZPQY9KYP09"
         ):
-            return Mock(
-                ok=True,
-                status_code=204,
-            )
+            return mock_response_no_content()
         return mock_response_error(403, "Forbidden")
 
     (
@@ -97,7 +92,7 @@ async def test_failed_remove_email_when_user_has_no_email() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value={}))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
@@ -125,7 +120,7 @@ async def test_failed_remove_email_when_api_in_error() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value={}))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
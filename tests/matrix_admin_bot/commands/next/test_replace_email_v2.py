@@ -48,7 +48,7 @@ async def test_replace_email() -> None:
         t,
     ) = await create_fake_admin_bot(validator=OkValidator())
     mocked_matrix_client.send = AsyncMock(side_effect=request_side_effect_synapse)
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
     await mocked_matrix_client.fake_synced_text_message(
@@ -46,7 +46,7 @@ async def test_reset_password_v2() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value={}))
     )
-    mock_admin_client.session.request.side_effect = Mock(
+    mock_admin_client.session.request.side_effect = AsyncMock(
         side_effect=request_side_effect
     )
 
@@ -103,7 +103,7 @@ async def test_failed_reset_password_v2() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value={}))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
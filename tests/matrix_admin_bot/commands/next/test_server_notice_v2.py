@@ -1,11 +1,17 @@
 import json
+import time
+from pathlib import Path
 from typing import Any
 from unittest.mock import AsyncMock, Mock
 
 import pytest
 from nio import MatrixRoom
 
+from matrix_admin_bot.commands.next.server_notice_checkpoint import (
+    ServerNoticeCheckpoint,
+)
 from matrix_admin_bot.commands.next.server_notice_v2 import USER_ALL
+from matrix_command_bot.store import SQLiteCommandStore
 from matrix_command_bot.validation.validators.confirm import ConfirmValidator
 from tests import (
     USER1_ID,
@@ -175,9 +181,7 @@ TEXT_DATA = "Some simple server notice"
 @pytest.mark.asyncio
 async def test_server_notice_to_all_recipients() -> None:
     def request_side_effect(method: str, url: str, **kwargs: Any) -> Mock:  # noqa: ARG001
-        if method == "GET" and url.endswith(
-            "/api/admin/v1/users?filter[status]=active&page[first]=100"
-        ):
+        if method == "GET" and url.endswith("/api/admin/v1/users"):
             return mock_response_with_json(mas_user_response_data_page1)
         if method == "GET" and url.endswith(
             "/api/admin/v1/users?filter[status]=active&page[after]=030C1G60R30C1G60R30C1G60R3&page[first]=3"
@@ -193,7 +197,7 @@ async def test_server_notice_to_all_recipients() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value=user_response_data))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
@@ -250,9 +254,7 @@ async def test_server_notice_to_all_recipients_when_invalid_request() -> None:
 
     def request_side_effect(method: str, url: str, **kwargs: Any) -> Mock:  # noqa: ARG001
         nonlocal counter
-        if method == "GET" and url.endswith(
-            "/api/admin/v1/users?filter[status]=active&page[first]=100"
-        ):
+        if method == "GET" and url.endswith("/api/admin/v1/users"):
             return mock_response_with_json(mas_user_response_data_page1)
         if (
             method == "GET"
@@ -273,7 +275,7 @@ async def test_server_notice_to_all_recipients_when_invalid_request() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value=user_response_data))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
@@ -329,9 +331,7 @@ async def test_server_notice_to_all_recipients_when_exception() -> None:
 
     def request_side_effect(method: str, url: str, **kwargs: Any) -> Mock:  # noqa: ARG001
         nonlocal counter
-        if method == "GET" and url.endswith(
-            "/api/admin/v1/users?filter[status]=active&page[first]=100"
-        ):
+        if method == "GET" and url.endswith("/api/admin/v1/users"):
             return mock_response_with_json(mas_user_response_data_page1)
         if (
             method == "GET"
@@ -353,7 +353,7 @@ async def test_server_notice_to_all_recipients_when_exception() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value=user_response_data))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
@@ -406,9 +406,7 @@ async def test_server_notice_to_all_recipients_when_exception() -> None:
 @pytest.mark.asyncio
 async def test_server_notice_to_all_recipients_failed() -> None:
     def request_side_effect(method: str, url: str, **kwargs: Any) -> Mock:  # noqa: ARG001
-        if method == "GET" and url.endswith(
-            "/api/admin/v1/users?filter[status]=active&page[first]=100"
-        ):
+        if method == "GET" and url.endswith("/api/admin/v1/users"):
             return mock_response_with_json(mas_user_response_data_page1)
         return mock_response_error(403, "Forbidden")
 
@@ -420,7 +418,7 @@ async def test_server_notice_to_all_recipients_failed() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value=user_response_data))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
@@ -459,8 +457,8 @@ async def test_server_notice_to_all_recipients_failed() -> None:
     # 6 calls to fetch the users
     assert len(mock_admin_client.session.request.call_args_list) == 6
     assert "/users" in mock_admin_client.session.request.call_args_list[0][0][1]
-    # no call to send the notice to all users
-    assert len(mocked_matrix_client.send.await_args_list) == 0
+    # the users of the first page have already been notified
+    assert len(mocked_matrix_client.send.await_args_list) == 3
     mocked_matrix_client.send.reset_mock()
 
     t.cancel()
@@ -765,3 +763,298 @@ async def test_to_one_recipient_with_coordinator() -> None:
 
     t1.cancel()
     t2.cancel()
+
+
+@pytest.mark.asyncio
+async def test_resume_server_notice_to_all_recipients(tmp_path: Path) -> None:
+    mas_available = False
+
+    def request_side_effect(method: str, url: str, **kwargs: Any) -> Mock:  # noqa: ARG001
+        if method == "GET" and url.endswith("/api/admin/v1/users"):
+            return mock_response_with_json(mas_user_response_data_page1)
+        if mas_available:
+            return mock_response_with_json(mas_user_response_data_page2)
+        return mock_response_error(403, "Forbidden")
+
+    (
+        mocked_matrix_client,
+        mock_admin_client,
+        t,
+    ) = await create_fake_admin_bot(
+        validator=ConfirmValidator(), server_notice_checkpoint_dir=str(tmp_path)
+    )
+    mocked_matrix_client.send = AsyncMock(
+        return_value=Mock(ok=True, json=AsyncMock(return_value=user_response_data))
+    )
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
+
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    command_event_id = await mocked_matrix_client.fake_synced_text_message(
+        room, USER1_ID, "!server_notice"
+    )
+    for reply, expected_message in (
+        (USER_ALL, "Type your recipients"),
+        (TEXT_DATA, "Type your notice"),
+        ("yes", "Please reply"),
+    ):
+        mocked_matrix_client.check_sent_message(expected_message)
+        await mocked_matrix_client.fake_synced_text_message(
+            room,
+            USER1_ID,
+            reply,
+            extra_content=create_thread_relation(command_event_id),
+        )
+
+    # the first page has been notified before MAS failed
+    assert len(mocked_matrix_client.send.await_args_list) == 3
+    mocked_matrix_client.send.reset_mock()
+    campaign_id = next(tmp_path.glob("*.json")).stem
+    delivered = (tmp_path / f"{campaign_id}.delivered").read_text().split()
+    assert len(delivered) == 3
+
+    mas_available = True
+    resume_event_id = await mocked_matrix_client.fake_synced_text_message(
+        room, USER1_ID, f"!server_notice resume {campaign_id}"
+    )
+    mocked_matrix_client.check_sent_message(f"`{campaign_id}` will be resumed")
+    await mocked_matrix_client.fake_synced_text_message(
+        room,
+        USER1_ID,
+        "yes",
+        extra_content=create_thread_relation(resume_event_id),
+    )
+
+    # only the remaining user is notified
+    assert len(mocked_matrix_client.send.await_args_list) == 1
+    data = json.loads(mocked_matrix_client.send.await_args_list[0][1]["data"])
+    assert data["user_id"] not in delivered
+    assert data["content"]["body"] == TEXT_DATA
+    # the campaign is complete
+    assert not list(tmp_path.iterdir())
+
+    t.cancel()
+
+
+@pytest.mark.asyncio
+async def test_resume_unknown_server_notice_campaign(tmp_path: Path) -> None:
+    mocked_matrix_client, _, t = await create_fake_admin_bot(
+        validator=ConfirmValidator(), server_notice_checkpoint_dir=str(tmp_path)
+    )
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    await mocked_matrix_client.fake_synced_text_message(
+        room, USER1_ID, "!server_notice resume unknown"
+    )
+
+    # No validation is asked for
+    mocked_matrix_client.check_sent_message("no server notice campaign to resume")
+    mocked_matrix_client.check_no_sent_message()
+    mocked_matrix_client.check_sent_reactions()
+
+    t.cancel()
+
+
+@pytest.mark.asyncio
+async def test_resumed_server_notice_survives_restart(tmp_path: Path) -> None:
+    store_path = str(tmp_path / "commands.sqlite")
+    # MAS usernames are localparts, the mocked ones are full user ids
+    user_ids = [f"@{user_id}:example.org" for user_id in (USER1_ID, USER2_ID)]
+    user_ids += [f"@{user_id}:example.org" for user_id in (USER3_ID, USER4_ID)]
+    checkpoint = ServerNoticeCheckpoint(str(tmp_path), "campaign")
+    await checkpoint.save({"msgtype": "m.text", "body": TEXT_DATA}, [USER_ALL])
+    await checkpoint.mark_delivered(user_ids[0])
+    await checkpoint.flush()
+
+    (
+        mocked_matrix_client,
+        mock_admin_client,
+        t,
+    ) = await create_fake_admin_bot(
+        validator=ConfirmValidator(),
+        server_notice_checkpoint_dir=str(tmp_path),
+        command_store=SQLiteCommandStore(store_path),
+    )
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+    resume_event_id = await mocked_matrix_client.fake_synced_text_message(
+        room, USER1_ID, "!server_notice resume campaign"
+    )
+    mocked_matrix_client.check_sent_message("`campaign` will be resumed")
+    t.cancel()
+
+    # The delivered users are not duplicated in the persisted state
+    record = SQLiteCommandStore(store_path).get_command(resume_event_id)
+    assert record is not None
+    assert "delivered" not in record.state["state"]
+
+    (
+        mocked_matrix_client,
+        mock_admin_client,
+        t,
+    ) = await create_fake_admin_bot(
+        validator=ConfirmValidator(),
+        server_notice_checkpoint_dir=str(tmp_path),
+        command_store=SQLiteCommandStore(store_path),
+    )
+    mocked_matrix_client.send = AsyncMock(
+        return_value=Mock(ok=True, json=AsyncMock(return_value=user_response_data))
+    )
+
+    def request_side_effect(method: str, url: str, **kwargs: Any) -> Mock:  # noqa: ARG001
+        if url.endswith("/api/admin/v1/users"):
+            return mock_response_with_json(mas_user_response_data_page1)
+        # The last page has no next link
+        return mock_response_with_json(mas_user_response_data_page2)
+
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
+    await mocked_matrix_client.fake_synced_text_message(
+        room,
+        USER1_ID,
+        "yes",
+        extra_content=create_thread_relation(resume_event_id),
+    )
+
+    # The delivered users are rebuilt from the checkpoint
+    notified = [
+        json.loads(call[1]["data"])["user_id"]
+        for call in mocked_matrix_client.send.await_args_list
+    ]
+    assert notified == user_ids[1:]
+
+    t.cancel()
+
+
+@pytest.mark.asyncio
+async def test_server_notice_waits_for_retry_after() -> None:
+    (
+        mocked_matrix_client,
+        mock_admin_client,
+        t,
+    ) = await create_fake_admin_bot(validator=ConfirmValidator())
+    limit_exceeded = Mock(
+        ok=False,
+        status=429,
+        headers={},
+        json=AsyncMock(
+            return_value={"errcode": "M_LIMIT_EXCEEDED", "retry_after_ms": 200}
+        ),
+    )
+    mocked_matrix_client.send = AsyncMock(
+        side_effect=[
+            limit_exceeded,
+            Mock(ok=True, json=AsyncMock(return_value=user_response_data)),
+        ]
+    )
+    mock_admin_client.session.request = Mock()
+
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    command_event_id = await mocked_matrix_client.fake_synced_text_message(
+        room, USER1_ID, "!server_notice"
+    )
+    for reply in (USER2_ID, TEXT_DATA):
+        await mocked_matrix_client.fake_synced_text_message(
+            room,
+            USER1_ID,
+            reply,
+            extra_content=create_thread_relation(command_event_id),
+        )
+
+    start = time.perf_counter()
+    await mocked_matrix_client.fake_synced_text_message(
+        room,
+        USER1_ID,
+        "yes",
+        extra_content=create_thread_relation(command_event_id),
+    )
+
+    # retried once Synapse allowed it, at a lower rate
+    assert len(mocked_matrix_client.send.await_args_list) == 2
+    assert time.perf_counter() - start >= 0.2 * 0.9
+    assert mock_admin_client.server_notice_rate_limiter.rate < 10
+
+    t.cancel()
+
+
+@pytest.mark.asyncio
+async def test_server_notice_progress_is_edited_in_place() -> None:
+    (
+        mocked_matrix_client,
+        mock_admin_client,
+        t,
+    ) = await create_fake_admin_bot(
+        validator=ConfirmValidator(), server_notice_progress_interval=0.05
+    )
+    mocked_matrix_client.send = AsyncMock(
+        return_value=Mock(ok=True, json=AsyncMock(return_value=user_response_data))
+    )
+    mock_admin_client.session.request = Mock()
+
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    command_event_id = await mocked_matrix_client.fake_synced_text_message(
+        room, USER1_ID, "!server_notice"
+    )
+    for reply in (f"{USER2_ID} {USER3_ID} {USER4_ID}", TEXT_DATA, "yes"):
+        await mocked_matrix_client.fake_synced_text_message(
+            room,
+            USER1_ID,
+            reply,
+            extra_content=create_thread_relation(command_event_id),
+        )
+
+    assert len(mocked_matrix_client.send.await_args_list) == 3
+    # a single progress message, then edits
+    progress_messages = [
+        args[0][1]
+        for args in mocked_matrix_client.send_text_message.await_args_list
+        if "Server notice on example.org" in args[0][1]
+    ]
+    assert len(progress_messages) == 1
+    assert "in progress" in progress_messages[0]
+    edits = [args[0][2] for args in mocked_matrix_client.room_send.await_args_list]
+    assert edits
+    assert all(edit["m.relates_to"]["rel_type"] == "m.replace" for edit in edits)
+    assert "completed: 3 sent, 0 failed" in edits[-1]["m.new_content"]["body"]
+
+    t.cancel()
+
+
+@pytest.mark.asyncio
+async def test_server_notice_continues_when_checkpoint_fails(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(
+        ServerNoticeCheckpoint,
+        "mark_delivered",
+        AsyncMock(side_effect=OSError("No space left on device")),
+    )
+    (
+        mocked_matrix_client,
+        _,
+        t,
+    ) = await create_fake_admin_bot(
+        validator=ConfirmValidator(), server_notice_checkpoint_dir=str(tmp_path)
+    )
+    mocked_matrix_client.send = AsyncMock(
+        return_value=Mock(ok=True, json=AsyncMock(return_value=user_response_data))
+    )
+
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    command_event_id = await mocked_matrix_client.fake_synced_text_message(
+        room, USER1_ID, "!server_notice"
+    )
+    for reply in (f"{USER2_ID} {USER3_ID} {USER4_ID}", TEXT_DATA, "yes"):
+        await mocked_matrix_client.fake_synced_text_message(
+            room,
+            USER1_ID,
+            reply,
+            extra_content=create_thread_relation(command_event_id),
+        )
+
+    # every notice is sent once, and the campaign completes
+    assert len(mocked_matrix_client.send.await_args_list) == 3
+    assert not list(tmp_path.iterdir())
+
+    t.cancel()
@@ -47,7 +47,7 @@ async def test_user_v2() -> None:
         t,
     ) = await create_fake_admin_bot(validator=OkValidator())
     mocked_matrix_client.send = AsyncMock(side_effect=request_synapse_side_effect)
-    mock_admin_client.session.request.side_effect = Mock(
+    mock_admin_client.session.request.side_effect = AsyncMock(
         side_effect=request_side_effect
     )
 
@@ -105,7 +105,7 @@ async def test_failed_user_v2() -> None:
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value={}))
     )
-    mock_admin_client.session.request = Mock(side_effect=request_side_effect)
+    mock_admin_client.session.request = AsyncMock(side_effect=request_side_effect)
 
     room = MatrixRoom("!roomid:example.org", USER1_ID)
 
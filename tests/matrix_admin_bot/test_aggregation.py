@@ -0,0 +1,246 @@
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Any
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from nio import Event, MatrixRoom
+
+from matrix_admin_bot.commands.next.admin_client import AdminClient
+from matrix_command_bot.aggregation import RESULT_EVENT_TYPE, CommandResult
+from tests import (
+    USER1_ID,
+    MatrixClientMock,
+    OkValidator,
+    create_fake_admin_bot,
+    generate_event_id,
+)
+from tests.matrix_admin_bot.commands.next import (
+    COMPAT_SESSIONS_LIST,
+    OAUTH2_SESSIONS_LIST,
+    USER,
+    USER_SESSIONS_LIST,
+    mock_response_error,
+    mock_response_with_json,
+)
+
+LOCK_COMMAND = "!lock @user_to_reset:example.org @user_to_reset:example2.org"
+WORKER_USER_ID = "@admin:example2.org"
+
+
+def create_result_event(sender: str, content: dict[str, Any]) -> Event:
+    return Event.parse_event(
+        {
+            "event_id": generate_event_id(),
+            "sender": sender,
+            "origin_server_ts": int(time.time() * 1000),
+            "type": RESULT_EVENT_TYPE,
+            "content": content,
+        }
+    )
+
+
+def request_side_effect(method: str, url: str, **_kwargs: Any) -> Mock:
+    if method == "GET" and url.endswith(
+        "/api/admin/v1/users/by-username/user_to_reset"
+    ):
+        return mock_response_with_json(USER)
+    if method == "GET" and url.endswith("/api/admin/v1/compat-sessions"):
+        return mock_response_with_json(COMPAT_SESSIONS_LIST)
+    if method == "GET" and url.endswith("/api/admin/v1/oauth2-sessions"):
+        return mock_response_with_json(OAUTH2_SESSIONS_LIST)
+    if method == "GET" and url.endswith("/api/admin/v1/user-sessions"):
+        return mock_response_with_json(USER_SESSIONS_LIST)
+    if method == "POST" and url.endswith("/lock"):
+        return mock_response_with_json(USER)
+    return mock_response_error(403, "Forbidden")
+
+
+def mock_admin_api(matrix_client: MatrixClientMock, admin_client: AdminClient) -> None:
+    matrix_client.send = AsyncMock(  # pyright: ignore[reportAttributeAccessIssue]
+        return_value=Mock(ok=True, json=AsyncMock(return_value={}))
+    )
+    admin_client.session.request = AsyncMock(side_effect=request_side_effect)  # pyright: ignore[reportAttributeAccessIssue]
+
+
+def read_sent_report(matrix_client: MatrixClientMock) -> list[dict[str, Any]]:
+    reports: list[dict[str, Any]] = []
+
+    async def send_file_message(_room_id: str, path: str, **_kwargs: Any) -> str:
+        reports.append(json.loads(Path(path).read_text()))
+        return generate_event_id()
+
+    matrix_client.send_file_message.side_effect = send_file_message
+    return reports
+
+
+@pytest.mark.asyncio
+async def test_worker_results_are_aggregated() -> None:
+    coordinator, coordinator_admin_client, t1 = await create_fake_admin_bot(
+        validator=OkValidator(),
+        aggregate_results=True,
+        worker_user_ids=[WORKER_USER_ID],
+    )
+    worker, worker_admin_client, t2 = await create_fake_admin_bot(
+        "example2.org",
+        is_coordinator=False,
+        validator=OkValidator(),
+        aggregate_results=True,
+    )
+    mock_admin_api(coordinator, coordinator_admin_client)
+    mock_admin_api(worker, worker_admin_client)
+    reports = read_sent_report(coordinator)
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+    command_event_id = generate_event_id()
+
+    await worker.fake_synced_text_message(
+        room, USER1_ID, LOCK_COMMAND, event_id=command_event_id
+    )
+
+    # The worker only sends its result to the coordinator
+    worker.send_file_message.assert_not_awaited()
+    worker.check_sent_reactions()
+    worker.check_no_sent_message()
+    worker.room_send.assert_awaited_once()
+    _, event_type, content = worker.room_send.await_args[0]
+    assert event_type == RESULT_EVENT_TYPE
+    assert content["command_event_id"] == command_event_id
+    assert content["result"]
+
+    await coordinator.fake_synced_message(
+        room, create_result_event(worker.user_id, content)
+    )
+    await coordinator.fake_synced_text_message(
+        room, USER1_ID, LOCK_COMMAND, event_id=command_event_id
+    )
+
+    coordinator.send_file_message.assert_awaited_once()
+    assert reports[0]["command"] == "lock"
+    assert set(reports[0]) >= {
+        "@user_to_reset:example.org",
+        "@user_to_reset:example2.org",
+    }
+    assert reports[0]["servers"] == {
+        "example.org": {"result": True},
+        "example2.org": {"result": True, "report": "merged"},
+    }
+    coordinator.check_sent_reactions("🚀", "✅")
+
+    t1.cancel()
+    t2.cancel()
+
+
+@pytest.mark.asyncio
+async def test_missing_worker_result() -> None:
+    coordinator, admin_client, t = await create_fake_admin_bot(
+        validator=OkValidator(),
+        aggregate_results=True,
+        aggregation_timeout=0.1,
+        worker_user_ids=[WORKER_USER_ID],
+    )
+    mock_admin_api(coordinator, admin_client)
+    reports = read_sent_report(coordinator)
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    await coordinator.fake_synced_text_message(room, USER1_ID, LOCK_COMMAND)
+
+    assert reports[0]["servers"]["example2.org"] == {"result": None}
+    coordinator.check_sent_message("No result received from the bots of: example2.org")
+    coordinator.check_sent_reactions("🚀", "❌")
+
+    t.cancel()
+
+
+@pytest.mark.asyncio
+async def test_forged_results_are_ignored() -> None:
+    coordinator, admin_client, t = await create_fake_admin_bot(
+        validator=OkValidator(),
+        aggregate_results=True,
+        aggregation_timeout=0.1,
+        worker_user_ids=[WORKER_USER_ID],
+    )
+    mock_admin_api(coordinator, admin_client)
+    reports = read_sent_report(coordinator)
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+    other_room = MatrixRoom("!other:example.org", USER1_ID)
+    command_event_id = generate_event_id()
+    content = CommandResult("example2.org", result=True).to_content(command_event_id)
+
+    # Another account of the worker server, and the worker bot in another room
+    await coordinator.fake_synced_message(
+        room, create_result_event("@user:example2.org", content)
+    )
+    await coordinator.fake_synced_message(
+        other_room, create_result_event(WORKER_USER_ID, content)
+    )
+    await coordinator.fake_synced_text_message(
+        room, USER1_ID, LOCK_COMMAND, event_id=command_event_id
+    )
+
+    assert reports[0]["servers"]["example2.org"] == {"result": None}
+    coordinator.check_sent_reactions("🚀", "❌")
+
+    t.cancel()
+
+
+@pytest.mark.asyncio
+async def test_servers_without_worker_are_skipped() -> None:
+    coordinator, admin_client, t = await create_fake_admin_bot(
+        validator=OkValidator(),
+        aggregate_results=True,
+        aggregation_timeout=10,
+        worker_user_ids=[WORKER_USER_ID],
+    )
+    mock_admin_api(coordinator, admin_client)
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    async with asyncio.timeout(5):
+        await coordinator.fake_synced_text_message(
+            room, USER1_ID, "!lock @user_to_reset:example.org @user:typo.org"
+        )
+
+    coordinator.send_file_message.assert_awaited_once()
+    coordinator.check_no_sent_message()
+    coordinator.check_sent_reactions("🚀", "✅")
+
+    t.cancel()
+
+
+@pytest.mark.asyncio
+async def test_large_worker_results_are_sent_by_the_worker() -> None:
+    coordinator, admin_client, t = await create_fake_admin_bot(
+        validator=OkValidator(),
+        aggregate_results=True,
+        aggregation_timeout=10,
+        worker_user_ids=[WORKER_USER_ID],
+    )
+    mock_admin_api(coordinator, admin_client)
+    reports = read_sent_report(coordinator)
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+    command_event_id = generate_event_id()
+    failed_user_ids = [f"@user{i}:example2.org" for i in range(5000)]
+    content = CommandResult(
+        "example2.org", result=False, failed_user_ids=failed_user_ids, report={}
+    ).to_content(command_event_id)
+
+    # Over the size of an event, the worker sends them itself
+    assert "failed_user_ids" not in content
+    assert "report" not in content
+
+    await coordinator.fake_synced_message(
+        room, create_result_event(WORKER_USER_ID, content)
+    )
+    async with asyncio.timeout(5):
+        await coordinator.fake_synced_text_message(
+            room, USER1_ID, LOCK_COMMAND, event_id=command_event_id
+        )
+
+    assert reports[0]["servers"]["example2.org"] == {
+        "result": False,
+        "report": "uploaded",
+    }
+    coordinator.check_sent_reactions("🚀", "❌")
+
+    t.cancel()
@@ -24,3 +24,18 @@ async def test_help_command() -> None:
         mocked_client.check_sent_message(command.KEYWORD)  # pyright: ignore [reportUnknownArgumentType]
 
     t.cancel()
+
+
+@pytest.mark.asyncio
+async def test_queue_command() -> None:
+    mocked_client, _, t = await create_fake_admin_bot()
+
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    await mocked_client.fake_synced_text_message(room, USER1_ID, "!queue")
+
+    mocked_client.check_sent_message(
+        "Commands on example.org:\n\nRunning: 0\nQueued: 0"
+    )
+
+    t.cancel()
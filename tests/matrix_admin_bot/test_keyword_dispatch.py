@@ -0,0 +1,79 @@
+from unittest.mock import Mock
+
+import pytest
+from nio import MatrixRoom, RoomMessageText
+
+from matrix_admin_bot.adminbot import HelpCommand, get_command_list
+from matrix_command_bot.command import ICommand
+from matrix_command_bot.commandbot import CommandBot
+from tests import USER1_ID, MatrixClientMock
+
+NB_MESSAGES = 10
+
+
+def create_message(body: str) -> RoomMessageText:
+    message = RoomMessageText.parse_event(
+        {
+            "event_id": "$event",
+            "sender": USER1_ID,
+            "origin_server_ts": 0,
+            "type": "m.room.message",
+            "content": {"msgtype": "m.text", "body": body},
+        }
+    )
+    assert isinstance(message, RoomMessageText)
+    return message
+
+
+def create_bot() -> CommandBot:
+    bot = CommandBot(
+        homeserver="",
+        username="",
+        password="",
+        commands=[*get_command_list(), HelpCommand],
+    )
+    bot.matrix_client = MatrixClientMock()
+    return bot
+
+
+def test_commands_are_dispatched_by_keyword() -> None:
+    bot = create_bot()
+
+    assert bot.get_candidate_commands(create_message("hello")) == []
+    assert bot.get_candidate_commands(create_message("!help")) == [HelpCommand]
+    assert [
+        command.KEYWORD
+        for command in bot.get_candidate_commands(create_message("!lock @a:b"))
+    ] == ["lock"]
+    assert bot.get_candidate_commands(create_message("!unknown")) == []
+
+
+def spy_command(command_type: type[ICommand]) -> Mock:
+    spy = Mock(wraps=command_type, KEYWORD=command_type.KEYWORD)
+    spy.__name__ = command_type.__name__
+    return spy
+
+
+@pytest.mark.asyncio
+async def test_plain_messages_only_try_commands_without_keyword() -> None:
+    bot = create_bot()
+    bot.commands_by_keyword = {
+        keyword: [spy_command(command_type) for command_type in command_types]
+        for keyword, command_types in bot.commands_by_keyword.items()
+    }
+    bot.commands_without_keyword = [
+        spy_command(command_type) for command_type in bot.commands_without_keyword
+    ]
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    for _ in range(NB_MESSAGES):
+        await bot.handle_event(room, create_message("Just chatting in the admin room"))
+
+    spies = [spy for group in bot.commands_by_keyword.values() for spy in group]
+    assert not any(spy.called for spy in spies)
+    for spy in bot.commands_without_keyword:
+        assert spy.call_count == NB_MESSAGES
+
+    await bot.handle_event(room, create_message("!help"))
+
+    assert [spy.__name__ for spy in spies if spy.called] == [HelpCommand.__name__]
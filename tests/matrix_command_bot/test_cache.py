@@ -0,0 +1,70 @@
+from unittest.mock import Mock
+
+from structlog.testing import capture_logs
+
+from matrix_command_bot.cache import MeteredTTLCache
+from matrix_command_bot.commandbot import CommandBot
+
+
+class FakeTimer:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_cache_counters() -> None:
+    on_evict = Mock()
+    timer = FakeTimer()
+    cache: MeteredTTLCache[str, int] = MeteredTTLCache(
+        "test", maxsize=2, ttl=10, on_evict=on_evict, timer=timer
+    )
+    cache["a"] = 1
+    cache["b"] = 2
+
+    assert cache["a"] == 1
+    assert cache.get("b") == 2
+    assert cache.get("c") is None
+
+    cache["c"] = 3
+    on_evict.assert_called_once_with("a", 1)
+
+    timer.now = 20
+    assert cache.get("b") is None
+
+    assert cache.get_stats() == {
+        "size": 0,
+        "maxsize": 2,
+        "entries": 0,
+        "hits": 2,
+        "misses": 2,
+        "evictions": 1,
+        "expirations": 2,
+    }
+
+    cache["d"] = 4
+    cache["e"] = 5
+    assert cache.pop("d") == 4
+    assert cache.pop("d", None) is None
+    # Clearing the cache neither evicts nor expires its entries
+    cache.clear()
+    assert len(cache) == 0
+    on_evict.assert_called_once()
+    assert cache.get_stats()["evictions"] == 1
+    assert cache.get_stats()["expirations"] == 2
+
+
+def test_evicted_command_root_is_reported() -> None:
+    bot = CommandBot(
+        homeserver="", username="", password="", commands=[], commands_cache_size=2
+    )
+    for i in range(3):
+        bot.commands_cache[f"$command{i}"] = Mock()
+
+    with capture_logs() as logs:
+        bot.commands_cache["$command3"] = Mock()
+
+    assert logs[0]["log_level"] == "warning"
+    assert logs[0]["command_event_id"] == "$command1"
+    assert bot.get_cache_stats()["commands"]["evictions"] == 2
@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import pytest
+from nio import MatrixRoom
+
+from matrix_command_bot.store import CommandRecord, SQLiteCommandStore
+from tests import (
+    USER1_ID,
+    create_fake_command_bot,
+    create_reply_relation,
+    create_thread_relation,
+)
+from tests.matrix_command_bot.validation.validators.test_confirm import (
+    ConfirmValidatedCommand,
+)
+
+
+@pytest.mark.asyncio
+async def test_pending_command_survives_restart(tmp_path: Path) -> None:
+    store_path = str(tmp_path / "commands.sqlite")
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    mocked_client, t = await create_fake_command_bot(
+        [ConfirmValidatedCommand], command_store=SQLiteCommandStore(store_path)
+    )
+    mocked_client.executed = False
+    command_event_id = await mocked_client.fake_synced_text_message(
+        room, USER1_ID, "!test"
+    )
+    mocked_client.check_sent_reactions("✏️")
+    mocked_client.check_sent_message("yes")
+    t.cancel()
+
+    # A new bot on the same store, as after a restart
+    mocked_client, t = await create_fake_command_bot(
+        [ConfirmValidatedCommand], command_store=SQLiteCommandStore(store_path)
+    )
+    mocked_client.executed = False
+    reply_event_id = await mocked_client.fake_synced_text_message(
+        room, USER1_ID, "no", extra_content=create_thread_relation(command_event_id)
+    )
+    assert not mocked_client.executed
+    # The prompt has not been sent again
+    mocked_client.check_no_sent_message()
+
+    # The reply to a reply is indexed from the store too
+    await mocked_client.fake_synced_text_message(
+        room, USER1_ID, "yes", extra_content=create_reply_relation(reply_event_id)
+    )
+    assert mocked_client.executed
+    mocked_client.check_sent_reactions("🚀", "✅")
+    t.cancel()
+
+    store = SQLiteCommandStore(store_path)
+    assert store.get_command(command_event_id) is None
+
+
+def test_expired_records_are_ignored(tmp_path: Path) -> None:
+    store = SQLiteCommandStore(str(tmp_path / "commands.sqlite"), ttl=-1)
+    store.save_command(CommandRecord("$command", "!roomid", "Command", {}, {}))
+    store.save_related_command_id("$reply", "$command")
+
+    assert store.get_command("$command") is None
+    assert store.get_related_command_id("$reply") is None
+
+    store.ttl = 60
+    store.save_related_command_id("$reply", "$command")
+    assert store.get_related_command_id("$reply") == "$command"
@@ -0,0 +1,75 @@
+import weakref
+from typing import Any
+
+from nio import RoomMessage, RoomMessageText
+
+from matrix_command_bot.event_cache import EventCache, EventRecord
+from tests import USER1_ID
+
+NB_EVENTS = 1024
+
+
+def create_message(i: int) -> RoomMessage:
+    content: dict[str, Any] = {
+        "msgtype": "m.text",
+        "body": f"> <{USER1_ID}> previous message\n\nA message of the admin room {i}",
+        "format": "org.matrix.custom.html",
+        "formatted_body": f"<mx-reply>...</mx-reply><p>A message {i}</p>",
+        "m.relates_to": {
+            "rel_type": "m.thread",
+            "event_id": "$command",
+            "is_falling_back": False,
+            "m.in_reply_to": {"event_id": f"$event{i - 1}"},
+        },
+    }
+    message = RoomMessageText.parse_event(
+        {
+            "event_id": f"$event{i}",
+            "sender": USER1_ID,
+            "origin_server_ts": 0,
+            "type": "m.room.message",
+            "unsigned": {"age": 1234},
+            "content": content,
+        }
+    )
+    assert isinstance(message, RoomMessageText)
+    return message
+
+
+def test_event_record() -> None:
+    record = EventRecord.from_message(create_message(1))
+
+    assert record.event_id == "$event1"
+    assert record.sender == USER1_ID
+    assert record.in_reply_to == "$event0"
+    assert record.thread_root == "$command"
+    assert record.replaces is None
+
+
+def test_event_cache_is_bounded_in_bytes() -> None:
+    record_size = EventRecord.from_message(create_message(0)).get_size()
+    cache = EventCache(max_bytes=100 * record_size)
+
+    for i in range(1000):
+        cache.add(create_message(i))
+
+    assert cache.currsize <= cache.maxsize
+    assert 90 <= len(cache) <= 100
+    # The oldest events are evicted first
+    assert "$event999" in cache
+    assert "$event0" not in cache
+
+
+def test_event_records_do_not_retain_the_messages() -> None:
+    cache = EventCache()
+    message_refs: list[weakref.ref[RoomMessage]] = []
+    for i in range(NB_EVENTS):
+        message = create_message(i)
+        message_refs.append(weakref.ref(message))
+        cache.add(message)
+        del message
+
+    assert len(cache) == NB_EVENTS
+    # Only the event ids and relations are kept, not the full events
+    assert not any(message_ref() for message_ref in message_refs)
+    assert not hasattr(cache["$event0"], "__dict__")
@@ -0,0 +1,50 @@
+from typing import Any
+
+import pytest
+from nio import MatrixRoom, RoomMessage
+
+from matrix_command_bot.commandbot import CommandBot
+from tests import USER1_ID, MatrixClientMock
+
+
+def create_message(sender: str, body: str, **extra_content: Any) -> RoomMessage:
+    message = RoomMessage.parse_event(
+        {
+            "event_id": f"$event{body}",
+            "sender": sender,
+            "origin_server_ts": 0,
+            "type": "m.room.message",
+            "content": {"msgtype": "m.text", "body": body, **extra_content},
+        }
+    )
+    assert isinstance(message, RoomMessage)
+    return message
+
+
+@pytest.mark.asyncio
+async def test_irrelevant_events_do_not_create_tasks() -> None:
+    bot = CommandBot(homeserver="", username="", password="", commands=[])
+    bot.matrix_client = MatrixClientMock()
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+    bot_user_id = bot.matrix_client.user_id
+
+    for message in [
+        create_message(USER1_ID, "hello"),
+        create_message(USER1_ID, "bot status", msgtype="m.notice"),
+        create_message(bot_user_id, "Please reply"),
+    ]:
+        await bot.launch_handle_event_task(room, message)
+
+    assert not bot.background_tasks
+    assert bot.skipped_events == {"not_a_command": 1, "notice": 1, "own_message": 1}
+
+    for message in [
+        create_message(USER1_ID, "!ping"),
+        create_message(
+            USER1_ID, "yes", **{"m.relates_to": {"m.in_reply_to": {"event_id": "$a"}}}
+        ),
+    ]:
+        await bot.launch_handle_event_task(room, message)
+
+    assert len(bot.background_tasks) == 2
+    assert sum(bot.skipped_events.values()) == 3
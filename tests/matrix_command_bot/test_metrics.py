@@ -0,0 +1,105 @@
+import socket
+
+import aiohttp
+import pytest
+from nio import MatrixRoom
+
+from matrix_command_bot.metrics import MetricsRegistry, get_endpoint_label
+from tests import USER1_ID, create_fake_command_bot
+from tests.matrix_command_bot.test_simple_command import SimpleTestCommand
+
+
+def test_metrics_rendering() -> None:
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "Requests", ("endpoint",))
+    histogram = registry.histogram(
+        "request_duration_seconds", "Durations", ("endpoint",), buckets=(0.1, 1)
+    )
+    registry.gauge("queue_depth", "Depth", collect=lambda: {(): 3})
+
+    counter.inc('/a"b')
+    counter.inc('/a"b')
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.5, "/a")
+    histogram.observe(5, "/a")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{endpoint="/a\\"b"} 2.0' in lines
+    assert 'request_duration_seconds_bucket{endpoint="/a",le="0.1"} 1' in lines
+    assert 'request_duration_seconds_bucket{endpoint="/a",le="1.0"} 2' in lines
+    assert 'request_duration_seconds_bucket{endpoint="/a",le="+Inf"} 3' in lines
+    assert 'request_duration_seconds_count{endpoint="/a"} 3' in lines
+    assert "queue_depth 3.0" in lines
+
+
+def test_gauge_series_removal() -> None:
+    registry = MetricsRegistry()
+    gauge = registry.gauge("queue_depth", "Depth", ("campaign",))
+
+    gauge.set(3, "a")
+    gauge.set(5, "b")
+    gauge.remove("a")
+    gauge.remove("unknown")
+
+    lines = registry.render().splitlines()
+    assert 'queue_depth{campaign="b"} 5.0' in lines
+    assert not any('campaign="a"' in line for line in lines)
+
+
+def test_endpoint_label_has_no_ids() -> None:
+    assert (
+        get_endpoint_label("/_synapse/admin/v2/users/@user:example.org/devices")
+        == "/_synapse/admin/v2/users/{id}/devices"
+    )
+    assert (
+        get_endpoint_label("/api/admin/v1/users/01040G2081040G2081040G2081/lock")
+        == "/api/admin/v1/users/{id}/lock"
+    )
+    assert (
+        get_endpoint_label("/api/admin/v1/users/by-username/john.doe")
+        == "/api/admin/v1/users/by-username/{id}"
+    )
+    assert (
+        get_endpoint_label("/api/admin/v1/compat-sessions?filter[user]=0104")
+        == "/api/admin/v1/compat-sessions"
+    )
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint() -> None:
+    port = get_free_port()
+    mocked_client, t = await create_fake_command_bot(
+        [SimpleTestCommand], metrics_port=port
+    )
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+    await mocked_client.fake_synced_text_message(room, USER1_ID, "!test")
+    await mocked_client.fake_synced_text_message(room, USER1_ID, "Hello")
+
+    async with (
+        aiohttp.ClientSession() as session,
+        session.get(f"http://127.0.0.1:{port}/metrics") as resp,
+    ):
+        assert resp.status == 200
+        body = await resp.text()
+
+    assert (
+        'matrix_bot_commands_total{keyword="SimpleTestCommand",result="success"}'
+        in body
+    )
+    assert (
+        'matrix_bot_step_duration_seconds_count{command="SimpleTestCommand",'
+        'step="SimpleExecuteStep"}' in body
+    )
+    assert 'matrix_bot_skipped_events_total{reason="not_a_command"} 1.0' in body
+    assert 'matrix_bot_scheduled_commands{state="queued"} 0' in body
+    assert 'matrix_bot_cache{cache="commands",stat="entries"} 1' in body
+    assert "matrix_bot_event_loop_lag_seconds" in body
+
+    t.cancel()
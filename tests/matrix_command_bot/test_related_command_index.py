@@ -0,0 +1,82 @@
+from typing import Any
+from unittest.mock import Mock
+
+import pytest
+from nio import RoomMessage, RoomMessageText
+
+from matrix_command_bot.commandbot import CommandBot
+from tests import USER1_ID
+
+CHAIN_DEPTH = 1000
+
+
+def create_reply(event_id: str, replied_event_id: str | None) -> RoomMessage:
+    content: dict[str, Any] = {"msgtype": "m.text", "body": "reply"}
+    if replied_event_id:
+        content["m.relates_to"] = {"m.in_reply_to": {"event_id": replied_event_id}}
+    message = RoomMessageText.parse_event(
+        {
+            "event_id": event_id,
+            "sender": USER1_ID,
+            "origin_server_ts": 0,
+            "type": "m.room.message",
+            "content": content,
+        }
+    )
+    assert isinstance(message, RoomMessageText)
+    return message
+
+
+def test_deep_reply_chain_resolves_with_one_lookup() -> None:
+    bot = CommandBot(homeserver="", username="", password="", commands=[])
+    command = Mock()
+    bot.commands_cache["$event0"] = command
+    events = [create_reply("$event0", None)] + [
+        create_reply(f"$event{i}", f"$event{i - 1}") for i in range(1, CHAIN_DEPTH)
+    ]
+    for event in events:
+        bot.index_related_command(event)
+    deepest = events[-1]
+    stats = bot.related_command_ids.get_stats()
+
+    assert bot.get_related_command(deepest) is command
+
+    # A single index entry is read, whatever the depth of the chain
+    assert bot.related_command_ids.hits == stats["hits"] + 1
+    assert bot.related_command_ids.misses == stats["misses"]
+    # Every reply of the chain points to the command itself
+    assert all(
+        bot.related_command_ids[event.event_id] == "$event0" for event in events[1:]
+    )
+
+
+def test_expired_command_is_not_resolved() -> None:
+    bot = CommandBot(homeserver="", username="", password="", commands=[])
+    bot.commands_cache["$command"] = Mock()
+    reply = create_reply("$reply", "$command")
+    bot.index_related_command(reply)
+    assert bot.get_related_command(reply) is not None
+
+    del bot.commands_cache["$command"]
+
+    assert bot.get_related_command(reply) is None
+    # Replies to an expired command are not related to anything anymore
+    late_reply = create_reply("$late_reply", "$reply")
+    bot.index_related_command(late_reply)
+    assert bot.get_related_command(late_reply) is None
+
+
+@pytest.mark.asyncio
+async def test_related_command_is_looked_up_once() -> None:
+    bot = CommandBot(homeserver="", username="", password="", commands=[])
+    command = Mock()
+    bot.commands_cache["$command"] = command
+    reply = create_reply("$reply", "$command")
+    bot.index_related_command(reply)
+    stats = bot.related_command_ids.get_stats()
+
+    assert await bot.find_related_command(reply) is command
+
+    # One hit in the index metrics per event
+    assert bot.related_command_ids.hits == stats["hits"] + 1
+    assert bot.related_command_ids.misses == stats["misses"]
@@ -0,0 +1,41 @@
+import gzip
+import io
+import json
+
+import pytest
+
+from matrix_command_bot import report
+from matrix_command_bot.report import get_compressor, write_report
+
+JSON_REPORT = {
+    "command": "lock",
+    "@user1:example.org": {"errors": [], "sessions": {"compat-sessions": []}},
+    "@user2:example.org": {"errors": [{"error": "Cannot lock"}], "sessions": {}},
+}
+
+
+def test_write_report_matches_json_dumps(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Force several flushes of the write buffer
+    monkeypatch.setattr(report, "WRITE_BUFFER_SIZE", 16)
+    compressor, extension, mime_type = get_compressor(None)
+    file = io.BytesIO()
+
+    write_report(JSON_REPORT, file, compressor)
+
+    assert extension == ""
+    assert mime_type is None
+    assert file.getvalue().decode() == json.dumps(JSON_REPORT, indent=2, sort_keys=True)
+
+
+def test_write_gzipped_json_lines_report() -> None:
+    compressor, extension, mime_type = get_compressor("gzip")
+    file = io.BytesIO()
+
+    write_report(JSON_REPORT, file, compressor, json_lines=True)
+
+    assert extension == ".gz"
+    assert mime_type == "application/gzip"
+    lines = gzip.decompress(file.getvalue()).decode().splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {key: JSON_REPORT[key]} for key in sorted(JSON_REPORT)
+    ]
@@ -0,0 +1,131 @@
+import asyncio
+from collections.abc import Mapping
+from typing import Any
+
+import pytest
+from matrix_bot.client import MatrixClient
+from matrix_bot.eventparser import MessageEventParser
+from nio import MatrixRoom, RoomMessage
+from typing_extensions import override
+
+from matrix_command_bot.scheduler import CommandScheduler
+from matrix_command_bot.simple_command import SimpleCommand
+from tests import (
+    USER1_ID,
+    create_fake_command_bot,
+    timeout,
+    wait_for_command_tasks,
+)
+
+
+class FirstCommand:
+    pass
+
+
+class SecondCommand:
+    pass
+
+
+@pytest.mark.asyncio
+async def test_scheduler_limits_and_order() -> None:
+    scheduler = CommandScheduler(2, {"FirstCommand": 1})
+    first, other_first, second, other_second = (
+        FirstCommand(),
+        FirstCommand(),
+        SecondCommand(),
+        SecondCommand(),
+    )
+
+    assert scheduler.try_acquire(first)
+    # Over the per command limit
+    assert not scheduler.try_acquire(other_first)
+    assert scheduler.try_acquire(second)
+    # Over the global limit
+    assert not scheduler.try_acquire(other_second)
+
+    other_first_task = asyncio.create_task(scheduler.acquire(other_first))
+    other_second_task = asyncio.create_task(scheduler.acquire(other_second))
+    await asyncio.sleep(0)
+    assert [s.command for s in scheduler.queued] == [other_first, other_second]
+
+    # other_first is still blocked by its class limit, other_second takes the slot
+    scheduler.release(second)
+    await asyncio.sleep(0)
+    assert other_second_task.done()
+    assert not other_first_task.done()
+
+    scheduler.release(other_second)
+    scheduler.release(first)
+    await asyncio.sleep(0)
+    assert other_first_task.done()
+    assert [s.command for s in scheduler.running] == [other_first]
+    assert not scheduler.queued
+
+
+@pytest.mark.asyncio
+async def test_cancelled_command_leaves_the_queue() -> None:
+    scheduler = CommandScheduler(1)
+    first, second = FirstCommand(), SecondCommand()
+
+    assert scheduler.try_acquire(first)
+    task = asyncio.create_task(scheduler.acquire(second))
+    await asyncio.sleep(0)
+    task.cancel()
+    await asyncio.sleep(0)
+
+    assert not scheduler.queued
+    scheduler.release(first)
+    assert not scheduler.running
+
+
+class BlockingTestCommand(SimpleCommand):
+    def __init__(
+        self,
+        room: MatrixRoom,
+        message: RoomMessage,
+        matrix_client: MatrixClient,
+        extra_config: Mapping[str, Any],
+    ) -> None:
+        event_parser = MessageEventParser(
+            room=room, event=message, matrix_client=matrix_client
+        )
+        event_parser.do_not_accept_own_message()
+        event_parser.command("test")
+
+        super().__init__(room, message, matrix_client, extra_config)
+
+    @override
+    async def simple_execute(self) -> bool:
+        await self.extra_config["unblock"].wait()
+        return True
+
+
+@pytest.mark.asyncio
+@timeout(5)
+async def test_queued_command_waits_for_a_slot() -> None:
+    unblock = asyncio.Event()
+    scheduler = CommandScheduler(max_running_per_command={"BlockingTestCommand": 1})
+    mocked_client, t = await create_fake_command_bot(
+        [BlockingTestCommand], scheduler=scheduler, unblock=unblock
+    )
+
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    for _ in range(2):
+        await mocked_client.fake_synced_text_message(
+            room, USER1_ID, "!test", wait_for_commands_execution=False
+        )
+    while len(scheduler.queued) < 1:
+        await asyncio.sleep(0.01)
+
+    assert len(scheduler.running) == 1
+    mocked_client.check_sent_reactions("🚀", "🚀", "⏳")
+
+    unblock.set()
+    await wait_for_command_tasks()
+
+    assert not scheduler.running
+    assert not scheduler.queued
+    mocked_client.check_sent_reactions("✅", "🚀", "✅")
+
+    t.cancel()
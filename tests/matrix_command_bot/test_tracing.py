@@ -0,0 +1,72 @@
+import json
+from pathlib import Path
+
+import pytest
+from nio import MatrixRoom
+from structlog.testing import capture_logs
+
+from matrix_command_bot.tracing import (
+    FileSpanExporter,
+    Span,
+    get_trace_id,
+    tracing_config,
+)
+from tests import USER1_ID, create_fake_command_bot
+from tests.matrix_command_bot.test_simple_command import SimpleTestCommand
+
+
+@pytest.mark.asyncio
+async def test_command_spans(tmp_path: Path) -> None:
+    trace_file = tmp_path / "traces.jsonl"
+    tracing_config.exporter = FileSpanExporter(str(trace_file))
+    try:
+        mocked_client, t = await create_fake_command_bot([SimpleTestCommand])
+        room = MatrixRoom("!roomid:example.org", USER1_ID)
+        with capture_logs() as logs:
+            await mocked_client.fake_synced_text_message(room, USER1_ID, "!test")
+        t.cancel()
+    finally:
+        tracing_config.exporter = None
+
+    span_logs = [log for log in logs if log["event"] == "Span ended"]
+    command_event_id = span_logs[0]["command_id"]
+    trace_id = get_trace_id(command_event_id)
+    assert [log["span"] for log in span_logs] == [
+        "ReactionStep",
+        "SimpleExecuteStep",
+        "ResultReactionStep",
+        "SimpleTestCommand",
+    ]
+    assert all(log["command_id"] == command_event_id for log in span_logs)
+    assert [log.get("step_index") for log in span_logs] == [0, 1, 2, None]
+    assert span_logs[1]["action"] == "CONTINUE"
+    assert span_logs[1]["ok"]
+
+    lines = trace_file.read_text().splitlines()
+    assert len(lines) == 1
+    resource_spans = json.loads(lines[0])["resourceSpans"][0]
+    *step_spans, command_span = resource_spans["scopeSpans"][0]["spans"]
+    assert len(step_spans) == 3
+    assert command_span["traceId"] == trace_id
+    for step_span in step_spans:
+        assert step_span["traceId"] == trace_id
+        assert step_span["parentSpanId"] == command_span["spanId"]
+    assert "parentSpanId" not in command_span
+    assert command_span["status"] == {"code": 1}
+    assert int(step_span["endTimeUnixNano"]) >= int(step_span["startTimeUnixNano"])
+
+
+@pytest.mark.asyncio
+async def test_pending_spans_are_capped(tmp_path: Path) -> None:
+    trace_file = tmp_path / "traces.jsonl"
+    exporter = FileSpanExporter(str(trace_file), max_pending=2)
+    for name in ("first", "second", "third"):
+        exporter.export(Span(name, get_trace_id("$command")))
+
+    with capture_logs() as logs:
+        await exporter.flush()
+
+    assert logs[0]["event"] == "1 spans dropped before being written"
+    spans = json.loads(trace_file.read_text())["resourceSpans"][0]["scopeSpans"][0]
+    assert [span["name"] for span in spans["spans"]] == ["second", "third"]
+    assert not exporter.pending
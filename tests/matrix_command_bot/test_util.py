@@ -0,0 +1,49 @@
+from collections.abc import AsyncIterator
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+
+from matrix_command_bot.util import is_email, is_user_id, iter_file_lines
+
+
+def test_user_id_and_email_checks() -> None:
+    assert is_user_id("@john.doe:example.org")
+    assert not is_user_id("@john.doe")
+    assert not is_user_id("john.doe@example.org")
+
+    assert is_email("john.doe@example.org")
+    assert not is_email("@john.doe:example.org")
+    assert not is_email("@")
+    assert not is_email("john.doe@")
+    assert not is_email("@example.org")
+
+
+@pytest.mark.asyncio
+async def test_iter_file_lines_with_a_long_line() -> None:
+    # Longer than the line limit of aiohttp
+    user_ids = ",".join(f"@user{i}:example.org" for i in range(10000))
+
+    async def file_content() -> AsyncIterator[bytes]:
+        data = f"user_id\n{user_ids}".encode()
+        for i in range(0, len(data), 1000):
+            yield data[i : i + 1000]
+
+    release = Mock()
+    matrix_client = Mock(
+        access_token="token",  # noqa: S106
+        send=AsyncMock(
+            return_value=Mock(
+                ok=True,
+                content=Mock(iter_chunked=Mock(return_value=file_content())),
+                release=release,
+            )
+        ),
+    )
+
+    lines = [
+        line async for line in iter_file_lines(matrix_client, "mxc://example.org/file")
+    ]
+
+    assert lines == ["user_id", user_ids]
+    assert "/media/download/example.org/file" in matrix_client.send.await_args[0][1]
+    release.assert_called_once()
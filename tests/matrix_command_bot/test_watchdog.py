@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import pytest
+from nio import MatrixRoom
+from structlog.testing import capture_logs
+
+from matrix_admin_bot.adminbot import get_command_list
+from matrix_command_bot.watchdog import LoopWatchdog, event_loop_blocked_total
+from tests import USER1_ID, create_fake_admin_bot
+
+
+def blocking_call() -> None:
+    time.sleep(0.3)
+
+
+async def blocking_coroutine() -> None:
+    blocking_call()
+
+
+@pytest.mark.asyncio
+async def test_blocking_call_is_reported() -> None:
+    watchdog = LoopWatchdog(threshold=0.1)
+    monitor = asyncio.create_task(watchdog.run())
+    await asyncio.sleep(0.05)
+
+    with capture_logs() as logs:
+        await asyncio.create_task(blocking_coroutine())
+        await asyncio.sleep(0.05)
+    monitor.cancel()
+
+    assert watchdog.blocked == 1
+    blocked_log = next(log for log in logs if log["event"] == "Event loop blocked")
+    assert blocked_log["log_level"] == "warning"
+    assert blocked_log["coroutine"] == "blocking_coroutine"
+    assert "in blocking_call" in blocked_log["stack"]
+    assert "time.sleep" in blocked_log["stack"]
+    assert any(log["event"] == "Event loop unblocked" for log in logs)
+
+
+@pytest.mark.asyncio
+async def test_commands_do_not_block_the_loop() -> None:
+    blocked_before = event_loop_blocked_total.values.get((), 0)
+    mocked_client, _, t = await create_fake_admin_bot(blocked_loop_threshold=0.1)
+    room = MatrixRoom("!roomid:example.org", USER1_ID)
+
+    await mocked_client.fake_synced_text_message(room, USER1_ID, "!help")
+    for command in get_command_list():
+        await mocked_client.fake_synced_text_message(
+            room, USER1_ID, f"!{command.KEYWORD} help"
+        )
+    await asyncio.sleep(0.1)
+
+    assert event_loop_blocked_total.values.get((), 0) == blocked_before
+    t.cancel()
@@ -0,0 +1,212 @@
+import asyncio
+from typing import Any
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from nio import GetOpenIDTokenResponse
+
+from matrix_command_bot.command import ICommand
+from tchap_admin_bot.tchapadminbot import (
+    TchapAdminBot,
+    TchapAdminBotConfig,
+    hash_email,
+)
+from tests import MatrixClientMock
+
+
+class FakeIdentityServer:
+    def __init__(self, accounts: dict[str, str]) -> None:
+        self.accounts = accounts
+        self.pepper = "pepper"
+        self.lookups: list[list[str]] = []
+        self.hash_details_calls = 0
+        self.running = 0
+        self.max_running = 0
+        self.token: str | None = None
+        self.registrations = 0
+        self.rejected: list[Mock] = []
+
+    def reject(self) -> Mock:
+        res = Mock(ok=False, status=401)
+        self.rejected.append(res)
+        return res
+
+    def is_authorized(self, kwargs: dict[str, Any]) -> bool:
+        authorization = kwargs.get("headers", {}).get("Authorization")
+        return self.token is not None and authorization == f"Bearer {self.token}"
+
+    async def get(self, url: str, **kwargs: Any) -> Mock:
+        assert url.endswith("/hash_details")
+        if not self.is_authorized(kwargs):
+            return self.reject()
+        self.hash_details_calls += 1
+        return Mock(
+            ok=True, json=AsyncMock(return_value={"lookup_pepper": self.pepper})
+        )
+
+    async def post(self, url: str, **kwargs: Any) -> Mock:
+        if url.endswith("/account/register"):
+            await asyncio.sleep(0.01)
+            self.registrations += 1
+            self.token = f"token{self.registrations}"
+            return Mock(ok=True, json=AsyncMock(return_value={"token": self.token}))
+        if not self.is_authorized(kwargs):
+            return self.reject()
+        body = kwargs["json"]
+        if body["pepper"] != self.pepper:
+            return Mock(
+                ok=False,
+                status=400,
+                json=AsyncMock(
+                    return_value={
+                        "errcode": "M_INVALID_PEPPER",
+                        "algorithm": "sha256",
+                        "lookup_pepper": self.pepper,
+                    }
+                ),
+            )
+        self.lookups.append(body["addresses"])
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        mappings = {
+            hash_email(email, self.pepper): mxid
+            for email, mxid in self.accounts.items()
+            if hash_email(email, self.pepper) in body["addresses"]
+        }
+        return Mock(ok=True, json=AsyncMock(return_value={"mappings": mappings}))
+
+
+def create_bot(identity_server: FakeIdentityServer, **config: Any) -> TchapAdminBot:
+    bot = TchapAdminBot(
+        TchapAdminBotConfig(
+            homeserver="http://localhost:8008",
+            bot_username="",
+            bot_password="",
+            mas_base_url="",
+            mas_access_token="",
+            allowed_room_ids=[],
+            totps={},
+            **config,
+        )
+    )
+    matrix_client = MatrixClientMock()
+    matrix_client.client_session = Mock(  # pyright: ignore[reportAttributeAccessIssue]
+        get=identity_server.get, post=identity_server.post
+    )
+    matrix_client.get_openid_token = AsyncMock(  # pyright: ignore[reportAttributeAccessIssue]
+        return_value=GetOpenIDTokenResponse.from_dict(
+            {
+                "token_type": "Bearer",
+                "matrix_server_name": "example.org",
+                "expires_in": 3600,
+                "access_token": "openid_access_token",
+            }
+        )
+    )
+    bot.matrix_client = matrix_client  # pyright: ignore[reportAttributeAccessIssue]
+    return bot
+
+
+@pytest.mark.asyncio
+async def test_lookups_are_cached() -> None:
+    identity_server = FakeIdentityServer({"user@example.org": "@user:example.org"})
+    bot = create_bot(identity_server)
+    cmd_input = ["user@example.org", "unknown@example.org", "@other:example.org"]
+
+    for _ in range(3):
+        assert await bot.transform_cmd_input(ICommand, cmd_input) == [
+            "@user:example.org",
+            "unknown@example.org",
+            "@other:example.org",
+        ]
+
+    # The email without account is not looked up again either
+    assert len(identity_server.lookups) == 1
+    assert identity_server.hash_details_calls == 1
+    stats = bot.get_cache_stats()["identity_lookups"]
+    assert stats["hits"] == 4
+    assert stats["misses"] == 2
+
+
+@pytest.mark.asyncio
+async def test_pepper_rotation() -> None:
+    identity_server = FakeIdentityServer({"user@example.org": "@user:example.org"})
+    bot = create_bot(identity_server)
+
+    await bot.transform_cmd_input(ICommand, ["user@example.org"])
+    identity_server.pepper = "new_pepper"
+    identity_server.accounts["user@example.org"] = "@renamed:example.org"
+
+    # The cached result is used until a lookup reveals the new pepper
+    cmd_input = ["user@example.org", "new@example.org"]
+    assert await bot.transform_cmd_input(ICommand, cmd_input) == [
+        "@renamed:example.org",
+        "new@example.org",
+    ]
+    assert bot.hash_pepper == "new_pepper"
+    # The rejected lookup is not recorded
+    assert identity_server.lookups[1:] == [
+        [hash_email(email, "new_pepper") for email in cmd_input]
+    ]
+
+
+@pytest.mark.asyncio
+async def test_lookup_in_chunks() -> None:
+    emails = [f"user{i}@example.org" for i in range(2500)]
+    identity_server = FakeIdentityServer(
+        {email: f"@user{i}:example.org" for i, email in enumerate(emails) if i % 2}
+    )
+    bot = create_bot(
+        identity_server, identity_lookup_chunk_size=1000, identity_lookup_nb_workers=2
+    )
+    cmd_input = [*reversed(emails), "@other:example.org", emails[0]]
+
+    result = await bot.transform_cmd_input(ICommand, cmd_input)
+
+    assert result == [
+        identity_server.accounts.get(user_id, user_id) for user_id in cmd_input
+    ]
+    assert [len(addresses) for addresses in identity_server.lookups] == [
+        1000,
+        1000,
+        500,
+    ]
+    assert identity_server.max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_expired_token_is_refreshed_once() -> None:
+    identity_server = FakeIdentityServer({"user@example.org": "@user:example.org"})
+    bot = create_bot(identity_server)
+    await bot.transform_cmd_input(ICommand, ["user@example.org"])
+    assert identity_server.registrations == 1
+
+    # The token expires while a burst of commands comes in
+    identity_server.token = None
+    results = await asyncio.gather(
+        *[
+            bot.transform_cmd_input(ICommand, [f"user{i}@example.org"])
+            for i in range(10)
+        ]
+    )
+
+    assert results == [[f"user{i}@example.org"] for i in range(10)]
+    assert identity_server.registrations == 2
+    assert bot.identity_server_access_token == "token2"
+    # The rejected responses are released before retrying
+    assert identity_server.rejected
+    for res in identity_server.rejected:
+        res.release.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_token_lifetime() -> None:
+    identity_server = FakeIdentityServer({})
+    bot = create_bot(identity_server, identity_server_token_lifetime=60)
+    assert await bot.get_identity_server_access_token() == "token1"
+    assert await bot.get_identity_server_access_token() == "token1"
+
+    bot.identity_server_token_expiry = 0
+    assert await bot.get_identity_server_access_token() == "token2"
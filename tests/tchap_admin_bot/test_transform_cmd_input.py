@@ -52,7 +52,7 @@ async def test_mail_address() -> None:  # noqa: C901
     mocked_matrix_client.send = AsyncMock(
         return_value=Mock(ok=True, json=AsyncMock(return_value={}))
     )
-    mock_admin_client.session.request.side_effect = Mock(
+    mock_admin_client.session.request.side_effect = AsyncMock(
         side_effect=request_side_effect
     )
 